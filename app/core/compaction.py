@@ -0,0 +1,222 @@
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import List
+from dotenv import load_dotenv
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.database import SessionLocal
+from app.models import Bottle, BottleCompaction
+from app.core.partitions import bottle_partitions
+from app.core.rollup import rebuild_daily_rollup
+
+# Load environment variables from the .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# The compaction job is off unless explicitly enabled
+COMPACTION_ENABLED = os.getenv("BOTTLE_COMPACTION_ENABLED", "false").lower() == "true"
+COMPACT_AFTER_DAYS = int(os.getenv("BOTTLE_COMPACT_AFTER_DAYS", 90))  # Raw rows older than this are compacted
+ARCHIVE_DIRECTORY = os.getenv("BOTTLE_ARCHIVE_DIRECTORY", "archive/bottles")
+COMPACT_DELETE_BATCH = int(os.getenv("BOTTLE_COMPACT_DELETE_BATCH", 5000))  # Rows deleted per transaction
+COMPACTION_INTERVAL_SECONDS = int(os.getenv("BOTTLE_COMPACTION_INTERVAL_SECONDS", 86400))
+
+ARCHIVE_COLUMNS = [column.name for column in Bottle.__table__.columns]
+
+
+class BottleCompactor:
+    """
+    Compacts raw bottle rows older than after_days, one local day (Bottle.local_date)
+    at a time and oldest first:
+
+    1. the day's bottle_daily_rollup entries are recomputed from its raw rows, so the
+       rollup is known to be exact before the rows go away;
+    2. the raw rows are written to a gzip CSV file under the archive directory,
+       <directory>/YYYY/MM/YYYY-MM-DD.<run>.csv.gz, and fsynced;
+    3. the archived rows are deleted in batches of delete_batch, one transaction each;
+    4. the day is recorded in bottle_compactions.
+
+    The dashboards read bottle_daily_rollup, which ingestion keeps current for live
+    rows and which holds the only totals of compacted days, so they stay correct.
+    Readings arriving late for a compacted day are added to the rollup as usual and
+    archived by the next run. An interrupted run leaves its archive file behind; the
+    next run archives the remaining rows again, so archive files may overlap and
+    should be de-duplicated by id.
+    """
+
+    def __init__(self, enabled: bool, after_days: int, directory: str, delete_batch: int, interval_seconds: int):
+        self.enabled = enabled
+        self.after_days = after_days
+        self.directory = directory
+        self.delete_batch = delete_batch
+        self.interval_seconds = interval_seconds
+        self._task = None
+
+        # Metrics
+        self.runs = 0
+        self.failed_runs = 0
+        self.days_compacted = 0
+        self.rows_archived = 0
+        self.last_run_seconds = 0.0
+
+    def _days_before(self, db: Session, cutoff: date) -> List[date]:
+        """Local days before cutoff that still have raw rows."""
+        days = set()
+        for bottles in bottle_partitions.tables(db):
+            days.update(
+                db.execute(
+                    select(bottles.c.local_date).where(bottles.c.local_date < cutoff).group_by(bottles.c.local_date)
+                ).scalars()
+            )
+        return sorted(days)
+
+    @staticmethod
+    def _day_filter(bottles, day: date):
+        """
+        Rows of a local day. The UTC created_at bounds around it (a local day starts at
+        most a day before or after the UTC one) let partitioned tables prune.
+        """
+        start = datetime.combine(day, datetime.min.time())
+        return (
+            bottles.c.local_date == day,
+            bottles.c.created_at >= start - timedelta(days=1),
+            bottles.c.created_at < start + timedelta(days=2),
+        )
+
+    def _archive(self, db: Session, day: date):
+        """Write the day's raw rows to a new archive file. Returns (path, ids per table)."""
+        folder = os.path.join(self.directory, f"{day:%Y}", f"{day:%m}")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{day.isoformat()}.{time.time_ns()}.csv.gz")
+        partial = path + ".part"
+
+        ids = []
+        with open(partial, "wb") as raw:
+            with io.TextIOWrapper(gzip.GzipFile(fileobj=raw, mode="wb"), encoding="utf-8", newline="") as archive:
+                writer = csv.writer(archive)
+                writer.writerow(ARCHIVE_COLUMNS)
+                for bottles in bottle_partitions.tables(db):
+                    table_ids = []
+                    rows = db.execute(
+                        select(*[bottles.c[name] for name in ARCHIVE_COLUMNS])
+                        .where(*self._day_filter(bottles, day))
+                        .order_by(bottles.c.id)
+                        .execution_options(yield_per=self.delete_batch)
+                    )
+                    for row in rows:
+                        writer.writerow(row)
+                        table_ids.append(row.id)
+                    if table_ids:
+                        ids.append((bottles, table_ids))
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(partial, path)
+        return path, ids
+
+    def compact_day(self, db: Session, day: date) -> int:
+        """Archive and delete the raw rows of one local day. Returns the number of rows archived."""
+        # Days compacted before (late readings) are not rebuilt: the rollup is their only record
+        if db.get(BottleCompaction, day) is None:
+            rebuild_daily_rollup(db, day, day + timedelta(days=1))
+
+        path, ids = self._archive(db, day)
+        archived = sum(len(table_ids) for _, table_ids in ids)
+
+        try:
+            for bottles, table_ids in ids:
+                for offset in range(0, len(table_ids), self.delete_batch):
+                    batch = table_ids[offset:offset + self.delete_batch]
+                    db.execute(delete(bottles).where(bottles.c.id.in_(batch), *self._day_filter(bottles, day)))
+                    db.commit()
+
+            record = db.get(BottleCompaction, day)
+            if record is None:
+                record = BottleCompaction(day=day, rows_archived=0)
+                db.add(record)
+            record.rows_archived += archived
+            record.archive_path = path
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        logger.info("Compacted %d bottle rows of %s into %s", archived, day, path)
+        return archived
+
+    def run_once(self, today: date = None) -> int:
+        """Compact every day older than after_days. Returns the number of rows archived."""
+        cutoff = (today or date.today()) - timedelta(days=self.after_days)
+        started = time.perf_counter()
+        archived = 0
+        db = SessionLocal()
+        try:
+            for day in self._days_before(db, cutoff):
+                rows = self.compact_day(db, day)
+                archived += rows
+                self.days_compacted += 1
+                self.rows_archived += rows
+            self.runs += 1
+        except Exception:
+            self.failed_runs += 1
+            logger.exception("Bottle compaction failed, retrying on the next run")
+        finally:
+            db.close()
+        self.last_run_seconds = time.perf_counter() - started
+        return archived
+
+    async def _run(self):
+        while True:
+            await run_in_threadpool(self.run_once)
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        """Start compacting periodically on the running event loop."""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def metrics(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "compact_after_days": self.after_days,
+            "runs": self.runs,
+            "failed_runs": self.failed_runs,
+            "days_compacted": self.days_compacted,
+            "rows_archived": self.rows_archived,
+            "last_run_ms": round(self.last_run_seconds * 1000, 3),
+        }
+
+
+compactor = BottleCompactor(
+    enabled=COMPACTION_ENABLED,
+    after_days=COMPACT_AFTER_DAYS,
+    directory=ARCHIVE_DIRECTORY,
+    delete_batch=COMPACT_DELETE_BATCH,
+    interval_seconds=COMPACTION_INTERVAL_SECONDS,
+)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Archive and delete raw bottle rows older than the configured age.")
+    parser.add_argument("--days", type=int, default=COMPACT_AFTER_DAYS, help="Compact raw rows older than this many days")
+    args = parser.parse_args()
+
+    compactor.after_days = args.days
+    print(f"Archived {compactor.run_once()} bottle rows")
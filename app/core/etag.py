@@ -0,0 +1,90 @@
+import hashlib
+from typing import Optional
+from fastapi import Request, Response
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.models import Business, BottleCompaction, Machine, TableVersion, User
+from app.core.partitions import bottle_partitions
+
+# Tables whose version stamp is (row count, newest updated_at, write counter)
+STAMPED_MODELS = {"businesses": Business, "machines": Machine, "users": User}
+
+
+def bump_version(db: Session, *names: str):
+    """
+    Count a write to the given tables ("businesses", "machines", "users") in the caller's
+    transaction, so every worker sees the new stamp as soon as the write commits. Catches
+    changes a timestamp with the same (one-second on MySQL) resolution as the previous
+    newest one would hide. Call before committing the write.
+    """
+    versions = TableVersion.__table__
+    for name in sorted(set(names)):  # Same lock order in every transaction
+        bumped = db.execute(update(versions).where(versions.c.name == name).values(version=versions.c.version + 1))
+        if bumped.rowcount:
+            continue
+        try:
+            with db.begin_nested():
+                db.execute(insert(versions).values(name=name, version=1))
+        except IntegrityError:
+            # Another worker created the counter first
+            db.execute(update(versions).where(versions.c.name == name).values(version=versions.c.version + 1))
+
+
+def version_stamp(db: Session, *names: str) -> tuple:
+    """
+    Cheap stamp of the current contents of the given tables, read in one statement
+    from indexes only. "bottles" is stamped by its lowest and highest id (inserts,
+    retention and compaction) and the compaction log; the other tables by their row
+    count, newest updated_at and write counter (table_versions). Identical on every
+    worker for identical contents.
+    """
+    columns = []
+    for name in names:
+        if name == "bottles":
+            for bottles in bottle_partitions.tables(db):
+                columns.append(select(func.min(bottles.c.id)).scalar_subquery())
+                columns.append(select(func.max(bottles.c.id)).scalar_subquery())
+            columns.append(select(func.count(BottleCompaction.day)).scalar_subquery())
+            columns.append(select(func.max(BottleCompaction.compacted_at)).scalar_subquery())
+        else:
+            model = STAMPED_MODELS[name]
+            columns.append(select(func.count(model.id)).scalar_subquery())
+            columns.append(select(func.max(model.updated_at)).scalar_subquery())
+            columns.append(select(TableVersion.version).where(TableVersion.name == name).scalar_subquery())
+
+    return tuple(db.execute(select(*columns)).one())
+
+
+def make_etag(*parts) -> str:
+    """Weak ETag of a response determined by parts (endpoint, parameters, version stamps)."""
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(request: Optional[Request], etag: str) -> bool:
+    """Whether the request's If-None-Match already names etag."""
+    if request is None:
+        return False
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison: W/ prefixes are ignored on both sides
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == wanted:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+def set_etag(response: Optional[Response], etag: str):
+    """Attach etag to the response FastAPI sends for a returned model or dict."""
+    if response is not None:
+        response.headers["ETag"] = etag
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, case, update
+from starlette.concurrency import run_in_threadpool
+from app.database import SessionLocal
+from app.models import Machine
+
+# Load environment variables from the .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_ONLINE_SECONDS = int(os.getenv("HEARTBEAT_ONLINE_SECONDS", 120))  # Seen within this window: online
+HEARTBEAT_STALE_SECONDS = int(os.getenv("HEARTBEAT_STALE_SECONDS", 900))  # ...within this one: stale, else offline
+HEARTBEAT_FLUSH_SECONDS = int(os.getenv("HEARTBEAT_FLUSH_SECONDS", 30))  # How often last-seen times are written
+
+
+class FleetHeartbeats:
+    """
+    In-memory last-seen table for every machine, keyed by Machine.id.
+
+    Heartbeats only update memory. A background task periodically writes the
+    changed timestamps to machines.last_seen_at in one bulk UPDATE and reloads the
+    table, which also merges heartbeats received by other worker processes.
+    """
+
+    def __init__(self, online_seconds: int, stale_seconds: int, flush_seconds: int):
+        self.online = timedelta(seconds=online_seconds)
+        self.stale = timedelta(seconds=stale_seconds)
+        self.flush_seconds = flush_seconds
+
+        self._lock = threading.Lock()
+        self._machines: Dict[int, list] = {}  # machine_id -> [business_id, last_seen_at (UTC) or None]
+        self._pending: Dict[int, datetime] = {}  # machine_id -> last_seen_at not yet written
+        self._task = None
+
+        # Metrics
+        self.heartbeats = 0
+        self.flushed = 0
+
+    def load(self):
+        """Reload every machine's business and last-seen time from the database."""
+        db = SessionLocal()
+        try:
+            rows = db.query(Machine.id, Machine.business_id, Machine.last_seen_at).all()
+        finally:
+            db.close()
+
+        with self._lock:
+            machines = {}
+            for machine_id, business_id, last_seen_at in rows:
+                # Keep newer, not yet persisted heartbeats received by this process
+                pending = self._pending.get(machine_id)
+                if pending is not None and (last_seen_at is None or pending > last_seen_at):
+                    last_seen_at = pending
+                machines[machine_id] = [business_id, last_seen_at]
+            self._machines = machines
+
+    def beat(self, machine_id: int, business_id: int, seen_at: datetime = None):
+        seen_at = seen_at or datetime.utcnow()
+        with self._lock:
+            self._machines[machine_id] = [business_id, seen_at]
+            self._pending[machine_id] = seen_at
+            self.heartbeats += 1
+
+    def register(self, machine_id: int, business_id: int):
+        """Track a new machine, or one that moved to another business."""
+        with self._lock:
+            entry = self._machines.setdefault(machine_id, [business_id, None])
+            entry[0] = business_id
+
+    def forget(self, machine_id: int):
+        with self._lock:
+            self._machines.pop(machine_id, None)
+            self._pending.pop(machine_id, None)
+
+    def flush(self) -> int:
+        """Write pending last-seen times in one bulk UPDATE. Returns the number of machines written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        machines = Machine.__table__
+        seen_at = bindparam("seen_at")
+        stmt = (
+            update(machines)
+            .where(machines.c.id == bindparam("machine_id"))
+            # Never move last_seen_at backwards if another worker wrote a newer time
+            .values(last_seen_at=case(
+                (machines.c.last_seen_at.is_(None), seen_at),
+                (machines.c.last_seen_at < seen_at, seen_at),
+                else_=machines.c.last_seen_at,
+            ), updated_at=machines.c.updated_at)  # A heartbeat is not an edit of the machine
+        )
+
+        db = SessionLocal()
+        try:
+            db.connection().execute(stmt, [{"machine_id": machine_id, "seen_at": at} for machine_id, at in pending.items()])
+            db.commit()
+        except Exception:
+            db.rollback()
+            # Keep the timestamps for the next flush unless newer ones arrived meanwhile
+            with self._lock:
+                for machine_id, at in pending.items():
+                    if machine_id in self._machines:
+                        self._pending.setdefault(machine_id, at)
+            raise
+        finally:
+            db.close()
+
+        self.flushed += len(pending)
+        return len(pending)
+
+    def classify(self, last_seen_at: Optional[datetime], now: datetime) -> str:
+        if last_seen_at is None or now - last_seen_at > self.stale:
+            return "offline"
+        if now - last_seen_at > self.online:
+            return "stale"
+        return "online"
+
+    def fleet_status(self, business_id: int = None) -> dict:
+        """Online, stale and offline machines per business, served from memory."""
+        now = datetime.utcnow()
+        with self._lock:
+            machines = list(self._machines.items())
+
+        businesses = {}
+        for machine_id, (machine_business_id, last_seen_at) in sorted(machines):
+            if business_id is not None and machine_business_id != business_id:
+                continue
+            status = businesses.setdefault(machine_business_id, {"online": [], "stale": [], "offline": []})
+            status[self.classify(last_seen_at, now)].append({
+                "machine_id": machine_id,
+                "last_seen_at": last_seen_at.isoformat() if last_seen_at else None,
+            })
+        return businesses
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await run_in_threadpool(self.flush)
+                await run_in_threadpool(self.load)
+            except Exception:
+                logger.exception("Flushing machine heartbeats failed")
+
+    def start(self):
+        """Load the fleet and start the periodic flush on the running event loop."""
+        if self._task is None:
+            self.load()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the periodic flush and write out the remaining heartbeats."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await run_in_threadpool(self.flush)
+        except Exception:
+            logger.exception("Flushing machine heartbeats on shutdown failed")
+
+
+heartbeats = FleetHeartbeats(HEARTBEAT_ONLINE_SECONDS, HEARTBEAT_STALE_SECONDS, HEARTBEAT_FLUSH_SECONDS)
@@ -0,0 +1,478 @@
+from datetime import date, datetime, timezone
+from typing import AsyncIterator, Dict, Iterable, List, Tuple
+from sqlalchemy import bindparam, delete, insert, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session
+from app.models import Machine, Bottle, BottleEventKey, Business, DEFAULT_BUSINESS_TIMEZONE
+from app.core.cache import TTLCache
+from app.core.rollup import upsert_daily_rollup
+from app.core.partitions import bottle_partitions
+from app.core.totals import running_totals
+from dotenv import load_dotenv
+import json
+import math
+import os
+import struct
+import zlib
+import pytz
+
+# Load environment variables from the .env file
+load_dotenv()
+
+
+# Upper bound on rows rendered into a single INSERT ... VALUES statement.
+# Keeps us well below the bind-parameter limits of SQLite and MySQL.
+INSERT_CHUNK_SIZE = 500
+
+# Compact wire format for machine uploads (Content-Type: application/octet-stream):
+#   1 byte  format version (1 or 2)
+#   N fixed-width little-endian records of
+#       uint32  machine_id
+#       uint16  bottle_count
+#       float32 bottle_weight
+#       uint32  unix timestamp in seconds (0 = use the server time)
+#       uint32  event sequence number (version 2 only, see Bottle.event_seq)
+PACKED_RECORDS = {
+    1: struct.Struct("<IHfI"),
+    2: struct.Struct("<IHfII"),
+}
+PACKED_FORMAT_VERSION = 2
+
+# Readings stamped further than this in the future are rejected
+MAX_CLOCK_SKEW_SECONDS = 300
+
+# Longest accepted line of an NDJSON upload; a reading is well below 200 bytes
+MAX_NDJSON_LINE_BYTES = 64 * 1024
+
+# machine_id -> business_id for the ingestion hot path. Machine routes invalidate
+# entries on create/update/delete; the TTL bounds staleness across worker processes.
+machine_cache = TTLCache(
+    max_size=int(os.getenv("MACHINE_CACHE_SIZE", 10000)),
+    ttl_seconds=float(os.getenv("MACHINE_CACHE_TTL", 300)),
+)
+
+# (machine_id, event_seq) of recently stored events, so most retries are answered
+# without touching the database. The unique index on bottles remains the authority.
+recent_events = TTLCache(
+    max_size=int(os.getenv("RECENT_EVENT_CACHE_SIZE", 50000)),
+    ttl_seconds=float(os.getenv("RECENT_EVENT_CACHE_TTL", 3600)),
+)
+
+# business_id -> timezone name, used to derive each bottle row's local_date. Business
+# routes invalidate entries when a business changes its timezone.
+business_timezones = TTLCache(
+    max_size=int(os.getenv("BUSINESS_TIMEZONE_CACHE_SIZE", 10000)),
+    ttl_seconds=float(os.getenv("BUSINESS_TIMEZONE_CACHE_TTL", 300)),
+)
+
+
+def get_machine_business_ids(db: Session, machine_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    Map every known machine id to its business id. Cached machines are answered
+    from machine_cache and the rest are resolved with a single SELECT.
+    Unknown machine ids are simply missing from the result.
+    """
+    business_ids = {}
+    missing = set()
+    for machine_id in set(machine_ids):
+        business_id = machine_cache.get(machine_id)
+        if business_id is None:
+            missing.add(machine_id)
+        else:
+            business_ids[machine_id] = business_id
+
+    if missing:
+        rows = (
+            db.query(Machine.id, Machine.business_id)
+            .filter(Machine.id.in_(missing))
+            .all()
+        )
+        for machine_id, business_id in rows:
+            machine_cache.set(machine_id, business_id)
+            business_ids[machine_id] = business_id
+
+    return business_ids
+
+
+def get_business_timezones(db: Session, business_ids: Iterable[int]) -> Dict[int, str]:
+    """
+    Map business ids to their timezone names, from business_timezones or a single SELECT.
+    """
+    timezones = {}
+    missing = set()
+    for business_id in set(business_ids):
+        name = business_timezones.get(business_id)
+        if name is None:
+            missing.add(business_id)
+        else:
+            timezones[business_id] = name
+
+    if missing:
+        rows = db.query(Business.id, Business.timezone).filter(Business.id.in_(missing)).all()
+        for business_id, name in rows:
+            name = name or DEFAULT_BUSINESS_TIMEZONE
+            business_timezones.set(business_id, name)
+            timezones[business_id] = name
+
+    return timezones
+
+
+def to_utc(moment: datetime) -> datetime:
+    """
+    Convert to naive UTC, the form bottle timestamps are stored in.
+    Naive values are taken to be UTC already.
+    """
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def local_date(created_at: datetime, timezone_name: str) -> date:
+    """The calendar day a naive UTC timestamp falls on in the given timezone."""
+    return pytz.utc.localize(created_at).astimezone(pytz.timezone(timezone_name)).date()
+
+
+def assign_local_dates(db: Session, rows: List[dict]):
+    """
+    Fill in the local_date of rows that have none: the day their created_at falls on
+    in the timezone of the machine's business.
+    """
+    pending = [row for row in rows if row.get("local_date") is None]
+    if not pending:
+        return
+
+    business_ids = get_machine_business_ids(db, (row["machine_id"] for row in pending))
+    timezones = get_business_timezones(db, business_ids.values())
+    for row in pending:
+        name = timezones.get(business_ids.get(row["machine_id"]), DEFAULT_BUSINESS_TIMEZONE)
+        row["local_date"] = local_date(row["created_at"], name)
+
+
+def build_bottle_row(machine_id: int, bottle_count: int, bottle_weight: float, business_id: int, created_at: datetime = None, event_seq: int = None) -> dict:
+    """
+    Build the column values for one bottle reading, the same way create_bottle does.
+    created_at is stored as naive UTC; local_date is filled in when the row is inserted.
+    """
+    created_at = to_utc(created_at) if created_at else datetime.utcnow()
+    return {
+        "machine_id": machine_id,
+        "bottle_count": bottle_count,
+        "bottle_weight": bottle_weight,
+        "event_seq": event_seq,
+        "local_date": None,
+        "created_by": business_id,  # Use the business_id from the machine
+        "updated_by": business_id,
+        "created_at": created_at,
+        "updated_at": created_at,
+    }
+
+
+def is_recent_event(machine_id: int, event_seq: int) -> bool:
+    """Whether this client event is known to be stored already."""
+    return event_seq is not None and recent_events.get((machine_id, event_seq)) is not None
+
+
+def _insert_ignoring_duplicates(db: Session, rows: List[dict]) -> List[dict]:
+    """
+    Insert rows carrying an event_seq, skipping those whose (machine_id, event_seq)
+    already exists. Duplicates are detected by the INSERT itself, never by a SELECT.
+    """
+    table = Bottle.__table__
+    dialect = db.get_bind().dialect.name
+    inserted = []
+
+    if dialect == "postgresql" and bottle_partitions.partitioned:
+        # Partitioned bottles cannot carry the unique index; claim the keys in
+        # bottle_event_keys first and insert only the rows whose key was new
+        keys = BottleEventKey.__table__
+        for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+            chunk = rows[start:start + INSERT_CHUNK_SIZE]
+            stmt = (
+                postgresql.insert(keys)
+                .values([
+                    {"machine_id": row["machine_id"], "event_seq": row["event_seq"], "created_at": row["created_at"]}
+                    for row in chunk
+                ])
+                .on_conflict_do_nothing()
+                .returning(keys.c.machine_id, keys.c.event_seq)
+            )
+            new_keys = {tuple(key) for key in db.execute(stmt)}
+            new_rows = [row for row in chunk if (row["machine_id"], row["event_seq"]) in new_keys]
+            if new_rows:
+                db.execute(insert(table).values(new_rows))
+            inserted.extend(new_rows)
+    elif dialect in ("postgresql", "sqlite"):
+        # INSERT ... ON CONFLICT DO NOTHING RETURNING tells us which rows were new
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+            chunk = rows[start:start + INSERT_CHUNK_SIZE]
+            stmt = (
+                dialect_insert(table)
+                .values(chunk)
+                .on_conflict_do_nothing(index_elements=["machine_id", "event_seq"])
+                .returning(table.c.machine_id, table.c.event_seq)
+            )
+            new_keys = {tuple(key) for key in db.execute(stmt)}
+            if dialect == "sqlite" and new_keys:
+                # Keys of rows moved into SQLite month tables live on in bottle_event_keys. Checked
+                # after the INSERT: it holds the write lock, so no month can be moved in between
+                keys = BottleEventKey.__table__
+                moved = {
+                    tuple(key) for key in db.execute(
+                        select(keys.c.machine_id, keys.c.event_seq)
+                        .where(tuple_(keys.c.machine_id, keys.c.event_seq).in_(list(new_keys)))
+                    )
+                }
+                if moved:
+                    db.execute(delete(table).where(tuple_(table.c.machine_id, table.c.event_seq).in_(list(moved))))
+                    new_keys -= moved
+            inserted.extend(row for row in chunk if (row["machine_id"], row["event_seq"]) in new_keys)
+    else:
+        # MySQL has no RETURNING, and neither INSERT IGNORE (which also downgrades FK and
+        # truncation errors to warnings) nor ON DUPLICATE KEY UPDATE tells which rows
+        # were new. Insert each chunk with one plain multi-row INSERT; only when it hits
+        # a duplicate key, read back which keys exist and insert the rest again.
+        for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+            chunk = rows[start:start + INSERT_CHUNK_SIZE]
+            while chunk:
+                try:
+                    with db.begin_nested():
+                        db.execute(insert(table).values(chunk))
+                except IntegrityError as e:
+                    if not _is_duplicate_key(e):
+                        raise
+                    existing = {
+                        tuple(key) for key in db.execute(
+                            select(table.c.machine_id, table.c.event_seq)
+                            .where(tuple_(table.c.machine_id, table.c.event_seq).in_([(row["machine_id"], row["event_seq"]) for row in chunk]))
+                        )
+                    }
+                    # Another writer may store one of the remaining keys meanwhile; then go round again
+                    chunk = [row for row in chunk if (row["machine_id"], row["event_seq"]) not in existing]
+                    continue
+                inserted.extend(chunk)
+                break
+
+    return inserted
+
+
+def _is_duplicate_key(error: IntegrityError) -> bool:
+    """Whether a MySQL IntegrityError is a unique key violation (ER_DUP_ENTRY)."""
+    args = getattr(error.orig, "args", ())
+    return bool(args) and args[0] == 1062
+
+
+def apply_bottle_rows(db: Session, rows: List[dict]):
+    """
+    Keep the data derived from bottle rows in step with them, in the same transaction:
+    each machine's fill level grows by the bottles it received, in O(1) per machine,
+    and the daily rollup is upserted. Must be called for every bottle row inserted.
+    """
+    upsert_daily_rollup(db, rows)
+
+    fill = {}
+    for row in rows:
+        fill[row["machine_id"]] = fill.get(row["machine_id"], 0) + row["bottle_count"]
+    if not fill:
+        return
+
+    machines = Machine.__table__
+    db.connection().execute(
+        update(machines)
+        .where(machines.c.id == bindparam("target_id"))
+        # Keep updated_at: its onupdate would otherwise turn "last edited" into "last bottle"
+        .values(fill_count=machines.c.fill_count + bindparam("added"), updated_at=machines.c.updated_at),
+        [{"target_id": machine_id, "added": added} for machine_id, added in fill.items()],
+    )
+
+
+def insert_bottle_rows(db: Session, rows: List[dict]) -> List[dict]:
+    """
+    Write the given bottle rows using multi-row INSERT statements and return the rows
+    that were actually stored. Rows whose (machine_id, event_seq) is already stored
+    are skipped. The caller owns the transaction and is responsible for committing.
+    """
+    assign_local_dates(db, rows)
+
+    plain = []
+    keyed = {}
+    for row in rows:
+        if row["event_seq"] is None:
+            plain.append(row)
+        else:
+            keyed.setdefault((row["machine_id"], row["event_seq"]), row)  # First copy wins within a batch
+
+    for start in range(0, len(plain), INSERT_CHUNK_SIZE):
+        db.execute(insert(Bottle.__table__).values(plain[start:start + INSERT_CHUNK_SIZE]))
+
+    inserted = list(plain)
+    if keyed:
+        inserted.extend(_insert_ignoring_duplicates(db, list(keyed.values())))
+
+    apply_bottle_rows(db, inserted)
+    return inserted
+
+
+def insert_bottle_rows_or_reject(db: Session, rows: List[dict]) -> Tuple[List[dict], List[dict]]:
+    """
+    insert_bottle_rows for queued rows that cannot be handed back to their sender: rows
+    the database refuses (integrity or data errors, e.g. a machine deleted since they
+    were accepted) are set aside instead of failing the whole batch. A failing batch is
+    bisected under savepoints until the offending rows are isolated.
+    Returns (inserted, rejected); any other error propagates.
+    """
+    if not rows:
+        return [], []
+    try:
+        with db.begin_nested():
+            return insert_bottle_rows(db, rows), []
+    except (IntegrityError, DataError):
+        if len(rows) == 1:
+            return [], list(rows)
+
+    middle = len(rows) // 2
+    inserted, rejected = insert_bottle_rows_or_reject(db, rows[:middle])
+    more_inserted, more_rejected = insert_bottle_rows_or_reject(db, rows[middle:])
+    return inserted + more_inserted, rejected + more_rejected
+
+
+def bottle_rows_committed(rows: List[dict], inserted: List[dict]):
+    """
+    Bookkeeping to run once bottle rows are committed. inserted are the rows that
+    were new, as returned by insert_bottle_rows.
+    """
+    for row in rows:
+        if row["event_seq"] is not None:
+            recent_events.set((row["machine_id"], row["event_seq"]), True)
+    running_totals.add(inserted)
+
+
+def commit_bottle_rows(db: Session, rows: List[dict], inserted: List[dict]):
+    """
+    Commit the caller's transaction holding bottle rows and run bottle_rows_committed,
+    without a running-totals reconcile reading the database in between.
+    """
+    with running_totals.committing():
+        db.commit()
+        bottle_rows_committed(rows, inserted)
+
+
+def store_bottle_rows(db: Session, rows: List[dict]) -> List[dict]:
+    """
+    Insert and commit bottle rows in one transaction. Returns the rows that were new.
+    """
+    try:
+        inserted = insert_bottle_rows(db, rows)
+        # Duplicates are stored too, so every keyed row is remembered
+        commit_bottle_rows(db, rows, inserted)
+    except Exception:
+        db.rollback()
+        raise
+    return inserted
+
+
+def decode_packed_readings(payload: bytes) -> List[Tuple[int, int, float, int, int]]:
+    """
+    Decode a packed upload into (machine_id, bottle_count, bottle_weight, timestamp, event_seq)
+    tuples; event_seq is None for version 1 uploads.
+    Raises ValueError if the payload is not a well-formed packed upload.
+    """
+    if not payload:
+        raise ValueError("Empty payload")
+    record = PACKED_RECORDS.get(payload[0])
+    if record is None:
+        raise ValueError(f"Unsupported format version {payload[0]}")
+
+    body = memoryview(payload)[1:]
+    if len(body) % record.size:
+        raise ValueError(f"Payload length is not a multiple of {record.size} bytes")
+
+    if payload[0] == 1:
+        return [reading + (None,) for reading in record.iter_unpack(body)]
+    return list(record.iter_unpack(body))
+
+
+def encode_packed_readings(readings: Iterable[Tuple[int, int, float, int, int]]) -> bytes:
+    """
+    Encode (machine_id, bottle_count, bottle_weight, timestamp, event_seq) tuples into the
+    current packed format. This is what the machine firmware sends; it is kept here for
+    tooling and benchmarks.
+    """
+    record = PACKED_RECORDS[PACKED_FORMAT_VERSION]
+    return bytes([PACKED_FORMAT_VERSION]) + b"".join(record.pack(*reading) for reading in readings)
+
+
+def reading_error(bottle_count: int, bottle_weight: float, timestamp: int, now: datetime):
+    """
+    Return why a decoded reading is invalid, or None if it can be stored.
+    """
+    if bottle_count <= 0:
+        return "bottle_count must be positive"
+    if not math.isfinite(bottle_weight) or bottle_weight < 0:
+        return "bottle_weight must be a non-negative number"
+    if timestamp and timestamp > now.timestamp() + MAX_CLOCK_SKEW_SECONDS:
+        return "timestamp is in the future"
+    return None
+
+
+async def iter_ndjson_lines(chunks: AsyncIterator[bytes], gzipped: bool = False) -> AsyncIterator[bytes]:
+    """
+    Split a (optionally gzip-compressed) byte stream into lines as it arrives,
+    holding at most one partial line in memory. A final line without a trailing
+    newline is yielded too.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    pending = b""
+
+    async for chunk in chunks:
+        while chunk:
+            if decompressor is not None:
+                # Inflate at most one line's worth at a time, so a gzip bomb without
+                # newlines is rejected before it is expanded in memory
+                try:
+                    data = decompressor.decompress(chunk, MAX_NDJSON_LINE_BYTES)
+                except zlib.error as e:
+                    raise ValueError(f"Invalid gzip data: {e}")
+                chunk = decompressor.unconsumed_tail
+            else:
+                data, chunk = chunk, b""
+
+            pending += data
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                yield line
+            if len(pending) > MAX_NDJSON_LINE_BYTES:
+                raise ValueError(f"Line longer than {MAX_NDJSON_LINE_BYTES} bytes")
+
+    if decompressor is not None:
+        pending += decompressor.flush()
+    if pending:
+        yield pending
+
+
+def parse_ndjson_reading(line: bytes):
+    """
+    Parse one NDJSON reading into (machine_id, bottle_count, bottle_weight, timestamp, event_seq).
+    Raises ValueError with a client-facing message if the line is not a valid reading.
+    """
+    try:
+        item = json.loads(line)
+    except ValueError:
+        raise ValueError("Invalid JSON")
+    if not isinstance(item, dict):
+        raise ValueError("Reading must be a JSON object")
+
+    try:
+        machine_id = int(item["machine_id"])
+        bottle_count = int(item["bottle_count"])
+        bottle_weight = float(item["bottle_weight"])
+        timestamp = int(item.get("timestamp") or 0)
+        event_seq = item.get("event_seq")
+        event_seq = int(event_seq) if event_seq is not None else None
+    except KeyError as e:
+        raise ValueError(f"Missing field {e.args[0]}")
+    except (TypeError, ValueError):
+        raise ValueError("Invalid field value")
+
+    return machine_id, bottle_count, bottle_weight, timestamp, event_seq
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+import jwt
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from app.core.security import SECRET_KEY, ALGORITHM
+from app.database import SessionLocal
+from app.models import MachineCredential
+
+# Load environment variables from the .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Machine tokens are signed with their own key so they can be rotated independently of user JWTs.
+# There is deliberately no default: a token sitting on a field device must never verify as a user JWT.
+# Without a usable key machine tokens are disabled, which is only allowed while MACHINE_AUTH_REQUIRED is off.
+MACHINE_TOKEN_SECRET = os.getenv("MACHINE_TOKEN_SECRET")
+MACHINE_TOKEN_HEADER = "X-Machine-Token"
+# When true, ingestion requests without a machine token are rejected
+MACHINE_AUTH_REQUIRED = os.getenv("MACHINE_AUTH_REQUIRED", "false").lower() == "true"
+# How often the credential versions (the revocation set) are reloaded from the database
+MACHINE_CREDENTIAL_REFRESH_SECONDS = int(os.getenv("MACHINE_CREDENTIAL_REFRESH_SECONDS", 60))
+
+
+class MachineCredentials:
+    """
+    Stateless, HMAC-signed machine credentials.
+
+    A token embeds machine_id, business_id and a credential version. Issuing a new
+    token or revoking credentials bumps the machine's version in the
+    machine_credentials table, which invalidates every older token. Verification
+    only compares the token version against an in-memory copy of that table, which
+    is refreshed periodically, so it never touches the database.
+    """
+
+    def __init__(self, secret: str, refresh_seconds: int):
+        self.secret = secret
+        self.refresh_seconds = refresh_seconds
+        self._versions: Dict[int, int] = {}  # machine_id -> lowest valid credential version
+        self._task = None
+        self.refreshed_at = None
+
+    def secret_problem(self) -> Optional[str]:
+        """Why machine tokens cannot be issued or verified, or None when they can."""
+        if not self.secret:
+            return "MACHINE_TOKEN_SECRET is not set"
+        if self.secret == SECRET_KEY:
+            return "MACHINE_TOKEN_SECRET must differ from the user JWT secret"
+        return None
+
+    @property
+    def enabled(self) -> bool:
+        return self.secret_problem() is None
+
+    def refresh(self):
+        """Reload the credential versions from the database."""
+        db = SessionLocal()
+        try:
+            self._versions = dict(db.query(MachineCredential.machine_id, MachineCredential.version).all())
+            self.refreshed_at = time.time()
+        finally:
+            db.close()
+
+    def _bump_version(self, db, machine_id: int) -> int:
+        credential = db.get(MachineCredential, machine_id)
+        if credential is None:
+            credential = MachineCredential(machine_id=machine_id, version=1)
+            db.add(credential)
+        else:
+            credential.version += 1
+        db.commit()
+        self._versions[machine_id] = credential.version
+        return credential.version
+
+    def issue(self, db, machine_id: int, business_id: int) -> str:
+        """Issue a new token for the machine, revoking all previously issued ones."""
+        if not self.enabled:
+            raise HTTPException(status_code=503, detail="Machine credentials are not configured")
+        version = self._bump_version(db, machine_id)
+        payload = {
+            "typ": "machine",
+            "machine_id": machine_id,
+            "business_id": business_id,
+            "ver": version,
+            "iat": int(time.time()),
+        }
+        return jwt.encode(payload, self.secret, algorithm=ALGORITHM)
+
+    def revoke(self, db, machine_id: int):
+        """Revoke every token issued for the machine so far."""
+        self._bump_version(db, machine_id)
+
+    def verify(self, token: str) -> dict:
+        """
+        Check the signature and version of a machine token, purely in memory.
+        Returns {"machine_id", "business_id"} or raises HTTPException.
+        """
+        if not self.enabled:
+            raise HTTPException(status_code=403, detail="Machine tokens are not accepted")
+        try:
+            payload = jwt.decode(token, self.secret, algorithms=[ALGORITHM])
+        except jwt.PyJWTError:
+            raise HTTPException(status_code=403, detail="Invalid machine token")
+
+        if payload.get("typ") != "machine":
+            raise HTTPException(status_code=403, detail="Invalid machine token")
+        if payload.get("ver", 0) < self._versions.get(payload["machine_id"], 1):
+            raise HTTPException(status_code=403, detail="Machine token has been revoked")
+
+        return {"machine_id": payload["machine_id"], "business_id": payload["business_id"]}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await run_in_threadpool(self.refresh)
+            except Exception:
+                logger.exception("Refreshing machine credential versions failed")
+
+    def start(self, required: bool = False):
+        """
+        Load the revocation set and keep it fresh on the running event loop.
+        Without a usable secret the startup fails if machine tokens are required,
+        otherwise machine tokens stay disabled.
+        """
+        problem = self.secret_problem()
+        if problem is not None:
+            if required:
+                raise RuntimeError(f"{problem}, but MACHINE_AUTH_REQUIRED is on")
+            logger.warning("%s: machine tokens are disabled", problem)
+            return
+        if self._task is None:
+            self.refresh()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+machine_credentials = MachineCredentials(MACHINE_TOKEN_SECRET, MACHINE_CREDENTIAL_REFRESH_SECONDS)
+
+
+# Dependency for the ingestion endpoints
+def get_machine_credentials(request: Request) -> Optional[dict]:
+    """
+    Verify the X-Machine-Token header if present. Returns the verified claims, or
+    None when no token was sent and MACHINE_AUTH_REQUIRED is off.
+    """
+    token = request.headers.get(MACHINE_TOKEN_HEADER)
+    if token is None:
+        if MACHINE_AUTH_REQUIRED:
+            raise HTTPException(status_code=403, detail="Machine token required")
+        return None
+    return machine_credentials.verify(token)
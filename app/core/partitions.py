@@ -0,0 +1,432 @@
+import argparse
+import asyncio
+import logging
+import os
+import re
+from datetime import date
+from typing import Dict
+from dotenv import load_dotenv
+from sqlalchemy import Column, Index, MetaData, Table, column, inspect, select, table, text, union_all
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+from starlette.concurrency import run_in_threadpool
+from app.models import Bottle
+
+# Load environment variables from the .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BOTTLE_PARTITION_MONTHS_AHEAD = int(os.getenv("BOTTLE_PARTITION_MONTHS_AHEAD", 3))  # Partitions created in advance
+BOTTLE_RETENTION_MONTHS = int(os.getenv("BOTTLE_RETENTION_MONTHS", 0))  # Raw months kept; 0 keeps everything
+BOTTLE_RETENTION_ACTION = os.getenv("BOTTLE_RETENTION_ACTION", "drop").lower()  # drop or detach (PostgreSQL)
+BOTTLE_PARTITION_CHECK_SECONDS = int(os.getenv("BOTTLE_PARTITION_CHECK_SECONDS", 3600))
+
+# Batch size of the retention DELETEs on databases without partitions (MySQL)
+RETENTION_DELETE_BATCH = 10000
+
+MONTH_TABLE = re.compile(r"^bottles_(\d{4})_(\d{2})$")
+DEFAULT_PARTITION = "bottles_default"
+
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_table_name(month: date) -> str:
+    return f"bottles_{month:%Y_%m}"
+
+
+def partitionable_indexes():
+    """
+    Indexes of the bottles table that a partitioned parent can carry. Unique indexes
+    must include the partition key there, so ux_bottles_machine_event_seq is replaced
+    by the bottle_event_keys table on partitioned PostgreSQL.
+    """
+    return [index for index in Bottle.__table__.indexes if not index.unique]
+
+
+def month_table(name: str) -> Table:
+    """
+    A SQLite month table: the columns, primary key and indexes of bottles under another
+    name. Foreign keys are left out; the rows were checked when they entered bottles.
+    """
+    bottles = Bottle.__table__
+    month = Table(name, MetaData(), *[
+        Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable) for c in bottles.columns
+    ])
+    for index in bottles.indexes:
+        # Index names are global in SQLite
+        Index(index.name.replace("bottles", name, 1), *[month.c[c.name] for c in index.columns], unique=index.unique)
+    return month
+
+
+class BottlePartitions:
+    """
+    Monthly partitioning of the bottles table and its retention policy.
+
+    PostgreSQL: bottles is a native RANGE (created_at) partitioned table with one
+    partition per month (see `python -m app.core.partitions convert`). Partitions are
+    created BOTTLE_PARTITION_MONTHS_AHEAD months in advance, date-filtered queries are
+    pruned by the planner, and retention detaches or drops whole partitions.
+
+    SQLite: closed months are moved out of the hot bottles table into bottles_YYYY_MM
+    tables with the same indexes; source() stitches the tables a date range needs back
+    together, and retention drops whole month tables. The event keys of moved rows are
+    kept in bottle_event_keys so retried events stay idempotent, and bottles allocates
+    ids with AUTOINCREMENT so an id is never reused once its row has moved.
+
+    Other databases (MySQL) are not partitioned; retention deletes old rows in
+    batches of RETENTION_DELETE_BATCH along the created_at index.
+    """
+
+    def __init__(self, months_ahead: int, retention_months: int, retention_action: str, check_seconds: int):
+        if retention_action not in ("drop", "detach"):
+            raise ValueError("BOTTLE_RETENTION_ACTION must be drop or detach")
+
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.retention_action = retention_action
+        self.check_seconds = check_seconds
+
+        self.partitioned = False  # bottles is a partitioned PostgreSQL table
+        self.month_tables: Dict[date, str] = {}  # SQLite month tables, by month
+        self._task = None
+
+    # State
+
+    def _is_partitioned(self, conn: Connection) -> bool:
+        if conn.dialect.name != "postgresql":
+            return False
+        relkind = conn.execute(text(
+            "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE c.relname = 'bottles' AND n.nspname = current_schema()"
+        )).scalar()
+        return relkind == "p"
+
+    def _month_tables(self, conn: Connection) -> Dict[date, str]:
+        tables = {}
+        for name in inspect(conn).get_table_names():
+            match = MONTH_TABLE.match(name)
+            if match:
+                tables[date(int(match.group(1)), int(match.group(2)), 1)] = name
+        return tables
+
+    def refresh(self, engine: Engine):
+        """Detect how the bottles table is laid out."""
+        with engine.connect() as conn:
+            self.partitioned = self._is_partitioned(conn)
+            self.month_tables = self._month_tables(conn) if conn.dialect.name == "sqlite" else {}
+
+    # Reads
+
+    def source(self, db: Session, start: date = None, end: date = None):
+        """
+        The bottle rows created in [start, end) as a selectable with the columns of the
+        bottles table. Callers filter on created_at themselves; on SQLite this also adds
+        the month tables that overlap the range.
+        """
+        bottles = Bottle.__table__
+        if db.get_bind().dialect.name != "sqlite" or not self.month_tables:
+            return bottles
+
+        names = [
+            name for month, name in sorted(self.month_tables.items())
+            if (start is None or add_months(month, 1) > start) and (end is None or month < end)
+        ]
+        if not names:
+            return bottles
+
+        selects = [select(bottles)] + [
+            select(table(name, *[column(c.name, c.type) for c in bottles.columns])) for name in names
+        ]
+        return union_all(*selects).subquery("bottle_rows")
+
+    def tables(self, db: Session):
+        """Every table holding raw bottle rows: bottles plus, on SQLite, the month tables."""
+        bottles = Bottle.__table__
+        if db.get_bind().dialect.name != "sqlite":
+            return [bottles]
+        return [bottles] + [
+            table(name, *[column(c.name, c.type) for c in bottles.columns])
+            for _, name in sorted(self.month_tables.items())
+        ]
+
+    # Maintenance
+
+    def _ensure_pg_partitions(self, conn: Connection, today: date):
+        """Create this month's partition, the next months_ahead ones and the default partition."""
+        first = month_start(today)
+        for offset in range(self.months_ahead + 1):
+            start = add_months(first, offset)
+            end = add_months(start, 1)
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {month_table_name(start)} PARTITION OF bottles "
+                f"FOR VALUES FROM ('{start}') TO ('{end}')"
+            ))
+        # Catches readings with timestamps outside every month partition
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF bottles DEFAULT"))
+
+    def _pg_partitions(self, conn: Connection) -> Dict[date, str]:
+        names = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'bottles'"
+        )).scalars()
+        partitions = {}
+        for name in names:
+            match = MONTH_TABLE.match(name)
+            if match:
+                partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+        return partitions
+
+    def _sync_month_table(self, conn: Connection, name: str):
+        """Create a SQLite month table, or bring an existing one in line with bottles."""
+        month = month_table(name)
+        inspector = inspect(conn)
+        if not inspector.has_table(name):
+            month.create(conn)
+            return
+
+        if not inspector.get_pk_constraint(name)["constrained_columns"]:
+            # Created with CREATE TABLE ... AS SELECT, without a primary key or indexes
+            self._rebuild_sqlite_table(conn, month)
+            conn.execute(text(
+                f"INSERT OR IGNORE INTO bottle_event_keys (machine_id, event_seq, created_at) "
+                f"SELECT machine_id, event_seq, created_at FROM {name} WHERE event_seq IS NOT NULL"
+            ))
+            return
+
+        existing = {c["name"] for c in inspector.get_columns(name)}
+        for c in Bottle.__table__.columns:
+            if c.name not in existing:
+                conn.execute(text(f"ALTER TABLE {name} ADD COLUMN {c.name} {c.type.compile(dialect=conn.dialect)}"))
+        indexes = {index["name"] for index in inspector.get_indexes(name)}
+        for index in month.indexes:
+            if index.name not in indexes:
+                conn.execute(CreateIndex(index))
+
+    def _rebuild_sqlite_table(self, conn: Connection, target: Table):
+        """Recreate a SQLite table with the layout of target, keeping its rows."""
+        name = target.name
+        old = f"{name}_rebuild"
+        inspector = inspect(conn)
+        columns = [c["name"] for c in inspector.get_columns(name)]
+        # The old indexes would keep their names, which the new table needs
+        for index in inspector.get_indexes(name):
+            conn.execute(text(f"DROP INDEX {index['name']}"))
+        conn.execute(text(f"ALTER TABLE {name} RENAME TO {old}"))
+        target.create(conn)
+        shared = ", ".join(c for c in columns if c in target.c)
+        conn.execute(text(f"INSERT INTO {name} ({shared}) SELECT {shared} FROM {old}"))
+        conn.execute(text(f"DROP TABLE {old}"))
+        logger.info("Rebuilt %s", name)
+
+    def _ensure_sqlite_autoincrement(self, conn: Connection):
+        """
+        Make bottles allocate ids with AUTOINCREMENT. Plain SQLite rowids restart from the
+        highest id left in the table, which reuses the ids of rows moved to month tables.
+        """
+        ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'bottles'")).scalar()
+        if ddl is None or "AUTOINCREMENT" in ddl.upper():
+            return
+        self._rebuild_sqlite_table(conn, Bottle.__table__)
+
+        # Continue above every id handed out so far, including the moved ones
+        high = max(
+            conn.execute(text(f"SELECT coalesce(max(id), 0) FROM {name}")).scalar()
+            for name in ["bottles"] + list(self._month_tables(conn).values())
+        )
+        conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'bottles'"))
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('bottles', :high)"), {"high": high})
+
+    def sync_month_tables(self, engine: Engine):
+        """
+        Give the SQLite month tables the columns and indexes of bottles, and bottles
+        AUTOINCREMENT ids.
+        """
+        with engine.begin() as conn:
+            if conn.dialect.name == "sqlite":
+                self._ensure_sqlite_autoincrement(conn)
+                for name in self._month_tables(conn).values():
+                    self._sync_month_table(conn, name)
+
+    def _roll_sqlite_months(self, conn: Connection, today: date):
+        """Move rows of months before the previous one from bottles into their month tables."""
+        cutoff = add_months(month_start(today), -1)
+        months = conn.execute(
+            text("SELECT DISTINCT strftime('%Y-%m-01', created_at) FROM bottles WHERE created_at < :cutoff"),
+            {"cutoff": cutoff},
+        ).scalars().all()
+
+        columns = ", ".join(c.name for c in Bottle.__table__.columns)
+        for month in months:
+            start = date.fromisoformat(month)
+            name = month_table_name(start)
+            bounds = {"start": start, "end": add_months(start, 1)}
+            self._sync_month_table(conn, name)
+            conn.execute(text(
+                f"INSERT INTO {name} ({columns}) SELECT {columns} FROM bottles "
+                f"WHERE created_at >= :start AND created_at < :end"
+            ), bounds)
+            # ux_bottles_machine_event_seq no longer sees the moved rows
+            conn.execute(text(
+                "INSERT OR IGNORE INTO bottle_event_keys (machine_id, event_seq, created_at) "
+                "SELECT machine_id, event_seq, created_at FROM bottles "
+                "WHERE created_at >= :start AND created_at < :end AND event_seq IS NOT NULL"
+            ), bounds)
+            conn.execute(text("DELETE FROM bottles WHERE created_at >= :start AND created_at < :end"), bounds)
+            logger.info("Moved bottles of %s into %s", start.strftime("%Y-%m"), name)
+
+    def _apply_retention(self, conn: Connection, today: date):
+        cutoff = add_months(month_start(today), -self.retention_months)
+        dialect = conn.dialect.name
+
+        if dialect == "postgresql" and self.partitioned:
+            for month, name in sorted(self._pg_partitions(conn).items()):
+                if month >= cutoff:
+                    break
+                conn.execute(text(f"ALTER TABLE bottles DETACH PARTITION {name}"))
+                if self.retention_action == "drop":
+                    conn.execute(text(f"DROP TABLE {name}"))
+                logger.info("Retention: %s partition %s", "dropped" if self.retention_action == "drop" else "detached", name)
+            conn.execute(text("DELETE FROM bottle_event_keys WHERE created_at < :cutoff"), {"cutoff": cutoff})
+        elif dialect == "sqlite":
+            for month, name in sorted(self._month_tables(conn).items()):
+                if month >= cutoff:
+                    break
+                conn.execute(text(f"DROP TABLE {name}"))
+                logger.info("Retention: dropped %s", name)
+            conn.execute(text("DELETE FROM bottle_event_keys WHERE created_at < :cutoff"), {"cutoff": cutoff})
+        elif dialect == "mysql":
+            while conn.execute(
+                text("DELETE FROM bottles WHERE created_at < :cutoff ORDER BY created_at LIMIT :batch"),
+                {"cutoff": cutoff, "batch": RETENTION_DELETE_BATCH},
+            ).rowcount:
+                conn.commit()
+
+    def maintain(self, engine: Engine, today: date = None):
+        """Create upcoming partitions, roll SQLite months and apply the retention policy."""
+        today = today or date.today()
+        self.refresh(engine)
+        with engine.begin() as conn:
+            if self.partitioned:
+                self._ensure_pg_partitions(conn, today)
+            elif conn.dialect.name == "sqlite":
+                self._roll_sqlite_months(conn, today)
+
+        if self.retention_months > 0:
+            with engine.connect() as conn:
+                self._apply_retention(conn, today)
+                conn.commit()
+        self.refresh(engine)
+
+    async def _run(self, engine: Engine):
+        while True:
+            try:
+                await run_in_threadpool(self.maintain, engine)
+            except Exception:
+                logger.exception("Bottle partition maintenance failed")
+            await asyncio.sleep(self.check_seconds)
+
+    def start(self, engine: Engine):
+        """Detect the table layout and run maintenance periodically on the running event loop."""
+        if self._task is None:
+            self.refresh(engine)
+            self._task = asyncio.create_task(self._run(engine))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # Conversion
+
+    def convert(self, engine: Engine, today: date = None):
+        """
+        Turn an existing PostgreSQL bottles table into a monthly partitioned one, copying
+        every row. Takes an exclusive lock for the duration: run it in a maintenance window.
+        """
+        today = today or date.today()
+        with engine.begin() as conn:
+            if conn.dialect.name != "postgresql":
+                raise RuntimeError("Native partitioning is only supported on PostgreSQL")
+            if self._is_partitioned(conn):
+                logger.info("bottles is already partitioned")
+                return
+
+            conn.execute(text("LOCK TABLE bottles IN ACCESS EXCLUSIVE MODE"))
+            conn.execute(text("UPDATE bottles SET created_at = COALESCE(updated_at, now()) WHERE created_at IS NULL"))
+            sequence = conn.execute(text("SELECT pg_get_serial_sequence('bottles', 'id')")).scalar()
+            first = conn.execute(text("SELECT min(created_at) FROM bottles")).scalar()
+
+            conn.execute(text("ALTER TABLE bottles RENAME TO bottles_unpartitioned"))
+            conn.execute(text(
+                "CREATE TABLE bottles (LIKE bottles_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"
+            ))
+            conn.execute(text("ALTER TABLE bottles ALTER COLUMN created_at SET NOT NULL"))
+            conn.execute(text("ALTER TABLE bottles ADD PRIMARY KEY (id, created_at)"))
+            for foreign_key in Bottle.__table__.foreign_keys:
+                target = foreign_key.column
+                conn.execute(text(
+                    f"ALTER TABLE bottles ADD FOREIGN KEY ({foreign_key.parent.name}) "
+                    f"REFERENCES {target.table.name} ({target.name})"
+                ))
+            if sequence:
+                # Keep the id sequence alive when the old table is dropped
+                conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY bottles.id"))
+
+            # Partitions for every month with data, plus the ones ahead
+            month = month_start(first.date()) if first else month_start(today)
+            while month < month_start(today):
+                end = add_months(month, 1)
+                conn.execute(text(
+                    f"CREATE TABLE {month_table_name(month)} PARTITION OF bottles FOR VALUES FROM ('{month}') TO ('{end}')"
+                ))
+                month = end
+            self._ensure_pg_partitions(conn, today)
+
+            conn.execute(text("INSERT INTO bottles SELECT * FROM bottles_unpartitioned"))
+            conn.execute(text(
+                "INSERT INTO bottle_event_keys (machine_id, event_seq, created_at) "
+                "SELECT machine_id, event_seq, created_at FROM bottles_unpartitioned WHERE event_seq IS NOT NULL"
+            ))
+            conn.execute(text("DROP TABLE bottles_unpartitioned"))
+
+            # Index names are taken until the old table is gone
+            for index in partitionable_indexes():
+                conn.execute(CreateIndex(index))
+
+        self.refresh(engine)
+        logger.info("bottles is now partitioned by month")
+
+
+bottle_partitions = BottlePartitions(
+    months_ahead=BOTTLE_PARTITION_MONTHS_AHEAD,
+    retention_months=BOTTLE_RETENTION_MONTHS,
+    retention_action=BOTTLE_RETENTION_ACTION,
+    check_seconds=BOTTLE_PARTITION_CHECK_SECONDS,
+)
+
+
+if __name__ == "__main__":
+    from app.database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Bottle table partitioning.")
+    parser.add_argument("command", choices=["convert", "maintain"], help="convert: partition an existing PostgreSQL table; maintain: create partitions and apply retention now")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        bottle_partitions.convert(engine)
+    bottle_partitions.maintain(engine)
@@ -0,0 +1,64 @@
+import json
+import os
+from typing import Dict
+from dotenv import load_dotenv
+from app.core.cache import TTLCache
+
+# Load environment variables from the .env file
+load_dotenv()
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 256))  # Per endpoint
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 4 * 1024 * 1024))  # Per endpoint, JSON-encoded size
+
+# Seconds a response stays cached. Responses are keyed by the ETag of the tables
+# they read, so writes made by any worker take effect at once; writes made by this
+# process also free the entries they made unreachable.
+RESPONSE_CACHE_TTLS = {
+    "machines-per-business": float(os.getenv("RESPONSE_CACHE_MACHINES_PER_BUSINESS_TTL", 60)),
+}
+
+# Endpoints whose responses a kind of write changes
+INVALIDATED_BY = {
+    "machine": ("machines-per-business",),
+    "business": ("machines-per-business",),
+}
+
+
+def _json_size(value) -> int:
+    return len(json.dumps(value, default=str))
+
+
+class ResponseCache:
+    """
+    Responses of read-only dashboard endpoints, one LRU TTLCache per endpoint keyed
+    by the request parameters and the version stamp of the data they were built from. Each cache is capped both in entries and in the
+    JSON-encoded size of the responses it holds.
+    """
+
+    def __init__(self, ttls: Dict[str, float], max_entries: int, max_bytes: int):
+        self._caches = {
+            endpoint: TTLCache(max_size=max_entries, ttl_seconds=ttl, max_bytes=max_bytes, sizeof=_json_size)
+            for endpoint, ttl in ttls.items()
+        }
+
+    def get(self, endpoint: str, key=()):
+        """The cached response of endpoint for key, or None."""
+        return self._caches[endpoint].get(key)
+
+    def set(self, endpoint: str, value, key=()):
+        self._caches[endpoint].set(key, value)
+
+    def invalidate(self, write: str):
+        """Drop every cached response a write of the given kind ("machine", "business") changes."""
+        for endpoint in INVALIDATED_BY[write]:
+            self._caches[endpoint].clear()
+
+    def clear(self):
+        for cache in self._caches.values():
+            cache.clear()
+
+    def stats(self) -> dict:
+        return {endpoint: cache.stats() for endpoint, cache in self._caches.items()}
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_TTLS, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES)
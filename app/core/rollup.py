@@ -0,0 +1,126 @@
+import argparse
+from datetime import date, timedelta
+from typing import List
+from sqlalchemy import Date, func, insert, literal, select, union_all
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session
+from app.models import BottleCompaction, BottleDailyRollup
+from app.core.partitions import bottle_partitions
+
+
+def calendar_days(start: date, end: date):
+    """
+    The days from start to end inclusive as a one-column ("day") subquery, to outer join
+    rollup rows against so days without bottles still show up. Built from a UNION ALL
+    of literals, which every supported database accepts; keep windows to a few hundred days.
+    """
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    return union_all(*[select(literal(day, Date).label("day")) for day in days]).subquery("calendar")
+
+
+def upsert_daily_rollup(db: Session, rows: List[dict]):
+    """
+    Add bottle rows to their (local_date, machine_id) rollup entries with a single upsert.
+    Runs inside the caller's transaction, so the rollup commits together with the rows.
+    """
+    totals = {}
+    for row in rows:
+        key = (row["local_date"], row["machine_id"])
+        count, weight = totals.get(key, (0, 0.0))
+        totals[key] = (count + row["bottle_count"], weight + row["bottle_weight"])
+    if not totals:
+        return
+
+    # Sorted so concurrent transactions lock rollup rows in the same order
+    values = [
+        {"day": day, "machine_id": machine_id, "bottle_count": count, "bottle_weight": weight}
+        for (day, machine_id), (count, weight) in sorted(totals.items())
+    ]
+
+    table = BottleDailyRollup.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        stmt = mysql.insert(table).values(values)
+        stmt = stmt.on_duplicate_key_update(
+            bottle_count=table.c.bottle_count + stmt.inserted.bottle_count,
+            bottle_weight=table.c.bottle_weight + stmt.inserted.bottle_weight,
+        )
+    else:
+        stmt = (postgresql.insert if dialect == "postgresql" else sqlite.insert)(table).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["day", "machine_id"],
+            set_={
+                "bottle_count": table.c.bottle_count + stmt.excluded.bottle_count,
+                "bottle_weight": table.c.bottle_weight + stmt.excluded.bottle_weight,
+            },
+        )
+    db.execute(stmt)
+
+
+def rebuild_daily_rollup(db: Session, start: date = None, end: date = None) -> int:
+    """
+    Recompute the rollup from the raw bottle rows, for every day or for [start, end).
+    A full rebuild starts at the oldest raw row still stored, and compacted days are
+    never rebuilt, so days whose raw rows were removed by the retention policy or the
+    compaction job keep their totals.
+    Runs in one transaction; pause ingestion while it runs to avoid counting a row twice.
+    Returns the number of rollup rows written.
+    """
+    # Local days can start up to a day before or after the UTC day, hence the padding
+    bottles = bottle_partitions.source(
+        db,
+        start - timedelta(days=1) if start else None,
+        end + timedelta(days=1) if end else None,
+    )
+    if start is None:
+        start = db.execute(select(func.min(bottles.c.local_date))).scalar()
+        if start is None:
+            return 0
+    last_compacted = db.query(func.max(BottleCompaction.day)).scalar()
+    if last_compacted is not None and start <= last_compacted:
+        start = last_compacted + timedelta(days=1)
+    if end is not None and start >= end:
+        return 0
+
+    delete_query = db.query(BottleDailyRollup).filter(BottleDailyRollup.day >= start)
+    source = (
+        select(
+            bottles.c.local_date,
+            bottles.c.machine_id,
+            func.sum(bottles.c.bottle_count),
+            func.sum(bottles.c.bottle_weight),
+        )
+        .where(bottles.c.local_date >= start)
+        .group_by(bottles.c.local_date, bottles.c.machine_id)
+    )
+    if end is not None:
+        delete_query = delete_query.filter(BottleDailyRollup.day < end)
+        source = source.where(bottles.c.local_date < end)
+
+    try:
+        delete_query.delete(synchronize_session=False)
+        result = db.execute(
+            insert(BottleDailyRollup.__table__).from_select(
+                ["day", "machine_id", "bottle_count", "bottle_weight"], source
+            )
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return result.rowcount
+
+
+if __name__ == "__main__":
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rebuild the bottle_daily_rollup table from raw bottle rows.")
+    parser.add_argument("--from", dest="start", type=date.fromisoformat, help="Only rebuild days on or after this date (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        written = rebuild_daily_rollup(db, args.start)
+    finally:
+        db.close()
+    print(f"Rebuilt {written} rollup rows")
@@ -53,10 +53,14 @@ def get_current_user(request: Request):
     try:
         token = token.split(" ")[1]  # Extract Bearer token
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload  # Contains {"sub": username, "role": role}
     except jwt.PyJWTError:
         raise HTTPException(status_code=403, detail="Invalid token")
 
+    # Machine credentials only authenticate ingestion, never a user
+    if payload.get("typ") == "machine":
+        raise HTTPException(status_code=403, detail="Invalid token")
+    return payload  # Contains {"sub": username, "role": role}
+
 # Dependency to verify the token
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials  # Extract the token from the header
@@ -75,6 +79,13 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
             detail="Invalid token",
         )
 
+    # Machine credentials only authenticate ingestion, never a user
+    if payload.get("typ") == "machine":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid token",
+        )
+
     # Optionally, you can extract user info from the payload
     # For example, assuming the JWT contains 'sub' (subject), which is the user identifier:
     user_id = payload.get("sub")
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Hashable
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical aggregations: while a computation for a key is in
+    flight, further requests for the same key wait for it and receive its result
+    instead of running the query again.
+
+    The computation runs in the threadpool on a session of its own, so it neither
+    blocks the event loop nor depends on the request that started it: a caller that
+    disconnects does not cancel it for the others. Only concurrent requests share a
+    result; nothing is cached once the computation finishes.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session]):
+        self.session_factory = session_factory
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+
+        # Metrics
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    def _compute(self, func: Callable[[Session], Any]):
+        db = self.session_factory()
+        try:
+            return func(db)
+        finally:
+            db.close()
+
+    def _finished(self, key: Hashable, flight: asyncio.Future):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Mark the exception retrieved even if every caller went away
+        if not flight.cancelled() and flight.exception() is not None:
+            self.failures += 1
+
+    async def run(self, key: Hashable, func: Callable[[Session], Any]):
+        """Result of func(session) for key, shared with concurrent callers of the same key."""
+        self.calls += 1
+        flight = self._flights.get(key)
+        if flight is None:
+            self.executions += 1
+            flight = asyncio.ensure_future(run_in_threadpool(self._compute, func))
+            self._flights[key] = flight
+            flight.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.coalesced += 1
+        # Shielded so that one caller's cancellation leaves the computation running for the rest
+        return await asyncio.shield(flight)
+
+    def metrics(self) -> dict:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": round(self.coalesced / self.calls, 4) if self.calls else 0.0,
+            "in_flight": len(self._flights),
+            "failures": self.failures,
+        }
+
+
+aggregations = SingleFlight(SessionLocal)
@@ -0,0 +1,276 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, Optional, Set
+from dotenv import load_dotenv
+from sqlalchemy import BigInteger, Column, Date, Float, Index, Integer, MetaData, Table, delete, func, insert, select, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.responses import Response
+from starlette.concurrency import run_in_threadpool
+from app.models import BottleDailyRollup, Machine, SnapshotRefresh
+
+# Load environment variables from the .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_REFRESH_SECONDS = int(os.getenv("SNAPSHOT_REFRESH_SECONDS", 60))  # How often the snapshots are refreshed
+SNAPSHOT_MAX_AGE_SECONDS = int(os.getenv("SNAPSHOT_MAX_AGE_SECONDS", 120))  # Reading an older one triggers a refresh
+
+# The snapshots' own metadata: they are materialized views on PostgreSQL, so they
+# must stay out of Base.metadata.create_all
+snapshot_metadata = MetaData()
+
+# Bottle totals per machine, behind /machines/bottle-count
+machine_bottle_totals = Table(
+    "machine_bottle_totals", snapshot_metadata,
+    Column("machine_id", Integer, primary_key=True),
+    Column("total_bottle_count", BigInteger, nullable=False),
+    Column("total_bottle_weight", Float, nullable=False),
+)
+
+# Daily rollup rows with their machine's business, behind /daywise-bottle-stats
+business_daywise_totals = Table(
+    "business_daywise_totals", snapshot_metadata,
+    Column("day", Date, primary_key=True),
+    Column("machine_id", Integer, primary_key=True),
+    Column("business_id", Integer, nullable=False),
+    Column("bottle_count", BigInteger, nullable=False),
+    Column("bottle_weight", Float, nullable=False),
+    Index("ix_business_daywise_totals_business_day", "business_id", "day"),
+)
+
+
+def snapshot_query(name: str):
+    """The SELECT a snapshot holds the result of, with columns in table order."""
+    rollup = BottleDailyRollup.__table__
+    if name == "machine_bottle_totals":
+        return select(
+            rollup.c.machine_id,
+            func.sum(rollup.c.bottle_count).label("total_bottle_count"),
+            func.sum(rollup.c.bottle_weight).label("total_bottle_weight"),
+        ).group_by(rollup.c.machine_id)
+    machines = Machine.__table__
+    return select(
+        rollup.c.day,
+        rollup.c.machine_id,
+        machines.c.business_id,
+        rollup.c.bottle_count,
+        rollup.c.bottle_weight,
+    ).join_from(rollup, machines, machines.c.id == rollup.c.machine_id)
+
+
+class DashboardSnapshots:
+    """
+    Periodically refreshed snapshots of the dashboard aggregates that tolerate being
+    a minute old.
+
+    PostgreSQL: materialized views refreshed with REFRESH MATERIALIZED VIEW
+    CONCURRENTLY, which leaves the previous contents readable until the new ones are
+    in place. Other databases (SQLite, MySQL): summary tables emptied and refilled in
+    one transaction, so readers keep seeing the previous snapshot until it commits.
+
+    A background task refreshes every snapshot each refresh_seconds; a worker skips a
+    snapshot another worker refreshed recently (snapshot_refreshes). Endpoints read the
+    last snapshot and report its age; reading one older than max_age_seconds schedules
+    a background refresh without waiting for it (stale-while-revalidate).
+    """
+
+    def __init__(self, refresh_seconds: int, max_age_seconds: int):
+        self.refresh_seconds = refresh_seconds
+        self.max_age_seconds = max_age_seconds
+        self._engine: Optional[Engine] = None
+        self._created = False
+        self._refreshing: Set[str] = set()
+        self._task = None
+
+        # Metrics
+        self.refreshes: Dict[str, int] = {name: 0 for name in snapshot_metadata.tables}
+        self.failures = 0
+        self.revalidations = 0
+        self.last_refresh_ms: Dict[str, float] = {}
+
+    def create(self, engine: Engine):
+        """Create the materialized views or summary tables if they do not exist yet."""
+        if engine.dialect.name != "postgresql":
+            snapshot_metadata.create_all(bind=engine)
+            self._created = True
+            return
+
+        with engine.begin() as conn:
+            for name, table in snapshot_metadata.tables.items():
+                query = snapshot_query(name).compile(engine, compile_kwargs={"literal_binds": True})
+                conn.exec_driver_sql(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS {query}")
+                # REFRESH ... CONCURRENTLY requires a unique index covering every row
+                key = ", ".join(column.name for column in table.primary_key.columns)
+                conn.exec_driver_sql(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{name} ON {name} ({key})")
+                for index in table.indexes:
+                    columns = ", ".join(column.name for column in index.columns)
+                    conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {index.name} ON {name} ({columns})")
+        self._created = True
+
+    def drop(self, engine: Engine):
+        """Remove the snapshots, e.g. before the tables they are built from are dropped."""
+        if engine.dialect.name == "postgresql":
+            with engine.begin() as conn:
+                for name in snapshot_metadata.tables:
+                    conn.exec_driver_sql(f"DROP MATERIALIZED VIEW IF EXISTS {name}")
+        else:
+            snapshot_metadata.drop_all(bind=engine)
+        self._created = False
+
+    @staticmethod
+    def _record(conn: Connection, name: str, refresh_ms: float) -> datetime:
+        refreshes = SnapshotRefresh.__table__
+        values = {"refreshed_at": datetime.utcnow(), "refresh_ms": refresh_ms}
+        record = update(refreshes).where(refreshes.c.name == name).values(**values)
+        if conn.execute(record).rowcount == 0:
+            try:
+                with conn.begin_nested():
+                    conn.execute(insert(refreshes).values(name=name, **values))
+            except IntegrityError:
+                # Another worker recorded its first refresh of this snapshot meanwhile
+                conn.execute(record)
+        return values["refreshed_at"]
+
+    def refresh(self, engine: Engine, name: str) -> datetime:
+        """Rebuild one snapshot from bottle_daily_rollup. Returns the refresh time recorded."""
+        if not self._created:
+            self.create(engine)
+
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                conn.exec_driver_sql(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}")
+            else:
+                table = snapshot_metadata.tables[name]
+                conn.execute(delete(table))
+                conn.execute(insert(table).from_select([column.name for column in table.columns], snapshot_query(name)))
+            refresh_ms = round((time.perf_counter() - started) * 1000, 3)
+            refreshed_at = self._record(conn, name, refresh_ms)
+
+        self.refreshes[name] += 1
+        self.last_refresh_ms[name] = refresh_ms
+        return refreshed_at
+
+    def refresh_due(self, engine: Engine, force: bool = False) -> int:
+        """Refresh every snapshot not refreshed by any worker recently. Returns the number refreshed."""
+        with engine.connect() as conn:
+            stamps = dict(conn.execute(select(SnapshotRefresh.name, SnapshotRefresh.refreshed_at)).all())
+
+        refreshed = 0
+        now = datetime.utcnow()
+        for name in snapshot_metadata.tables:
+            refreshed_at = stamps.get(name)
+            # Slightly less than the interval, so the workers' loops do not skip each other forever
+            if not force and refreshed_at is not None and (now - refreshed_at).total_seconds() < self.refresh_seconds * 0.9:
+                continue
+            if name in self._refreshing:
+                continue
+            self._refreshing.add(name)
+            try:
+                self.refresh(engine, name)
+                refreshed += 1
+            finally:
+                self._refreshing.discard(name)
+        return refreshed
+
+    def _revalidate(self, engine: Engine, name: str):
+        """Refresh a stale snapshot in the background, unless that is already under way."""
+        if name in self._refreshing:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Outside the event loop the periodic refresh catches up
+        self.revalidations += 1
+        self._refreshing.add(name)
+
+        async def run():
+            try:
+                await run_in_threadpool(self.refresh, engine, name)
+            except Exception:
+                self.failures += 1
+                logger.exception("Refreshing the %s snapshot failed", name)
+            finally:
+                self._refreshing.discard(name)
+
+        loop.create_task(run())
+
+    def refreshed_at(self, db: Session, name: str) -> datetime:
+        """
+        When the snapshot was last refreshed (UTC). A snapshot that was never built is
+        built on the spot; a stale one is served and refreshed in the background.
+        """
+        engine = self._engine or db.get_bind()
+        refreshed_at = db.query(SnapshotRefresh.refreshed_at).filter(SnapshotRefresh.name == name).scalar()
+        if refreshed_at is None:
+            return self.refresh(engine, name)
+        if self.age_seconds(refreshed_at) > self.max_age_seconds:
+            self._revalidate(engine, name)
+        return refreshed_at
+
+    @staticmethod
+    def age_seconds(refreshed_at: datetime) -> float:
+        return max((datetime.utcnow() - refreshed_at).total_seconds(), 0.0)
+
+    def set_age(self, response: Optional[Response], refreshed_at: datetime):
+        """Report the snapshot a response was built from in its headers."""
+        if response is not None:
+            response.headers["X-Snapshot-Age"] = str(int(self.age_seconds(refreshed_at)))
+            response.headers["X-Snapshot-Refreshed-At"] = refreshed_at.isoformat() + "Z"
+
+    async def _run(self, engine: Engine):
+        while True:
+            try:
+                await run_in_threadpool(self.refresh_due, engine)
+            except Exception:
+                self.failures += 1
+                logger.exception("Refreshing the dashboard snapshots failed")
+            await asyncio.sleep(self.refresh_seconds)
+
+    def start(self, engine: Engine):
+        """Create the snapshots and refresh them periodically on the running event loop."""
+        if self._task is None:
+            self._engine = engine
+            self.create(engine)
+            self._task = asyncio.create_task(self._run(engine))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def metrics(self) -> dict:
+        return {
+            "refresh_seconds": self.refresh_seconds,
+            "max_age_seconds": self.max_age_seconds,
+            "refreshes": dict(self.refreshes),
+            "revalidations": self.revalidations,
+            "failures": self.failures,
+            "refreshing": sorted(self._refreshing),
+            "last_refresh_ms": dict(self.last_refresh_ms),
+        }
+
+
+snapshots = DashboardSnapshots(SNAPSHOT_REFRESH_SECONDS, SNAPSHOT_MAX_AGE_SECONDS)
+
+
+if __name__ == "__main__":
+    from app.database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Create and refresh the dashboard snapshots.")
+    parser.parse_args()
+
+    snapshots.create(engine)
+    print(f"Refreshed {snapshots.refresh_due(engine, force=True)} snapshots")
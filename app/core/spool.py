@@ -0,0 +1,353 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import List
+from dotenv import load_dotenv
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from app.database import SessionLocal
+from app.models import SpoolCheckpoint
+from app.core.ingest import insert_bottle_rows_or_reject, commit_bottle_rows, to_utc
+
+# Load environment variables from the .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Store-and-forward mode is off unless explicitly enabled
+SPOOL_ENABLED = os.getenv("BOTTLE_SPOOL_ENABLED", "false").lower() == "true"
+SPOOL_DIRECTORY = os.getenv("BOTTLE_SPOOL_DIRECTORY", "spool/bottles")
+SPOOL_FSYNC = os.getenv("BOTTLE_SPOOL_FSYNC", "always").lower()  # always, interval or never
+SPOOL_FSYNC_MS = int(os.getenv("BOTTLE_SPOOL_FSYNC_MS", 100))  # Used by the "interval" policy
+SPOOL_SEGMENT_BYTES = int(os.getenv("BOTTLE_SPOOL_SEGMENT_BYTES", 16 * 1024 * 1024))
+SPOOL_REPLAY_ROWS = int(os.getenv("BOTTLE_SPOOL_REPLAY_ROWS", 500))  # Rows per replay transaction
+SPOOL_REPLAY_MS = int(os.getenv("BOTTLE_SPOOL_REPLAY_MS", 200))
+
+FSYNC_POLICIES = ("always", "interval", "never")
+SEGMENT_SUFFIX = ".log"
+REJECTED_SUFFIX = ".rejected"  # Dead letters: rows of a segment the database refused
+
+
+class CheckpointConflict(Exception):
+    """Another replayer advanced the segment checkpoint first."""
+
+
+def encode_record(row: dict) -> bytes:
+    """One spool record: '<crc32 hex> <json>\n'. The CRC detects torn or corrupt writes."""
+    payload = json.dumps(
+        {**row, "created_at": row["created_at"].isoformat(), "updated_at": row["updated_at"].isoformat()},
+        separators=(",", ":"),
+    ).encode()
+    return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+
+def decode_record(line: bytes) -> dict:
+    """Decode a record written by encode_record. Raises ValueError on corruption."""
+    crc, _, payload = line.rstrip(b"\n").partition(b" ")
+    if len(crc) != 8 or int(crc, 16) != zlib.crc32(payload):
+        raise ValueError("Checksum mismatch")
+
+    row = json.loads(payload)
+    # Records spooled before bottle times moved to UTC carry aware +05:30 timestamps
+    row["created_at"] = to_utc(datetime.fromisoformat(row["created_at"]))
+    row["updated_at"] = to_utc(datetime.fromisoformat(row["updated_at"]))
+    return row
+
+
+def append_records(path: str, rows: List[dict]):
+    """Durably append rows to a record file, e.g. a dead-letter file."""
+    # local_date is filled in by the insert and derived again when a row is re-ingested
+    data = b"".join(encode_record({**row, "local_date": None}) for row in rows)
+    with open(path, "ab") as records:
+        records.write(data)
+        records.flush()
+        os.fsync(records.fileno())
+
+
+class BottleSpool:
+    """
+    Durable store-and-forward queue for bottle rows.
+
+    Accepted rows are appended to segment files in the spool directory. A background
+    replayer copies them into the bottles table in batches and records how far each
+    segment has been replayed in the spool_checkpoints table, in the same transaction
+    as the inserted rows. A crash therefore never loses an acknowledged row nor
+    inserts one twice. Fully replayed segments that no writer holds are deleted.
+    Rows the database refuses are moved to a .rejected file next to their segment
+    rather than blocking the rows behind them.
+
+    Every process writes to its own, newly created segment, holding an exclusive
+    flock on it for as long as it is active.
+    """
+
+    def __init__(self, enabled: bool, directory: str, fsync_policy: str, fsync_interval_ms: int,
+                 segment_bytes: int, replay_rows: int, replay_interval_ms: int):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"BOTTLE_SPOOL_FSYNC must be one of {', '.join(FSYNC_POLICIES)}")
+
+        self.enabled = enabled
+        self.directory = directory
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval_ms / 1000
+        self.segment_bytes = segment_bytes
+        self.replay_rows = replay_rows
+        self.replay_interval = replay_interval_ms / 1000
+
+        self._lock = threading.Lock()  # Guards the active segment
+        self._segment = None
+        self._segment_name = None
+        self._last_fsync = 0.0
+        self._dirty = False
+        self._task = None
+
+        # Metrics
+        self.appended = 0
+        self.fsyncs = 0
+        self.replayed_rows = 0
+        self.replay_duplicates = 0
+        self.replay_errors = 0
+        self.rejected_rows = 0
+        self.corrupt_records = 0
+        self.segments_removed = 0
+        self.last_replay_seconds = 0.0
+
+    # Writer
+
+    def _open_segment(self):
+        name = f"{time.time_ns():020d}{SEGMENT_SUFFIX}"
+        segment = open(os.path.join(self.directory, name), "ab")
+        fcntl.flock(segment.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._segment, self._segment_name = segment, name
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._sync()
+            self._segment.close()  # Closing releases the flock and seals the segment
+            self._segment = self._segment_name = None
+
+    def _sync(self):
+        self._segment.flush()
+        if self._dirty and self.fsync_policy != "never":
+            os.fsync(self._segment.fileno())
+            self.fsyncs += 1
+        self._dirty = False
+        self._last_fsync = time.monotonic()
+
+    def append(self, rows: List[dict]):
+        """
+        Durably append rows to the active segment according to the fsync policy.
+        Rows are acknowledged to the client once this returns.
+        """
+        data = b"".join(encode_record(row) for row in rows)
+        with self._lock:
+            if self._segment is None:
+                raise RuntimeError("Bottle spool is not started")
+            if self._segment.tell() + len(data) > self.segment_bytes and self._segment.tell() > 0:
+                self._close_segment()
+                self._open_segment()
+
+            self._segment.write(data)
+            self._dirty = True
+            self.appended += len(rows)
+
+            if self.fsync_policy == "always" or time.monotonic() - self._last_fsync >= self.fsync_interval:
+                self._sync()
+            else:
+                self._segment.flush()  # Visible to the replayer, fsync comes later
+
+    def sync_if_due(self):
+        """Honour the fsync interval when no new append triggers it."""
+        with self._lock:
+            if self._segment is not None and self._dirty and time.monotonic() - self._last_fsync >= self.fsync_interval:
+                self._sync()
+
+    # Replayer
+
+    def _segments(self) -> List[str]:
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+
+    def _read_records(self, path: str, offset: int):
+        """
+        Read up to replay_rows complete records starting at offset.
+        Returns (rows, new offset). A trailing line without newline is an append in progress.
+        """
+        rows = []
+        with open(path, "rb") as segment:
+            segment.seek(offset)
+            while len(rows) < self.replay_rows:
+                line = segment.readline()
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                try:
+                    rows.append(decode_record(line))
+                except ValueError:
+                    self.corrupt_records += 1
+                    logger.error("Skipping corrupt spool record in %s before offset %d", path, offset)
+        return rows, offset
+
+    def _advance_checkpoint(self, db, name: str, old_offset: int, new_offset: int):
+        """Move the segment checkpoint forward, failing if another replayer moved it first."""
+        if old_offset == 0 and db.get(SpoolCheckpoint, name) is None:
+            db.add(SpoolCheckpoint(segment=name, offset=new_offset))
+            db.flush()  # Raises IntegrityError if another replayer created it concurrently
+            return
+
+        result = db.execute(
+            update(SpoolCheckpoint)
+            .where(SpoolCheckpoint.segment == name, SpoolCheckpoint.offset == old_offset)
+            .values(offset=new_offset)
+        )
+        if result.rowcount != 1:
+            raise CheckpointConflict(name)
+
+    def _is_sealed(self, path: str) -> bool:
+        """A segment is sealed once no process holds its writer lock."""
+        with open(path, "rb") as segment:
+            try:
+                fcntl.flock(segment.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            fcntl.flock(segment.fileno(), fcntl.LOCK_UN)
+            return True
+
+    def _replay_segment(self, name: str) -> int:
+        path = os.path.join(self.directory, name)
+        replayed = 0
+        while True:
+            db = SessionLocal()
+            try:
+                checkpoint = db.get(SpoolCheckpoint, name)
+                offset = checkpoint.offset if checkpoint else 0
+                rows, new_offset = self._read_records(path, offset)
+
+                sealed = False
+                if new_offset == offset and name != self._segment_name and self._is_sealed(path):
+                    # The writer may have appended more records between the read above and
+                    # sealing the segment, so read again now that nothing can be added
+                    sealed = True
+                    rows, new_offset = self._read_records(path, offset)
+
+                if new_offset == offset:
+                    # Nothing left to replay right now; drop the segment once its writer is gone.
+                    # All that can remain of a sealed segment is a record without newline.
+                    if sealed:
+                        size = os.path.getsize(path)
+                        if size != offset:
+                            logger.warning("Discarding %d bytes of torn data at the end of spool segment %s", size - offset, name)
+                        os.remove(path)
+                        if checkpoint is not None:
+                            db.delete(checkpoint)
+                            db.commit()
+                        self.segments_removed += 1
+                    return replayed
+
+                inserted, rejected = insert_bottle_rows_or_reject(db, rows)
+                if rejected:
+                    # Written before the commit: a crash may repeat dead letters, never lose them
+                    append_records(os.path.join(self.directory, name[:-len(SEGMENT_SUFFIX)] + REJECTED_SUFFIX), rejected)
+                    logger.error("Moved %d bottle rows the database refused from spool segment %s to dead letters", len(rejected), name)
+                self._advance_checkpoint(db, name, offset, new_offset)
+                refused = {id(row) for row in rejected}
+                commit_bottle_rows(db, [row for row in rows if id(row) not in refused], inserted)
+            except (CheckpointConflict, IntegrityError, FileNotFoundError):
+                db.rollback()
+                logger.info("Spool segment %s is being replayed elsewhere", name)
+                return replayed
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+            replayed += len(inserted)
+            self.replayed_rows += len(inserted)
+            self.rejected_rows += len(rejected)
+            self.replay_duplicates += len(rows) - len(inserted) - len(rejected)
+
+    def replay_once(self) -> int:
+        """Replay every segment in order. Returns the number of rows inserted."""
+        started = time.perf_counter()
+        replayed = 0
+        try:
+            for name in self._segments():
+                replayed += self._replay_segment(name)
+        except Exception:
+            self.replay_errors += 1
+            logger.exception("Bottle spool replay failed, retrying later")
+        self.last_replay_seconds = time.perf_counter() - started
+        return replayed
+
+    def _cleanup_checkpoints(self):
+        """Drop checkpoints of segments that were deleted before their checkpoint was."""
+        segments = set(self._segments())
+        db = SessionLocal()
+        try:
+            db.query(SpoolCheckpoint).filter(SpoolCheckpoint.segment.notin_(segments)).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.replay_interval)
+            await run_in_threadpool(self.sync_if_due)
+            await run_in_threadpool(self.replay_once)
+
+    def start(self):
+        """Open a fresh segment and start the background replayer on the running event loop."""
+        if not self.enabled or self._task is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._cleanup_checkpoints()
+        with self._lock:
+            self._open_segment()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the replayer and seal the active segment; it is replayed after the restart."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        with self._lock:
+            self._close_segment()
+
+    def metrics(self) -> dict:
+        segments = self._segments() if self.enabled and os.path.isdir(self.directory) else []
+        return {
+            "enabled": self.enabled,
+            "fsync_policy": self.fsync_policy,
+            "segments": len(segments),
+            "spooled_bytes": sum(os.path.getsize(os.path.join(self.directory, name)) for name in segments),
+            "appended": self.appended,
+            "fsyncs": self.fsyncs,
+            "replayed_rows": self.replayed_rows,
+            "replay_duplicates": self.replay_duplicates,
+            "replay_errors": self.replay_errors,
+            "rejected_rows": self.rejected_rows,
+            "corrupt_records": self.corrupt_records,
+            "segments_removed": self.segments_removed,
+            "last_replay_ms": round(self.last_replay_seconds * 1000, 3),
+        }
+
+
+spool = BottleSpool(
+    enabled=SPOOL_ENABLED,
+    directory=SPOOL_DIRECTORY,
+    fsync_policy=SPOOL_FSYNC,
+    fsync_interval_ms=SPOOL_FSYNC_MS,
+    segment_bytes=SPOOL_SEGMENT_BYTES,
+    replay_rows=SPOOL_REPLAY_ROWS,
+    replay_interval_ms=SPOOL_REPLAY_MS,
+)
@@ -0,0 +1,129 @@
+from datetime import date, datetime, time, timedelta
+from typing import List
+import pytz
+from sqlalchemy import Date, cast, func, literal_column
+
+GRANULARITIES = ("hour", "day", "week", "month")
+
+# Longest series returned by the time-series endpoint
+MAX_TIMESERIES_POINTS = 5000
+
+
+def _offset_modifier(offset_minutes: int) -> str:
+    return f"{offset_minutes:+d} minutes"
+
+
+def bucket_day(column, granularity: str, dialect: str):
+    """
+    SQL truncating a DATE column (e.g. the rollup's business-local day) to the start
+    of its day, ISO week (Monday) or month.
+    """
+    if granularity == "day":
+        return column
+    if dialect == "postgresql":
+        return cast(func.date_trunc(granularity, column), Date)
+    if dialect == "mysql":
+        if granularity == "week":
+            return func.subdate(column, func.weekday(column))
+        return cast(func.date_format(column, "%Y-%m-01"), Date)
+    # SQLite: "weekday 0" moves forward to Sunday, six days back is that week's Monday
+    if granularity == "week":
+        return func.date(column, "weekday 0", "-6 days")
+    return func.date(column, "start of month")
+
+
+def bucket_timestamp(column, granularity: str, timezone_name: str, offset_minutes: int, dialect: str):
+    """
+    SQL truncating a naive UTC timestamp column to the start of its hour, day, ISO week
+    or month in the given timezone. PostgreSQL converts with the timezone itself, so DST
+    is honoured; MySQL and SQLite have no timezone data and shift by offset_minutes.
+    """
+    if dialect == "postgresql":
+        local = func.timezone(timezone_name, func.timezone("UTC", column))
+        return func.date_trunc(granularity, local)
+    if dialect == "mysql":
+        local = func.date_add(column, literal_column(f"INTERVAL {offset_minutes} MINUTE"))
+        if granularity == "hour":
+            return func.date_format(local, "%Y-%m-%d %H:00:00")
+        if granularity == "day":
+            return func.date(local)
+        if granularity == "week":
+            return func.subdate(func.date(local), func.weekday(local))
+        return func.date_format(local, "%Y-%m-01")
+    modifier = _offset_modifier(offset_minutes)
+    if granularity == "hour":
+        return func.strftime("%Y-%m-%d %H:00:00", column, modifier)
+    if granularity == "day":
+        return func.date(column, modifier)
+    if granularity == "week":
+        return func.date(column, modifier, "weekday 0", "-6 days")
+    return func.date(column, modifier, "start of month")
+
+
+def bucket_label(value, granularity: str) -> str:
+    """ISO label of a bucket as returned by any dialect (date, datetime or string)."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if granularity == "hour":
+        return value.strftime("%Y-%m-%dT%H:00")
+    return value.strftime("%Y-%m-%d")
+
+
+def bucket_labels(start: date, end: date, granularity: str) -> List[str]:
+    """Every bucket label from the day start to the day end inclusive."""
+    if granularity == "hour":
+        moment, last = datetime.combine(start, time.min), datetime.combine(end, time(23))
+        labels = []
+        while moment <= last:
+            labels.append(bucket_label(moment, granularity))
+            moment += timedelta(hours=1)
+        return labels
+
+    if granularity == "week":
+        day = start - timedelta(days=start.weekday())
+    elif granularity == "month":
+        day = start.replace(day=1)
+    else:
+        day = start
+
+    labels = []
+    while day <= end:
+        labels.append(bucket_label(day, granularity))
+        if granularity == "month":
+            day = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+        else:
+            day += timedelta(days=7 if granularity == "week" else 1)
+    return labels
+
+
+def utc_bounds(start: date, end: date, timezone_name: str):
+    """Naive UTC [from, to) covering the local days start to end in the timezone."""
+    zone = pytz.timezone(timezone_name)
+    lower = zone.localize(datetime.combine(start, time.min)).astimezone(pytz.utc).replace(tzinfo=None)
+    upper = zone.localize(datetime.combine(end + timedelta(days=1), time.min)).astimezone(pytz.utc).replace(tzinfo=None)
+    return lower, upper
+
+
+def utc_offset_minutes(timezone_name: str, day: date) -> int:
+    """UTC offset of the timezone around noon of the given day."""
+    offset = pytz.timezone(timezone_name).utcoffset(datetime.combine(day, time(12)))
+    return int(offset.total_seconds() // 60)
+
+
+def dense_series(labels: List[str], rows, granularity: str):
+    """
+    Parallel count and weight arrays over labels, with zeros for empty buckets.
+    rows are (bucket, bottle_count, bottle_weight).
+    """
+    totals = {}
+    for bucket, count, weight in rows:
+        # Summed rather than assigned: a repeated DST hour yields the same label twice
+        label = bucket_label(bucket, granularity)
+        previous_count, previous_weight = totals.get(label, (0, 0.0))
+        totals[label] = (previous_count + (count or 0), previous_weight + (weight or 0.0))
+    counts, weights = [], []
+    for label in labels:
+        count, weight = totals.get(label, (0, 0.0))
+        counts.append(int(count or 0))
+        weights.append(round(float(weight or 0.0), 3))
+    return counts, weights
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import func
+from starlette.concurrency import run_in_threadpool
+from app.database import SessionLocal
+from app.models import BottleDailyRollup, Machine
+
+# Load environment variables from the .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RUNNING_TOTALS_RECONCILE_SECONDS = int(os.getenv("RUNNING_TOTALS_RECONCILE_SECONDS", 30))  # How often totals are checked against the database
+
+# Weight differences below this are float rounding, not drift
+WEIGHT_TOLERANCE = 0.001
+
+
+class RunningTotals:
+    """
+    Bottle count and weight totals kept in memory, globally and per business, so the
+    totals endpoints answer without aggregating.
+
+    The totals are loaded from bottle_daily_rollup at startup and ingestion adds every
+    newly stored row once its transaction has committed. A background task recomputes
+    them from the rollup every reconcile_seconds, logs any drift and adopts the database
+    figures. While the database is read, this process's ingestion waits before committing
+    (see committing), so no row is both in the figures read and added on top of them.
+
+    Each worker process only sees the rows it stored itself: with several workers the
+    others' rows arrive with the next reconcile, so workers can disagree, and a client
+    moving between them can see totals go backwards, by up to reconcile_seconds of
+    ingestion. Lower RUNNING_TOTALS_RECONCILE_SECONDS to tighten that.
+    """
+
+    def __init__(self, reconcile_seconds: int):
+        self.reconcile_seconds = reconcile_seconds
+
+        self._lock = threading.Lock()
+        self._fence = threading.Condition()  # Orders commits against reads of the database
+        self._committing = 0
+        self._reading = False
+        self._total = [0, 0.0]  # [bottle_count, bottle_weight] across every machine
+        self._businesses: Dict[int, list] = {}  # business_id -> [bottle_count, bottle_weight]
+        self._machines: Dict[int, list] = {}  # machine_id -> [business_id, bottle_count, bottle_weight]
+        self._task = None
+
+        # Metrics
+        self.loaded = False
+        self.rows_added = 0
+        self.reconciles = 0
+        self.drifts = 0
+        self.last_drift = None
+        self.last_reconcile_seconds = 0.0
+
+    @staticmethod
+    def _read() -> Tuple[list, Dict[int, list], Dict[int, list]]:
+        """Totals recomputed from the database: (global, per business, per machine)."""
+        db = SessionLocal()
+        try:
+            sums = dict(
+                (machine_id, (count, weight))
+                for machine_id, count, weight in db.query(
+                    BottleDailyRollup.machine_id,
+                    func.sum(BottleDailyRollup.bottle_count),
+                    func.sum(BottleDailyRollup.bottle_weight),
+                ).group_by(BottleDailyRollup.machine_id)
+            )
+            owners = db.query(Machine.id, Machine.business_id).all()
+        finally:
+            db.close()
+
+        total = [0, 0.0]
+        for count, weight in sums.values():
+            total[0] += int(count or 0)
+            total[1] += float(weight or 0.0)
+
+        businesses, machines = {}, {}
+        for machine_id, business_id in owners:
+            count, weight = sums.get(machine_id, (0, 0.0))
+            count, weight = int(count or 0), float(weight or 0.0)
+            machines[machine_id] = [business_id, count, weight]
+            entry = businesses.setdefault(business_id, [0, 0.0])
+            entry[0] += count
+            entry[1] += weight
+        return total, businesses, machines
+
+    def _apply(self, total: list, businesses: Dict[int, list], machines: Dict[int, list], machine_id: int, count: int, weight: float):
+        total[0] += count
+        total[1] += weight
+        machine = machines.get(machine_id)
+        # A machine created by another worker since the last reconcile is only counted globally until the next one
+        if machine is not None:
+            machine[1] += count
+            machine[2] += weight
+            entry = businesses.setdefault(machine[0], [0, 0.0])
+            entry[0] += count
+            entry[1] += weight
+
+    @contextmanager
+    def committing(self):
+        """
+        Wrap committing bottle rows and adding them: the database is never read for the
+        totals while a row is committed but not yet added.
+        """
+        with self._fence:
+            while self._reading:
+                self._fence.wait()
+            self._committing += 1
+        try:
+            yield
+        finally:
+            with self._fence:
+                self._committing -= 1
+                self._fence.notify_all()
+
+    @contextmanager
+    def _quiesced(self):
+        """Hold off this process's commits until the totals read from the database are adopted."""
+        with self._fence:
+            self._reading = True
+            while self._committing:
+                self._fence.wait()
+        try:
+            yield
+        finally:
+            with self._fence:
+                self._reading = False
+                self._fence.notify_all()
+
+    def load(self):
+        """Replace the totals with the ones recomputed from the database."""
+        with self._quiesced():
+            total, businesses, machines = self._read()
+            with self._lock:
+                self._total, self._businesses, self._machines = total, businesses, machines
+                self.loaded = True
+
+    def add(self, rows: List[dict]):
+        """Count newly committed bottle rows."""
+        with self._lock:
+            for row in rows:
+                self._apply(self._total, self._businesses, self._machines, row["machine_id"], row["bottle_count"], row["bottle_weight"])
+            self.rows_added += len(rows)
+
+    def register(self, machine_id: int, business_id: int):
+        """Track a new machine, or move a machine's totals to the business it now belongs to."""
+        with self._lock:
+            machine = self._machines.setdefault(machine_id, [business_id, 0, 0.0])
+            if machine[0] == business_id:
+                return
+            previous = self._businesses.get(machine[0])
+            if previous is not None:
+                previous[0] -= machine[1]
+                previous[1] -= machine[2]
+            entry = self._businesses.setdefault(business_id, [0, 0.0])
+            entry[0] += machine[1]
+            entry[1] += machine[2]
+            machine[0] = business_id
+
+    def forget(self, machine_id: int):
+        """Drop a deleted machine from its business's totals."""
+        with self._lock:
+            machine = self._machines.pop(machine_id, None)
+            if machine is not None:
+                entry = self._businesses.get(machine[0])
+                if entry is not None:
+                    entry[0] -= machine[1]
+                    entry[1] -= machine[2]
+
+    def reconcile(self) -> bool:
+        """
+        Recompute the totals from the database, log any drift from the in-memory ones
+        and adopt the database figures. Returns whether drift was found.
+        """
+        started = time.perf_counter()
+        with self._quiesced():
+            total, businesses, machines = self._read()
+
+            with self._lock:
+                drifted = {}
+                if self._total[0] != total[0] or abs(self._total[1] - total[1]) > WEIGHT_TOLERANCE:
+                    drifted["global"] = {"count": self._total[0] - total[0], "weight": round(self._total[1] - total[1], 3)}
+                for business_id in set(self._businesses) | set(businesses):
+                    memory = self._businesses.get(business_id, [0, 0.0])
+                    database = businesses.get(business_id, [0, 0.0])
+                    if memory[0] != database[0] or abs(memory[1] - database[1]) > WEIGHT_TOLERANCE:
+                        drifted[business_id] = {"count": memory[0] - database[0], "weight": round(memory[1] - database[1], 3)}
+
+                self._total, self._businesses, self._machines = total, businesses, machines
+                self.loaded = True
+
+        self.reconciles += 1
+        self.last_reconcile_seconds = time.perf_counter() - started
+        if drifted:
+            self.drifts += 1
+            self.last_drift = drifted
+            # Expected with several workers, where it is the other workers' rows
+            logger.warning("Running bottle totals drifted from the database (memory - database): %s", drifted)
+        return bool(drifted)
+
+    def totals(self, business_id: int = None) -> Tuple[int, float]:
+        """(bottle_count, bottle_weight) overall or of one business."""
+        # Outside the app (scripts, benchmarks) nothing loaded the totals at startup
+        if not self.loaded:
+            self.load()
+        with self._lock:
+            if business_id is None:
+                count, weight = self._total
+            else:
+                count, weight = self._businesses.get(business_id, (0, 0.0))
+        return count, round(weight, 3)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.reconcile_seconds)
+            try:
+                await run_in_threadpool(self.reconcile)
+            except Exception:
+                logger.exception("Reconciling running bottle totals failed")
+
+    def start(self):
+        """Load the totals and start the periodic reconcile on the running event loop."""
+        if self._task is None:
+            self.load()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def metrics(self) -> dict:
+        with self._lock:
+            count, weight = self._total
+        return {
+            "loaded": self.loaded,
+            "total_count": count,
+            "total_weight": round(weight, 3),
+            "businesses": len(self._businesses),
+            "rows_added": self.rows_added,
+            "reconciles": self.reconciles,
+            "drifts": self.drifts,
+            "last_drift": self.last_drift,
+            "last_reconcile_ms": round(self.last_reconcile_seconds * 1000, 3),
+            "reconcile_seconds": self.reconcile_seconds,
+        }
+
+
+running_totals = RunningTotals(RUNNING_TOTALS_RECONCILE_SECONDS)
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import List
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+from app.database import SessionLocal
+from app.core.ingest import insert_bottle_rows_or_reject, commit_bottle_rows
+from app.core.spool import append_records
+
+# Load environment variables from the .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Write-behind mode is off unless explicitly enabled
+WRITE_BEHIND_ENABLED = os.getenv("BOTTLE_WRITE_BEHIND", "false").lower() == "true"
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("BOTTLE_WRITE_BEHIND_FLUSH_MS", 200))  # Flush at least this often
+WRITE_BEHIND_FLUSH_ROWS = int(os.getenv("BOTTLE_WRITE_BEHIND_FLUSH_ROWS", 500))  # ...or as soon as this many rows wait
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("BOTTLE_WRITE_BEHIND_MAX_QUEUE", 10000))  # Reject new events beyond this
+WRITE_BEHIND_DEAD_LETTERS = os.getenv("BOTTLE_WRITE_BEHIND_DEAD_LETTERS", "spool/write_behind.rejected")  # Rows the database refused
+
+
+class QueueFullError(Exception):
+    """Raised when the write-behind queue cannot take more rows."""
+
+
+class WriteBehindBuffer:
+    """
+    Bounded in-memory queue of bottle rows that are written to the database in
+    grouped transactions by a background task.
+
+    Rows are lost if the process dies before they are flushed, which is the
+    trade-off accepted by enabling this mode. Rows the database refuses (e.g. for a
+    machine deleted since they were queued) are appended to the dead_letters file
+    instead of blocking every row behind them.
+    """
+
+    def __init__(self, enabled: bool, max_size: int, flush_rows: int, flush_interval_ms: int, dead_letters: str):
+        self.enabled = enabled
+        self.max_size = max_size
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval_ms / 1000
+        self.dead_letters = dead_letters
+
+        self._rows = deque()
+        self._in_flight = 0  # Rows taken by a flush that may still be put back
+        self._lock = threading.Lock()  # Guards the queue and _in_flight
+        self._flush_lock = threading.Lock()  # Only one flush writes at a time
+        self._wakeup = None
+        self._task = None
+
+        # Metrics
+        self.enqueued = 0
+        self.rejected = 0
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dead_lettered = 0
+        self.total_flush_seconds = 0.0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def enqueue(self, rows: List[dict]):
+        """
+        Queue rows for the next flush. All rows are accepted or none are.
+        """
+        with self._lock:
+            # Rows being flushed still count: a failed flush puts them back
+            if len(self._rows) + self._in_flight + len(rows) > self.max_size:
+                self.rejected += len(rows)
+                raise QueueFullError()
+            self._rows.extend(rows)
+            self.enqueued += len(rows)
+            depth = len(self._rows)
+
+        # Wake the flusher early once a full group is waiting
+        if depth >= self.flush_rows and self._wakeup is not None:
+            self._wakeup.set()
+
+    def flush(self, drain: bool = False) -> int:
+        """
+        Write queued rows in groups of flush_rows, one transaction per group.
+        Without drain only the rows queued when the flush started are written.
+        Returns the number of rows written.
+        """
+        written = 0
+        with self._flush_lock:
+            with self._lock:
+                pending = len(self._rows)
+
+            while drain or written < pending:
+                with self._lock:
+                    group = [self._rows.popleft() for _ in range(min(self.flush_rows, len(self._rows)))]
+                    self._in_flight = len(group)
+                if not group:
+                    break
+
+                started = time.perf_counter()
+                db = SessionLocal()
+                try:
+                    inserted, rejected = insert_bottle_rows_or_reject(db, group)
+                    if rejected:
+                        self._dead_letter(rejected)
+                    refused = {id(row) for row in rejected}
+                    commit_bottle_rows(db, [row for row in group if id(row) not in refused], inserted)
+                except Exception:
+                    db.rollback()
+                    self.failed_flushes += 1
+                    logger.exception("Write-behind flush of %d bottle rows failed", len(group))
+                    # Put the group back in front so it is retried on the next flush
+                    with self._lock:
+                        self._rows.extendleft(reversed(group))
+                        self._in_flight = 0
+                    break
+                finally:
+                    db.close()
+
+                with self._lock:
+                    self._in_flight = 0
+
+                elapsed = time.perf_counter() - started
+                written += len(group)
+                self.flushes += 1
+                self.flushed_rows += len(group)
+                self.total_flush_seconds += elapsed
+                self.last_flush_seconds = elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+        return written
+
+    def _dead_letter(self, rows: List[dict]):
+        """Set aside rows the database refused, before the transaction commits."""
+        directory = os.path.dirname(self.dead_letters)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        append_records(self.dead_letters, rows)
+        self.dead_lettered += len(rows)
+        logger.error("Moved %d bottle rows the database refused to %s", len(rows), self.dead_letters)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await run_in_threadpool(self.flush)
+
+    def start(self):
+        """Start the background flusher on the running event loop."""
+        if self.enabled and self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background flusher and write out everything still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        written = await run_in_threadpool(self.flush, True)
+        if written:
+            logger.info("Write-behind flushed %d bottle rows on shutdown", written)
+        if self._rows:
+            logger.error("Write-behind lost %d bottle rows on shutdown", len(self._rows))
+
+    def metrics(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "queue_depth": len(self._rows),
+            "in_flight": self._in_flight,
+            "max_queue_size": self.max_size,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "flushed_rows": self.flushed_rows,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "dead_lettered": self.dead_lettered,
+            "last_flush_ms": round(self.last_flush_seconds * 1000, 3),
+            "max_flush_ms": round(self.max_flush_seconds * 1000, 3),
+            "avg_flush_ms": round(self.total_flush_seconds * 1000 / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+
+write_behind = WriteBehindBuffer(
+    enabled=WRITE_BEHIND_ENABLED,
+    max_size=WRITE_BEHIND_MAX_QUEUE,
+    flush_rows=WRITE_BEHIND_FLUSH_ROWS,
+    flush_interval_ms=WRITE_BEHIND_FLUSH_MS,
+    dead_letters=WRITE_BEHIND_DEAD_LETTERS,
+)
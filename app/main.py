@@ -11,11 +11,24 @@ from app.routes.business import router as business_router
 from app.routes.machine import router as machine_router
 from app.routes.bottles import router as bottle_router
 from app.routes.email import router as email_router
+from app.routes.metrics import router as metrics_router
 from app.database import database  # Import the database instance
+from app.core.write_behind import write_behind
+from app.core.spool import spool
+from app.core.machine_auth import machine_credentials, MACHINE_AUTH_REQUIRED
+from app.core.heartbeat import heartbeats
+from app.core.partitions import bottle_partitions
+from app.core.compaction import compactor
+from app.core.totals import running_totals
+from app.core.snapshots import snapshots
+from app.migrations import run_migrations
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+# Apply additive schema changes (new columns and indexes) to existing tables
+run_migrations(engine)
+
 
 # Create the FastAPI app instance
 app = FastAPI()
@@ -29,6 +42,7 @@ app.include_router(business_router)
 app.include_router(machine_router)
 app.include_router(bottle_router)
 app.include_router(email_router)
+app.include_router(metrics_router)
 
 
 # Connect to the database on app startup
@@ -36,10 +50,40 @@ app.include_router(email_router)
 async def startup():
     # Connect to PostgreSQL database
     await database.connect()
+    # Start flushing queued bottle events (no-op unless write-behind is enabled)
+    write_behind.start()
+    # Open a spool segment and start replaying spooled events (no-op unless enabled)
+    spool.start()
+    # Load the machine credential revocation set and keep it fresh
+    machine_credentials.start(required=MACHINE_AUTH_REQUIRED)
+    # Load the fleet's last-seen times and start flushing heartbeats
+    heartbeats.start()
+    # Load the running bottle totals and reconcile them with the database periodically
+    running_totals.start()
+    # Create the dashboard snapshots and refresh them periodically
+    snapshots.start(engine)
+    # Create upcoming bottle partitions and apply the retention policy periodically
+    bottle_partitions.start(engine)
+    # Archive and delete old raw bottle rows periodically (no-op unless enabled)
+    compactor.start()
 
 # Disconnect from the database on app shutdown
 @app.on_event("shutdown")
 async def shutdown():
+    # Stop partition maintenance and compaction
+    await bottle_partitions.stop()
+    await compactor.stop()
+    # Stop reconciling the running bottle totals and refreshing the snapshots
+    await running_totals.stop()
+    await snapshots.stop()
+    # Stop refreshing the machine credential revocation set
+    await machine_credentials.stop()
+    # Write out the last heartbeats
+    await heartbeats.stop()
+    # Write out any queued bottle events before the database goes away
+    await write_behind.stop()
+    # Seal the active spool segment; it is replayed after the restart
+    await spool.stop()
     # Disconnect from the database
     await database.disconnect()
 
@@ -0,0 +1,188 @@
+import logging
+import os
+import re
+from dotenv import load_dotenv
+from sqlalchemy import Date, cast, func, inspect, literal_column, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex, DefaultClause
+from app.database import Base
+from app.models import Bottle, BottleDailyRollup
+from app.core.rollup import rebuild_daily_rollup
+from app.core.partitions import bottle_partitions
+
+# Load environment variables from the .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Bottles stored before local_date existed hold IST wall-clock times (MySQL and SQLite
+# drop the offset of the aware datetimes the app used to send). On PostgreSQL the server
+# converted them to its session timezone instead: set this to that zone's UTC offset.
+LEGACY_BOTTLE_UTC_OFFSET_MINUTES = int(os.getenv("LEGACY_BOTTLE_UTC_OFFSET_MINUTES", 330))
+
+# UTC offset of DEFAULT_BUSINESS_TIMEZONE (Asia/Kolkata has no DST), the timezone
+# every existing business starts with
+DEFAULT_TIMEZONE_OFFSET_MINUTES = 330
+
+BACKFILL_BATCH = 50000
+
+
+def _column_ddl(column, engine: Engine) -> str:
+    """Render the column definition used by ALTER TABLE ... ADD COLUMN."""
+    preparer = engine.dialect.identifier_preparer
+    ddl = f"{preparer.quote(column.name)} {column.type.compile(dialect=engine.dialect)}"
+
+    default = column.server_default
+    if isinstance(default, DefaultClause):
+        arg = default.arg if isinstance(default.arg, str) else str(default.arg.compile(dialect=engine.dialect))
+        ddl += f" DEFAULT {arg}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+    elif not column.nullable:
+        raise RuntimeError(f"Cannot add NOT NULL column {column} without a server default")
+
+    return ddl
+
+
+def add_missing_columns(engine: Engine):
+    """Add columns that exist on the models but not yet in the database."""
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue  # New tables are created by create_all
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    logger.info("Adding column %s.%s", table.name, column.name)
+                    conn.execute(text(f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {_column_ddl(column, engine)}"))
+
+
+def create_missing_indexes(engine: Engine):
+    """
+    Create indexes declared on the models that the database does not have yet.
+    On PostgreSQL they are built CONCURRENTLY so large tables stay writable meanwhile,
+    except on the partitioned bottles table, which does not support it.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        partitioned = table is Bottle.__table__ and bottle_partitions.partitioned
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if partitioned and index.unique:
+                continue  # Replaced by bottle_event_keys
+            logger.info("Creating index %s", index.name)
+            if engine.dialect.name == "postgresql" and not partitioned:
+                ddl = str(CreateIndex(index).compile(dialect=engine.dialect))
+                ddl = re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl)
+                # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+                with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                    conn.exec_driver_sql(ddl)
+            else:
+                index.create(bind=engine)
+
+
+def sync_bottle_month_tables(engine: Engine):
+    """Give the SQLite bottle month tables the columns and indexes of bottles, and bottles AUTOINCREMENT ids."""
+    bottle_partitions.sync_month_tables(engine)
+
+
+def _shifted(column: str, minutes: int, dialect: str):
+    """column + minutes, as SQL for the given dialect."""
+    if dialect == "postgresql":
+        return literal_column(f"{column} + INTERVAL '{minutes} minutes'")
+    if dialect == "mysql":
+        return literal_column(f"{column} + INTERVAL {minutes} MINUTE")
+    return func.strftime("%Y-%m-%d %H:%M:%f", literal_column(column), f"{minutes} minutes")
+
+
+def backfill_bottle_local_dates(engine: Engine):
+    """
+    Move bottles stored before local_date existed to UTC and give them their local_date,
+    in batches of BACKFILL_BATCH ids. Rows that have a local_date are never touched again.
+    """
+    dialect = engine.dialect.name
+    to_utc = -LEGACY_BOTTLE_UTC_OFFSET_MINUTES
+    to_local = DEFAULT_TIMEZONE_OFFSET_MINUTES - LEGACY_BOTTLE_UTC_OFFSET_MINUTES
+
+    with Session(bind=engine) as db:
+        tables = bottle_partitions.tables(db)
+
+    for bottles in tables:
+        with engine.connect() as conn:
+            low, high = conn.execute(
+                select(func.min(bottles.c.id), func.max(bottles.c.id)).where(bottles.c.local_date.is_(None))
+            ).one()
+            if low is None:
+                continue
+            logger.info("Backfilling local_date of %s", bottles.name)
+
+            for start in range(low, high + 1, BACKFILL_BATCH):
+                conn.execute(
+                    update(bottles)
+                    .where(bottles.c.local_date.is_(None), bottles.c.id.between(start, start + BACKFILL_BATCH - 1))
+                    # local_date first: MySQL applies SET assignments left to right, and
+                    # .values() would render them in table column order
+                    .ordered_values(
+                        ("local_date", cast(_shifted("created_at", to_local, dialect), Date) if dialect != "sqlite"
+                         else func.date(literal_column("created_at"), f"{to_local} minutes")),
+                        ("created_at", _shifted("created_at", to_utc, dialect)),
+                        ("updated_at", _shifted("updated_at", to_utc, dialect)),
+                    )
+                )
+                conn.commit()
+
+
+def backfill_daily_rollup(engine: Engine):
+    """
+    Populate bottle_daily_rollup from the raw rows the first time it is deployed, while
+    it is still empty and bottles exist. The rebuild is a single transaction: when another
+    worker backfills at the same time, or ingestion upserts one of the rollup rows
+    meanwhile, it fails on the rollup primary key and rolls back instead of counting a
+    row twice.
+    """
+    with Session(bind=engine) as db:
+        if db.query(BottleDailyRollup.day).first() is not None or db.query(Bottle.id).first() is None:
+            return
+        logger.info("bottle_daily_rollup is empty; backfilling it from the raw bottle rows")
+        try:
+            written = rebuild_daily_rollup(db)
+        except (IntegrityError, OperationalError):
+            logger.warning(
+                "Backfilling bottle_daily_rollup was interrupted by another worker or by ingestion; "
+                "if day-wise totals look low, run `python -m app.core.rollup` with ingestion paused",
+                exc_info=True,
+            )
+            return
+        logger.info("Backfilled %d bottle_daily_rollup rows", written)
+
+
+def detect_bottle_partitions(engine: Engine):
+    """Find out whether bottles is partitioned before indexes are checked."""
+    bottle_partitions.refresh(engine)
+
+
+# Applied in order on every startup; each step must be idempotent
+MIGRATIONS = [
+    detect_bottle_partitions,
+    add_missing_columns,
+    sync_bottle_month_tables,
+    create_missing_indexes,
+    backfill_bottle_local_dates,
+    backfill_daily_rollup,
+]
+
+
+def run_migrations(engine: Engine):
+    """
+    Bring an existing database in line with the models. create_all only creates
+    missing tables, so additive changes to existing tables are applied here.
+    """
+    for migration in MIGRATIONS:
+        migration(engine)
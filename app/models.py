@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import  Column, Integer, String, Boolean, DateTime, ForeignKey, LargeBinary, TIMESTAMP, Float
+from sqlalchemy import  Column, Integer, BigInteger, String, Boolean, Date, DateTime, ForeignKey, LargeBinary, TIMESTAMP, Float, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.database import Base, engine  # Import Base and engine
@@ -8,6 +8,9 @@ from sqlalchemy.orm import relationship, Mapped
 from sqlalchemy.dialects.sqlite import JSON
 from sqlalchemy.sql import func
 
+# Timezone of businesses that have not set one; bottle days are counted in it
+DEFAULT_BUSINESS_TIMEZONE = "Asia/Kolkata"
+
 # Define the User model
 class User(Base):
     __tablename__ = "users"
@@ -34,6 +37,7 @@ class Business(Base):
     mobile = Column(String, nullable=False, unique=True)
     logo_image = Column(LargeBinary, nullable=True)
     business_owner = Column(Integer, ForeignKey("users.id"), nullable=False)
+    timezone = Column(String(64), nullable=False, default=DEFAULT_BUSINESS_TIMEZONE, server_default=DEFAULT_BUSINESS_TIMEZONE)  # IANA name, e.g. "Asia/Kolkata"
     created_by = Column(Integer, ForeignKey("users.id"), nullable=False)
     created_at = Column(DateTime, default=func.now(), nullable=False)
     updated_by = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -44,6 +48,11 @@ class Business(Base):
     created_user = relationship("User", foreign_keys=[created_by])
     updated_user = relationship("User", foreign_keys=[updated_by])
 
+    __table_args__ = (
+        Index("ix_businesses_business_owner", "business_owner"),  # "my-*" endpoints resolve the owner's business
+        Index("ix_businesses_name", "name"),  # Duplicate-name check on create
+    )
+
 
 class Machine(Base):
     __tablename__ = 'machines'
@@ -60,11 +69,20 @@ class Machine(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_by = Column(Integer, ForeignKey('users.id'), nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_seen_at = Column(DateTime, nullable=True)  # Last heartbeat (UTC), flushed periodically
+    capacity = Column(Integer, nullable=True)  # Bottles the machine holds before it must be emptied
+    fill_count = Column(Integer, nullable=False, default=0, server_default="0")  # Bottles since last emptied
+    last_emptied_at = Column(DateTime, nullable=True)
 
     business = relationship("Business", foreign_keys=[business_id])
     creator = relationship("User", foreign_keys=[created_by])
     updater = relationship("User", foreign_keys=[updated_by])
 
+    __table_args__ = (
+        Index("ix_machines_business_id", "business_id", "id"),  # Machines of a business, joins to bottles
+        Index("ix_machines_number", "number"),  # Duplicate-number check on create
+    )
+
 
 class Bottle(Base):
     __tablename__ = "bottles"
@@ -73,8 +91,10 @@ class Bottle(Base):
     machine_id = Column(Integer, ForeignKey("machines.id"), nullable=False)
     bottle_count = Column(Integer, nullable=False)
     bottle_weight = Column(Float, nullable=False)
+    event_seq = Column(BigInteger, nullable=True)  # Client-supplied sequence number, unique per machine
     created_by = Column(Integer, ForeignKey("users.id"), nullable=False)
-    created_at = Column(TIMESTAMP, server_default=func.now())
+    created_at = Column(TIMESTAMP, server_default=func.now())  # UTC
+    local_date = Column(Date, nullable=True)  # Day of created_at in the business's timezone
     updated_by = Column(Integer, ForeignKey("users.id"))
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.current_timestamp())
     
@@ -82,6 +102,103 @@ class Bottle(Base):
     created_by_user = relationship("User", foreign_keys=[created_by])
     updated_by_user = relationship("User", foreign_keys=[updated_by])
 
+    __table_args__ = (
+        # Makes retried events idempotent; rows without an event_seq are never considered duplicates
+        Index("ux_bottles_machine_event_seq", "machine_id", "event_seq", unique=True),
+        Index("ix_bottles_machine_created_at", "machine_id", "created_at"),  # Per-machine history and date ranges
+        Index("ix_bottles_created_at", "created_at"),  # Date-range scans across machines (partition pruning)
+        Index("ix_bottles_machine_local_date", "machine_id", "local_date"),  # Day-wise grouping per machine
+        Index("ix_bottles_local_date", "local_date"),  # Day-wise grouping across machines (rollup rebuild, compaction)
+        {"sqlite_autoincrement": True},  # Ids of rows moved to SQLite month tables are never reused
+    )
+
+
+class BottleEventKey(Base):
+    __tablename__ = "bottle_event_keys"
+
+    # (machine_id, event_seq) of stored bottle rows, used for idempotency instead of
+    # ux_bottles_machine_event_seq once bottles is partitioned on PostgreSQL, where a
+    # unique index has to include the partition key, and for the rows moved into SQLite
+    # month tables (see app/core/partitions.py).
+    machine_id = Column(Integer, primary_key=True, autoincrement=False)
+    event_seq = Column(BigInteger, primary_key=True, autoincrement=False)
+    created_at = Column(TIMESTAMP, nullable=False, index=True)  # Pruned with the partitions it belongs to
+
+
+class BottleDailyRollup(Base):
+    __tablename__ = "bottle_daily_rollup"
+
+    # Bottle totals per machine and day, maintained by the ingestion path
+    # (see app/core/rollup.py, which also rebuilds it from the raw rows).
+    day = Column(Date, primary_key=True)  # Bottle.local_date
+    machine_id = Column(Integer, ForeignKey("machines.id"), primary_key=True)
+    bottle_count = Column(BigInteger, nullable=False, default=0)
+    bottle_weight = Column(Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        Index("ix_bottle_daily_rollup_machine_day", "machine_id", "day"),
+    )
+
+
+class BottleCompaction(Base):
+    __tablename__ = "bottle_compactions"
+
+    # Days whose raw bottle rows were archived to disk and removed from the database
+    # (see app/core/compaction.py). bottle_daily_rollup is their only record from then on.
+    day = Column(Date, primary_key=True)
+    rows_archived = Column(BigInteger, nullable=False, default=0)
+    archive_path = Column(String(255))  # Most recent archive file written for the day
+    compacted_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class SnapshotRefresh(Base):
+    __tablename__ = "snapshot_refreshes"
+
+    # When each dashboard snapshot (materialized view on PostgreSQL, summary table
+    # elsewhere, see app/core/snapshots.py) was last refreshed, shared by all workers.
+    name = Column(String(64), primary_key=True)
+    refreshed_at = Column(DateTime, nullable=False)  # UTC
+    refresh_ms = Column(Float, nullable=True)
+
+
+class TableVersion(Base):
+    __tablename__ = "table_versions"
+
+    # Write counter per table, bumped in the transaction of every API write to it and
+    # part of the ETag version stamps (see app/core/etag.py), shared by all workers.
+    name = Column(String(64), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+class MachineEmptying(Base):
+    __tablename__ = "machine_emptyings"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    machine_id = Column(Integer, ForeignKey("machines.id"), nullable=False, index=True)
+    bottle_count = Column(Integer, nullable=False)  # Fill level when the machine was emptied
+    emptied_by = Column(Integer, ForeignKey("users.id"), nullable=False)
+    emptied_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class MachineCredential(Base):
+    __tablename__ = "machine_credentials"
+
+    # Lowest valid version of the machine's signed ingestion token. Bumped on rotation
+    # and revocation. No foreign key: the revocation must outlive a deleted machine.
+    machine_id = Column(Integer, primary_key=True, autoincrement=False)
+    version = Column(Integer, nullable=False, default=1)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class SpoolCheckpoint(Base):
+    __tablename__ = "spool_checkpoints"
+
+    # Bytes of a bottle spool segment already replayed into the bottles table.
+    # Updated in the same transaction as the replayed rows.
+    segment = Column(String(64), primary_key=True)
+    offset = Column(BigInteger, nullable=False, default=0)
+
+
 # Create the tables in the database (if not already created)
 Base.metadata.create_all(bind=engine)
 
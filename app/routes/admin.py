@@ -1,11 +1,15 @@
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from sqlalchemy.orm import Session
+from sqlalchemy import and_, func
+from datetime import date
+from typing import Optional
 from app.database import SessionLocal
 from app.core.security import hash_password, verify_token
 from app.schemas import BusinessCreate
-from app.models import User
+from app.models import User, Business, Machine, BottleDailyRollup
 from app.core.security import role_required
+from app.core.singleflight import aggregations
 
 # Create APIRouter instance
 router = APIRouter()
@@ -29,3 +33,72 @@ def admin_area(current_user: dict = Depends(role_required("t_admin"))):
     return {"message": "Welcome to the admin area", "user": current_user}
 
 
+@router.get("/admin/dashboard", dependencies=[Depends(verify_token)], tags=["Admin-Dashboard"])
+async def get_admin_dashboard(
+    start: Optional[date] = Query(None, alias="from"),
+    end: Optional[date] = Query(None, alias="to"),
+    current_user: dict = Depends(role_required("t_admin"))
+):
+    """
+    Every headline KPI of the admin dashboard in one response: machine and business
+    counts, bottle totals, machines per business and bottles per machine.
+    Bottle figures cover the inclusive from/to days when given, otherwise all time.
+    """
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+
+    def aggregate(session: Session):
+        # Bottles of the window are joined in the ON clause so machines without any stay in
+        rollup_join = [BottleDailyRollup.machine_id == Machine.id]
+        if start:
+            rollup_join.append(BottleDailyRollup.day >= start)
+        if end:
+            rollup_join.append(BottleDailyRollup.day <= end)
+
+        # One grouped query over businesses -> machines -> rollup yields every figure
+        rows = (
+            session.query(
+                Business.id.label("business_id"),
+                Business.name.label("business_name"),
+                Machine.id.label("machine_id"),
+                Machine.name.label("machine_name"),
+                func.coalesce(func.sum(BottleDailyRollup.bottle_count), 0).label("total_bottles"),
+                func.coalesce(func.sum(BottleDailyRollup.bottle_weight), 0.0).label("total_weight"),
+            )
+            .outerjoin(Machine, Machine.business_id == Business.id)
+            .outerjoin(BottleDailyRollup, and_(*rollup_join))
+            .group_by(Business.id, Business.name, Machine.id, Machine.name)
+            .order_by(Business.id, Machine.id)
+            .all()
+        )
+
+        machines_per_business = {}
+        machine_bottle_counts = []
+        total_count, total_weight = 0, 0.0
+        for row in rows:
+            if row.machine_id is None:
+                continue  # Business without machines
+            machines_per_business[row.business_name] = machines_per_business.get(row.business_name, 0) + 1
+            machine_bottle_counts.append({
+                "machine_id": row.machine_id,
+                "machine_name": row.machine_name,
+                "business_id": row.business_id,
+                "total_bottle_count": int(row.total_bottles),
+                "total_weight": round(float(row.total_weight), 3),
+            })
+            total_count += int(row.total_bottles)
+            total_weight += float(row.total_weight)
+
+        return {
+            "from": start.isoformat() if start else None,
+            "to": end.isoformat() if end else None,
+            "machine_count": len(machine_bottle_counts),
+            "business_count": len({row.business_id for row in rows}),
+            "total_count": total_count,
+            "total_weight": round(total_weight, 3),
+            "machines_per_business": machines_per_business,
+            "machine_bottle_counts": machine_bottle_counts,
+        }
+
+    # Every open dashboard polls this at once; concurrent loads share one computation
+    return await aggregations.run(("admin-dashboard", start, end), aggregate)
@@ -1,73 +1,401 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from app.models import Machine, Bottle, User, Business
+from app.models import Machine, Bottle, User, Business, BottleDailyRollup, DEFAULT_BUSINESS_TIMEZONE
 from app.schemas import BottleCreate
 from app.database import get_db
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
 from app.core.security import get_current_user, verify_token
+from app.core.ingest import get_machine_business_ids, build_bottle_row, assign_local_dates, apply_bottle_rows, store_bottle_rows, commit_bottle_rows, is_recent_event, decode_packed_readings, reading_error, iter_ndjson_lines, parse_ndjson_reading
+from app.core.write_behind import write_behind, QueueFullError
+from app.core.spool import spool
+from app.core.machine_auth import get_machine_credentials
+from app.core.partitions import bottle_partitions
+from app.core.rollup import calendar_days
+from app.core.totals import running_totals
+from app.core.etag import version_stamp, make_etag, etag_matches, not_modified, set_etag
+from app.core.singleflight import aggregations
+from app.core.snapshots import snapshots, business_daywise_totals
+from app.core.timeseries import GRANULARITIES, MAX_TIMESERIES_POINTS, bucket_day, bucket_timestamp, bucket_labels, dense_series, utc_bounds, utc_offset_minutes
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import aliased
-from sqlalchemy import false, func, cast, Date
-from typing import Dict
+from sqlalchemy import and_, func
+from typing import Dict, List, Optional
 import pytz
 
+# Maximum number of readings accepted by a single batch request
+MAX_BATCH_SIZE = 1000
 
-IST = pytz.timezone('Asia/Kolkata')
+# Maximum number of readings accepted by a single packed upload
+MAX_PACKED_READINGS = 5000
+
+# Readings written per transaction by the streaming upload
+STREAM_CHUNK_SIZE = 500
+
+# Rejected lines itemised in a streaming upload response
+MAX_STREAM_ERRORS = 100
+
+# Window of the day-wise endpoints when no range is given, and the largest one accepted
+DEFAULT_DAYWISE_DAYS = 30
+MAX_DAYWISE_DAYS = 366
 
 router = APIRouter()
 
+
+def day_window(start: Optional[date], end: Optional[date], today: date):
+    """
+    Resolve an optional from/to pair into an inclusive (start, end) window of at most
+    MAX_DAYWISE_DAYS days, defaulting to the DEFAULT_DAYWISE_DAYS days up to today.
+    """
+    end = end or (start + timedelta(days=DEFAULT_DAYWISE_DAYS - 1) if start else today)
+    start = start or end - timedelta(days=DEFAULT_DAYWISE_DAYS - 1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    if (end - start).days + 1 > MAX_DAYWISE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range exceeds {MAX_DAYWISE_DAYS} days")
+    return start, end
+
+
+def persist_bottle_rows(db: Session, rows: list):
+    """
+    Write validated bottle rows in one transaction, or hand them to the durable spool
+    or the write-behind buffer when one of those modes is enabled. Returns
+    ("created", rows that were new) or ("queued", rows).
+    Blocks on the database, the spool's fsync and the running-totals fence, so async
+    handlers call it through run_in_threadpool.
+    """
+    if spool.enabled:
+        try:
+            spool.append(rows)
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Error spooling bottles: {str(e)}")
+        return "queued", rows
+
+    if write_behind.enabled:
+        try:
+            write_behind.enqueue(rows)
+        except QueueFullError:
+            raise HTTPException(status_code=429, detail="Bottle ingestion queue is full, retry later")
+        return "queued", rows
+
+    try:
+        inserted = store_bottle_rows(db, rows)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating bottles: {str(e)}")
+    return "created", inserted
+
+
+def resolve_business_ids(db: Session, machine_ids, credentials: Optional[dict]) -> Dict[int, int]:
+    """
+    Business id per machine. A verified machine credential already carries it, so
+    authenticated uploads skip the machine lookup entirely and only cover that machine.
+    """
+    if credentials is not None:
+        return {credentials["machine_id"]: credentials["business_id"]}
+    return get_machine_business_ids(db, machine_ids)
+
+
+def unknown_machine_detail(credentials: Optional[dict]) -> str:
+    return "Machine not found" if credentials is None else "Machine not covered by machine token"
+
+
+def row_statuses(rows: list, status: str, inserted: list) -> list:
+    """Per-row outcome of persist_bottle_rows: created, duplicate or queued."""
+    if status == "queued":
+        return [status] * len(rows)
+    new_rows = {id(row) for row in inserted}
+    return ["created" if id(row) in new_rows else "duplicate" for row in rows]
+
+
 @router.post("/create_bottle/", tags=["Admin-Bottle"])
 async def create_bottle(
     bottle: BottleCreate,  # Assuming you have a Pydantic model BottleCreate
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    credentials: Optional[dict] = Depends(get_machine_credentials)
 ):
-    # Check if the machine exists
-    machine = db.query(Machine).filter(Machine.id == bottle.machine_id).first()
-    if not machine:
+    # A machine token may only report for its own machine
+    if credentials is not None and credentials["machine_id"] != bottle.machine_id:
+        raise HTTPException(status_code=403, detail="Machine token is not valid for this machine")
+
+    # Check if the machine exists (answered from the token or the machine cache when possible)
+    business_id = resolve_business_ids(db, [bottle.machine_id], credentials).get(bottle.machine_id)
+    if business_id is None:
         raise HTTPException(status_code=404, detail="Machine not found")
     
-    current_time_ist = datetime.now(IST)
-    business_id = machine.business_id
+    now = datetime.now(timezone.utc)
+
+    # Retried events that were stored recently are answered without touching the database
+    if is_recent_event(bottle.machine_id, bottle.event_seq):
+        return {"status": "duplicate", "machine_id": bottle.machine_id, "event_seq": bottle.event_seq}
+
+    row = build_bottle_row(bottle.machine_id, bottle.bottle_count, bottle.bottle_weight, business_id, now, bottle.event_seq)
+
+    # In spool and write-behind mode the event is acknowledged once it is queued
+    if spool.enabled or write_behind.enabled:
+        await run_in_threadpool(persist_bottle_rows, db, [row])
+        return JSONResponse(status_code=202, content={"status": "queued", "machine_id": bottle.machine_id, "event_seq": bottle.event_seq})
+
+    # Events with a client event ID are inserted with duplicate detection in the same statement
+    if bottle.event_seq is not None:
+        status, inserted = await run_in_threadpool(persist_bottle_rows, db, [row])
+        return {"status": row_statuses([row], status, inserted)[0], "machine_id": bottle.machine_id, "event_seq": bottle.event_seq}
 
     # Create a new bottle entry
-    db_bottle = Bottle(
-        machine_id=bottle.machine_id,
-        bottle_count=bottle.bottle_count,
-        bottle_weight=bottle.bottle_weight,
-        created_by=business_id,  # Use the business_id from the machine
-        updated_by=business_id,
-        created_at=current_time_ist,  # Set created_at to current time in IST
-        updated_at=current_time_ist 
-    )
-    db.add(db_bottle)
-    db.commit()
-    db.refresh(db_bottle)
-    return db_bottle
+    def store():
+        assign_local_dates(db, [row])
+        db_bottle = Bottle(**row)
+        db.add(db_bottle)
+        apply_bottle_rows(db, [row])
+        commit_bottle_rows(db, [row], [row])
+        db.refresh(db_bottle)
+        return db_bottle
+
+    # Off the event loop: the commit may wait for a running-totals reconcile
+    return await run_in_threadpool(store)
+
+
+@router.post("/create_bottles/batch", tags=["Admin-Bottle"])
+async def create_bottles_batch(
+    bottles: List[BottleCreate],
+    db: Session = Depends(get_db),
+    credentials: Optional[dict] = Depends(get_machine_credentials)
+):
+    """
+    Create many bottle entries, possibly for many machines, in one transaction.
+    Machines are resolved with a single SELECT and all valid readings are written
+    with multi-row INSERTs. Readings for unknown machines are reported per item, and
+    readings whose event_seq is already stored are reported as duplicates.
+    """
+    if not bottles:
+        raise HTTPException(status_code=400, detail="No bottles provided")
+    if len(bottles) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {MAX_BATCH_SIZE} readings")
+
+    # Resolve all machines of the batch at once
+    business_ids = resolve_business_ids(db, (bottle.machine_id for bottle in bottles), credentials)
+
+    now = datetime.now(timezone.utc)
+    rows = []
+    pending = []
+    results = []
+    for index, bottle in enumerate(bottles):
+        result = {"index": index, "machine_id": bottle.machine_id, "event_seq": bottle.event_seq}
+        results.append(result)
+
+        business_id = business_ids.get(bottle.machine_id)
+        if business_id is None:
+            result.update(status="error", detail=unknown_machine_detail(credentials))
+        elif is_recent_event(bottle.machine_id, bottle.event_seq):
+            result["status"] = "duplicate"
+        else:
+            rows.append(build_bottle_row(bottle.machine_id, bottle.bottle_count, bottle.bottle_weight, business_id, now, bottle.event_seq))
+            pending.append(result)
+
+    status = None
+    if rows:
+        status, inserted = await run_in_threadpool(persist_bottle_rows, db, rows)
+        for result, row_status in zip(pending, row_statuses(rows, status, inserted)):
+            result["status"] = row_status
+
+    body = {
+        "created": sum(result["status"] == "created" for result in results),
+        "queued": sum(result["status"] == "queued" for result in results),
+        "duplicates": sum(result["status"] == "duplicate" for result in results),
+        "failed": sum(result["status"] == "error" for result in results),
+        "results": results,
+    }
+    # Like create_bottle, queued readings are only accepted, not stored yet
+    if status == "queued":
+        return JSONResponse(status_code=202, content=body)
+    return body
+
+
+@router.post("/create_bottles/packed", tags=["Admin-Bottle"])
+async def create_bottles_packed(
+    request: Request,
+    db: Session = Depends(get_db),
+    credentials: Optional[dict] = Depends(get_machine_credentials)
+):
+    """
+    Create bottle entries from a packed binary upload (see app.core.ingest for the format).
+    Readings are decoded straight into tuples, without a pydantic model per reading,
+    and written in one transaction like the batch endpoint.
+    """
+    try:
+        readings = decode_packed_readings(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid packed payload: {e}")
+
+    if len(readings) > MAX_PACKED_READINGS:
+        raise HTTPException(status_code=400, detail=f"Upload exceeds {MAX_PACKED_READINGS} readings")
+
+    business_ids = resolve_business_ids(db, (reading[0] for reading in readings), credentials)
+
+    now = datetime.now(timezone.utc)
+    rows = []
+    errors = []
+    duplicates = 0
+    for index, (machine_id, bottle_count, bottle_weight, timestamp, event_seq) in enumerate(readings):
+        business_id = business_ids.get(machine_id)
+        error = unknown_machine_detail(credentials) if business_id is None else reading_error(bottle_count, bottle_weight, timestamp, now)
+        if error:
+            errors.append({"index": index, "machine_id": machine_id, "detail": error})
+            continue
+        if is_recent_event(machine_id, event_seq):
+            duplicates += 1
+            continue
+
+        created_at = datetime.fromtimestamp(timestamp, timezone.utc) if timestamp else now
+        # float32 on the wire; round away the single-precision noise (e.g. 0.1 -> 0.10000000149)
+        rows.append(build_bottle_row(machine_id, bottle_count, round(bottle_weight, 3), business_id, created_at, event_seq))
+
+    status, inserted = await run_in_threadpool(persist_bottle_rows, db, rows) if rows else ("created", [])
+
+    # Only failures are itemised to keep the response small on metered links
+    body = {
+        "status": status,
+        "created": len(inserted),
+        "duplicates": duplicates + len(rows) - len(inserted),
+        "failed": len(errors),
+        "errors": errors,
+    }
+    if status == "queued":
+        return JSONResponse(status_code=202, content=body)
+    return body
+
+
+@router.post("/create_bottles/stream", tags=["Admin-Bottle"])
+async def create_bottles_stream(
+    request: Request,
+    offset: int = 0,
+    db: Session = Depends(get_db),
+    credentials: Optional[dict] = Depends(get_machine_credentials)
+):
+    """
+    Replay a backlog of readings uploaded as newline-delimited JSON, one reading per line:
+    {"machine_id": 1, "bottle_count": 3, "bottle_weight": 0.6, "timestamp": 1700000000, "event_seq": 42}
+    timestamp and event_seq are optional. Send Content-Encoding: gzip for compressed uploads.
+
+    The body is parsed as it streams in and written in transactions of STREAM_CHUNK_SIZE
+    readings, so memory use does not depend on the upload size. resume_offset in the
+    response is the number of lines fully processed; if the upload is interrupted, send
+    the same body again with ?offset=<resume_offset> to skip them.
+    """
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="offset must not be negative")
+
+    gzipped = request.headers.get("content-encoding", "").lower() == "gzip"
+    now = datetime.now(timezone.utc)
+    progress = {"lines_read": 0, "resume_offset": offset, "created": 0, "queued": 0, "duplicates": 0, "failed": 0}
+    errors = []
+    chunk = []  # (line number, parsed reading)
+
+    def reject(line_number, machine_id, detail):
+        progress["failed"] += 1
+        if len(errors) < MAX_STREAM_ERRORS:
+            errors.append({"line": line_number, "machine_id": machine_id, "detail": detail})
+
+    async def write_chunk():
+        business_ids = resolve_business_ids(db, (reading[0] for _, reading in chunk), credentials)
+        rows = []
+        for line_number, (machine_id, bottle_count, bottle_weight, timestamp, event_seq) in chunk:
+            business_id = business_ids.get(machine_id)
+            error = unknown_machine_detail(credentials) if business_id is None else reading_error(bottle_count, bottle_weight, timestamp, now)
+            if error:
+                reject(line_number, machine_id, error)
+            elif is_recent_event(machine_id, event_seq):
+                progress["duplicates"] += 1
+            else:
+                created_at = datetime.fromtimestamp(timestamp, timezone.utc) if timestamp else now
+                rows.append(build_bottle_row(machine_id, bottle_count, bottle_weight, business_id, created_at, event_seq))
+
+        if rows:
+            status, inserted = await run_in_threadpool(persist_bottle_rows, db, rows)
+            progress[status] += len(inserted)
+            progress["duplicates"] += len(rows) - len(inserted)
+
+        progress["resume_offset"] = chunk[-1][0] + 1
+        chunk.clear()
+
+    try:
+        line_number = -1
+        async for line in iter_ndjson_lines(request.stream(), gzipped):
+            line_number += 1
+            progress["lines_read"] += 1
+            if line_number < offset:
+                continue  # Already processed by an earlier attempt
+
+            line = line.strip()
+            try:
+                if line:
+                    chunk.append((line_number, parse_ndjson_reading(line)))
+            except ValueError as e:
+                reject(line_number, None, str(e))
+
+            if not chunk:
+                # Nothing waits to be written, so this line is fully processed
+                progress["resume_offset"] = line_number + 1
+            elif len(chunk) >= STREAM_CHUNK_SIZE:
+                await write_chunk()
+
+        if chunk:
+            await write_chunk()
+        progress["resume_offset"] = max(progress["resume_offset"], line_number + 1)
+    except ValueError as e:
+        # The stream itself is malformed; everything before resume_offset is stored
+        return JSONResponse(status_code=400, content={"detail": str(e), **progress, "errors": errors})
+    except HTTPException as e:
+        # Database error or full write-behind queue; the client can resume from resume_offset
+        return JSONResponse(status_code=e.status_code, content={"detail": e.detail, **progress, "errors": errors})
+
+    return {**progress, "errors": errors}
 
 
 @router.get("/bottles/",  dependencies=[Depends(verify_token)], tags=["Admin-Bottle"])
 async def get_all_bottles(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    start: Optional[date] = Query(None, alias="from", description="Only bottles created on or after this day"),
+    end: Optional[date] = Query(None, alias="to", description="Only bottles created on or before this day"),
     db: Session = Depends(get_db),
 ):
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+
+    etag = make_etag("bottles", skip, limit, start, end, version_stamp(db, "bottles", "machines", "users"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
+    # Days are business-local; the UTC created_at bounds, a day wider on each side,
+    # let the database skip the partitions (months) outside the range
+    utc_start = start - timedelta(days=1) if start else None
+    utc_end = end + timedelta(days=2) if end else None
+    bottles_source = bottle_partitions.source(db, utc_start, utc_end)
+
     # Query all bottle entries with machine and user details
-    bottles = (
+    query = (
         db.query(
-            Bottle.id,
-            Bottle.bottle_count,
-            Bottle.bottle_weight,
+            bottles_source.c.id,
+            bottles_source.c.bottle_count,
+            bottles_source.c.bottle_weight,
             Machine.name.label("machine_name"),
             User.email.label("creator_name"),
             User.email.label("updater_name"),
-            Bottle.created_at,
-            Bottle.updated_at,
+            bottles_source.c.created_at,
+            bottles_source.c.updated_at,
         )
-        .join(Machine, Bottle.machine_id == Machine.id)
-        .join(User, Bottle.created_by == User.id)
-        .offset(skip)
-        .limit(limit)
-        .all()
+        .select_from(bottles_source)
+        .join(Machine, bottles_source.c.machine_id == Machine.id)
+        .join(User, bottles_source.c.created_by == User.id)
     )
+    if start:
+        query = query.filter(bottles_source.c.local_date >= start, bottles_source.c.created_at >= utc_start)
+    if end:
+        query = query.filter(bottles_source.c.local_date <= end, bottles_source.c.created_at < utc_end)
+    bottles = query.offset(skip).limit(limit).all()
 
     return [
         {
@@ -87,27 +415,36 @@ async def get_all_bottles(
 @router.get("/bottle/{bottle_id}",  dependencies=[Depends(verify_token)], tags=["Admin-Bottle"])
 async def get_bottle(
     bottle_id: int,
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
 ):
+    etag = make_etag("bottle", bottle_id, version_stamp(db, "bottles", "machines", "users"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
     creator = aliased(User)
     updater = aliased(User)
 
     # Query bottle entry with related machine and user details
+    bottles_source = bottle_partitions.source(db)
     bottle = (
         db.query(
-            Bottle.id,
-            Bottle.bottle_count,
-            Bottle.bottle_weight,
+            bottles_source.c.id,
+            bottles_source.c.bottle_count,
+            bottles_source.c.bottle_weight,
             Machine.name.label("machine_name"),
             creator.email.label("creator_name"),
             updater.email.label("updater_name"),
-            Bottle.created_at,
-            Bottle.updated_at,
+            bottles_source.c.created_at,
+            bottles_source.c.updated_at,
         )
-        .join(Machine, Bottle.machine_id == Machine.id)
-        .join(creator, Bottle.created_by == creator.id)
-        .join(updater, Bottle.updated_by == updater.id)
-        .filter(Bottle.id == bottle_id)
+        .select_from(bottles_source)
+        .join(Machine, bottles_source.c.machine_id == Machine.id)
+        .join(creator, bottles_source.c.created_by == creator.id)
+        .join(updater, bottles_source.c.updated_by == updater.id)
+        .filter(bottles_source.c.id == bottle_id)
         .first()
     )
 
@@ -126,29 +463,24 @@ async def get_bottle(
     }
 
 @router.get("/bottle-stats", response_model=Dict[str, float],  dependencies=[Depends(verify_token)], tags=["Admin-Dashboard"])
-async def get_bottle_stats(db: Session = Depends(get_db)):
-    result = (
-        db.query(
-            func.sum(Bottle.bottle_count).label("total_count"),
-            func.sum(Bottle.bottle_weight).label("total_weight")
-        )
-        .join(Machine, Bottle.machine_id == Machine.id)
-        .all()
-    )
-
-    if not result:
-        raise HTTPException(status_code=404, detail="No bottles found")
+async def get_bottle_stats(request: Request, response: Response, db: Session = Depends(get_db)):
+    # Served from the in-memory running totals (app/core/totals.py), reconciled with the rollup periodically
+    total_count, total_weight = running_totals.totals()
 
-    total_count, total_weight = result[0]
+    # The totals are the version stamp
+    etag = make_etag("bottle-stats", total_count, total_weight)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
 
     return {
-        "total_count": total_count or 0,
-        "total_weight": total_weight or 0.0
+        "total_count": total_count,
+        "total_weight": total_weight
     }
 
 
 @router.get("/my-bottle-stats", response_model=Dict[str, float],  dependencies=[Depends(verify_token)], tags=["Customer-Dashboard"])
-async def get_bottle_stats(db: Session = Depends(get_db), current_user: User = Depends(verify_token)):
+async def get_bottle_stats(request: Request, response: Response, db: Session = Depends(get_db), current_user: User = Depends(verify_token)):
     # Get the user's business by their ID
     business = db.query(Business).filter(Business.business_owner == current_user["id"]).first()
     
@@ -156,166 +488,285 @@ async def get_bottle_stats(db: Session = Depends(get_db), current_user: User = D
         raise HTTPException(status_code=404, detail="Business not found for the user")
 
     # Get the machine IDs that belong to this business
-    machine_ids = db.query(Machine.id).filter(Machine.business_id == business.id).all()
+    machine_ids = db.query(Machine.id).filter(Machine.business_id == business.id).limit(1).all()
     
     if not machine_ids:
         raise HTTPException(status_code=404, detail="No machines found for this business")
 
-    # Query for the total count and total weight of bottles for the machines of the current user's business
-    result = (
-        db.query(
-            func.sum(Bottle.bottle_count).label("total_count"),
-            func.sum(Bottle.bottle_weight).label("total_weight")
-        )
-        .filter(Bottle.machine_id.in_([machine_id[0] for machine_id in machine_ids]))  # Filter by machines belonging to the user's business
-        .all()
-    )
-
-    # If no bottles are found, return zero values
-    if not result:
-        raise HTTPException(status_code=404, detail="No bottles found for this business")
+    # Totals of the business's machines, served from the in-memory running totals
+    total_count, total_weight = running_totals.totals(business.id)
 
-    total_count, total_weight = result[0]
+    etag = make_etag("my-bottle-stats", business.id, total_count, total_weight)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
 
     return {
-        "total_count": total_count or 0,  # Return 0 if no count is found
-        "total_weight": total_weight or 0.0  # Return 0.0 if no weight is found
+        "total_count": total_count,
+        "total_weight": total_weight
     }
 
 @router.get("/my-daywise-bottle-stats", dependencies=[Depends(verify_token)], tags=["Customer-Dashboard"])
 async def get_daywise_bottle_stats(
+    request: Request,
+    response: Response,
+    start: Optional[date] = Query(None, alias="from", description=f"First day (default: {DEFAULT_DAYWISE_DAYS} days before 'to')"),
+    end: Optional[date] = Query(None, alias="to", description="Last day (default: today in the business's timezone)"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)  # Fetch current user
 ):
     """
     Get day-wise count and weight of bottles per machine for the current user's business.
+    Every day of the window lists every machine of the business, with zeros where it had no bottles.
     """
     # Fetch the business ID from the current user
     business_owner = current_user["id"]  # Assuming the current user has a business_id attribute
-    print(business_owner)
     # Validate if the business exists
     business = db.query(Business).filter(Business.business_owner == business_owner).first()
     if not business:
         raise HTTPException(status_code=404, detail="Business not found")
-    
-    # Get all machines for the business
-    machines = db.query(Machine).filter(Machine.business_id == business.id).all()
-    
-    # Query to calculate day-wise bottle stats with left join
-    stats = (
-        db.query(
-            cast(Bottle.created_at, Date).label("date"),  # Extract date from timestamp
-            Machine.id.label("machine_id"),
-            Machine.name.label("machine_name"),
-            func.coalesce(func.sum(Bottle.bottle_count), 0).label("total_bottles"),  # Handle no bottles case
-            func.coalesce(func.sum(Bottle.bottle_weight), 0.0).label("total_weight"),  # Handle no weight case
-        )
-        .join(Machine, Bottle.machine_id == Machine.id, isouter=True)  # Left join to include machines without bottles
-        .filter(Machine.business_id == business.id)  # Filter by business ID from the current user
-        .group_by(cast(Bottle.created_at, Date), Machine.id)  # Group by date and machine
-        .order_by(cast(Bottle.created_at, Date).desc(), Machine.id)  # Sort by date and machine
-        .all()
-    )
 
-    # Format the result
-    result = {}
-    for stat in stats:
-        date = stat.date.isoformat()  # Format date as string
-        if date not in result:
-            result[date] = []
-
-        # Add machine details
-        result[date].append(
-            {
-                "machine_id": stat.machine_id,
-                "machine_name": stat.machine_name,
-                "total_bottles": stat.total_bottles,
-                "total_weight": stat.total_weight,
-            }
+    today = datetime.now(pytz.timezone(business.timezone)).date()
+    start, end = day_window(start, end, today)
+
+    etag = make_etag("my-daywise-bottle-stats", business.id, start, end, version_stamp(db, "bottles", "machines"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
+    business_id = business.id
+
+    def aggregate(session: Session):
+        # The dense day x machine grid in one query: the calendar crossed with the
+        # business's machines, left-joined to the daily rollup
+        days = calendar_days(start, end)
+        stats = (
+            session.query(
+                days.c.day.label("date"),
+                Machine.id.label("machine_id"),
+                Machine.name.label("machine_name"),
+                func.coalesce(BottleDailyRollup.bottle_count, 0).label("total_bottles"),
+                func.coalesce(BottleDailyRollup.bottle_weight, 0.0).label("total_weight"),
+            )
+            .select_from(days)
+            .join(Machine, Machine.business_id == business_id)
+            .outerjoin(
+                BottleDailyRollup,
+                and_(BottleDailyRollup.day == days.c.day, BottleDailyRollup.machine_id == Machine.id),
+            )
+            .order_by(days.c.day.desc(), Machine.id)  # Sort by date and machine
+            .all()
         )
 
-    # Ensure machines with no records are included with zero values
-    for machine in machines:
-        for date in result:
-            # If the machine is not in the day-wise records, add it with zero values
-            if not any(m["machine_id"] == machine.id for m in result[date]):
-                result[date].append(
-                    {
-                        "machine_id": machine.id,
-                        "machine_name": machine.name,
-                        "total_bottles": 0,
-                        "total_weight": 0.0,
-                    }
-                )
+        # Format the result
+        result = {}
+        for stat in stats:
+            result.setdefault(stat.date.isoformat(), []).append(
+                {
+                    "machine_id": stat.machine_id,
+                    "machine_name": stat.machine_name,
+                    "total_bottles": stat.total_bottles,
+                    "total_weight": stat.total_weight,
+                }
+            )
+
+        return result
 
-    return result
+    db.close()  # Release this request's connection while the shared computation runs
+    return await aggregations.run(("my-daywise-bottle-stats", business_id, start, end), aggregate)
 
 @router.get("/daywise-bottle-stats", dependencies=[Depends(verify_token)], tags=["Admin-Dashboard"])
 async def get_daywise_bottle_stats_all_businesses(
+    request: Request,
+    response: Response,
+    skip: int = Query(0, ge=0, description="Businesses to skip, ordered by id"),
+    limit: int = Query(100, ge=1, le=500, description="Businesses to return"),
+    start: Optional[date] = Query(None, alias="from", description=f"First day (default: {DEFAULT_DAYWISE_DAYS} days before 'to')"),
+    end: Optional[date] = Query(None, alias="to", description="Last day (default: today)"),
     db: Session = Depends(get_db),
 ):
     """
-    Get day-wise count and weight of bottles per machine for all businesses.
+    Get day-wise count and weight of bottles per machine for a page of businesses.
+    Every day of the window lists every business of the page and each of its machines,
+    with zeros where a machine had no bottles. Bottle figures come from the
+    business_daywise_totals snapshot, which may be up to about a minute old; its age
+    is reported in the X-Snapshot-Age header. Three queries regardless of the page size.
     """
-    # Query to calculate day-wise bottle stats for all businesses
-    stats = (
-        db.query(
-            cast(Bottle.created_at, Date).label("date"),  # Extract date from timestamp
-            Machine.id.label("machine_id"),
-            Machine.name.label("machine_name"),
-            func.coalesce(func.sum(Bottle.bottle_count), 0).label("total_bottles"),  # Handle no bottles case
-            func.coalesce(func.sum(Bottle.bottle_weight), 0.0).label("total_weight"),  # Handle no weight case
-            Business.name.label("business_name")  # Get business name
+    today = datetime.now(pytz.timezone(DEFAULT_BUSINESS_TIMEZONE)).date()
+    start, end = day_window(start, end, today)
+
+    refreshed_at = snapshots.refreshed_at(db, "business_daywise_totals")
+    etag = make_etag("daywise-bottle-stats", skip, limit, start, end, refreshed_at, version_stamp(db, "machines", "businesses"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+    snapshots.set_age(response, refreshed_at)
+
+    def aggregate(session: Session):
+        # Query 1: the page of businesses
+        businesses = session.query(Business.id, Business.name).order_by(Business.id).offset(skip).limit(limit).all()
+        if not businesses:
+            return {}
+        business_ids = [business.id for business in businesses]
+
+        # Query 2: their machines, each listed on every day
+        machines = (
+            session.query(Machine.id, Machine.name, Machine.business_id)
+            .filter(Machine.business_id.in_(business_ids))
+            .order_by(Machine.id)
+            .all()
         )
-        .join(Machine, Bottle.machine_id == Machine.id, isouter=True)  # Left join to include machines without bottles
-        .join(Business, Machine.business_id == Business.id)  # Join with Business table
-        .group_by(cast(Bottle.created_at, Date), Machine.id, Business.id)  # Group by date, machine, and business
-        .order_by(cast(Bottle.created_at, Date).desc(), Machine.id)  # Sort by date and machine
-        .all()
-    )
 
-    # Format the result
-    result = {}
-    for stat in stats:
-        if stat.date is not None:
-            date = stat.date.isoformat()  # Format date as string
-            business_name = stat.business_name
-            if date not in result:
-               result[date] = {}
-
-            if business_name not in result[date]:
-               result[date][business_name] = []
+        # Query 3: the snapshot's bottle figures of those businesses within the window
+        totals = business_daywise_totals
+        bottles = {
+            (row.day, row.machine_id): row
+            for row in session.query(totals.c.day, totals.c.machine_id, totals.c.bottle_count, totals.c.bottle_weight)
+            .filter(totals.c.business_id.in_(business_ids), totals.c.day >= start, totals.c.day <= end)
+        }
 
-            result[date][business_name].append(
-                {
-                "machine_id": stat.machine_id,
-                "machine_name": stat.machine_name,
-                "total_bottles": stat.total_bottles,
-                "total_weight": stat.total_weight,
-                }
+        # Every business appears on every day, even without machines
+        names = {business.id: business.name for business in businesses}
+        result = {}
+        day = end
+        while day >= start:
+            entries = {business.name: [] for business in businesses}
+            for machine in machines:
+                row = bottles.get((day, machine.id))
+                entries[names[machine.business_id]].append(
+                    {
+                        "machine_id": machine.id,
+                        "machine_name": machine.name,
+                        "total_bottles": row.bottle_count if row else 0,
+                        "total_weight": row.bottle_weight if row else 0.0,
+                    }
+                )
+            result[day.isoformat()] = entries
+            day -= timedelta(days=1)
+
+        return result
+
+    # Dashboards polling at the same moment share one computation
+    db.close()  # Release this request's connection while it runs
+    return await aggregations.run(("daywise-bottle-stats", skip, limit, start, end), aggregate)
+
+
+@router.get("/bottle-timeseries", tags=["Admin-Dashboard"])
+async def get_bottle_timeseries(
+    request: Request,
+    response: Response,
+    granularity: str = Query("day", description="hour, day, week (ISO, starting Monday) or month"),
+    scope: str = Query("all", description="machine, business or all"),
+    scope_id: Optional[int] = Query(None, description="Machine or business id for those scopes"),
+    tz: Optional[str] = Query(None, description="IANA timezone of the buckets (default: the business's)"),
+    start: Optional[date] = Query(None, alias="from", description=f"First day (default: {DEFAULT_DAYWISE_DAYS} days before 'to')"),
+    end: Optional[date] = Query(None, alias="to", description="Last day (default: today)"),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Bottle count and weight per hour, day, week or month as parallel arrays, with zeros
+    for empty buckets. Buckets of business-local days and coarser come from the daily
+    rollup; hours, or buckets in an explicitly requested timezone, from the raw rows.
+    Customers only see their own business.
+    """
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+    if scope not in ("machine", "business", "all"):
+        raise HTTPException(status_code=400, detail="scope must be machine, business or all")
+    if scope != "all" and scope_id is None:
+        raise HTTPException(status_code=400, detail=f"scope_id is required for the {scope} scope")
+    if tz is not None and tz not in pytz.all_timezones_set:
+        raise HTTPException(status_code=400, detail=f"Unknown timezone: {tz}")
+
+    # Customers are confined to their own business
+    own = None
+    if current_user["role"] != "t_admin":
+        own = db.query(Business.id).filter(Business.business_owner == current_user["id"]).scalar()
+        if own is None:
+            raise HTTPException(status_code=404, detail="Business not found")
+        if scope == "all":
+            scope, scope_id = "business", own
+        elif scope == "business" and scope_id != own:
+            raise HTTPException(status_code=403, detail="Not authorized to view this business")
+
+    business_id = None
+    if scope == "machine":
+        business_id = db.query(Machine.business_id).filter(Machine.id == scope_id).scalar()
+        if business_id is None:
+            raise HTTPException(status_code=404, detail="Machine not found")
+        if current_user["role"] != "t_admin" and business_id != own:
+            raise HTTPException(status_code=403, detail="Not authorized to view this machine")
+    elif scope == "business":
+        business_id = scope_id
+
+    business_timezone = DEFAULT_BUSINESS_TIMEZONE
+    if business_id is not None:
+        business_timezone = db.query(Business.timezone).filter(Business.id == business_id).scalar()
+        if business_timezone is None:
+            raise HTTPException(status_code=404, detail="Business not found")
+
+    # Local days of the business are already aggregated in the rollup
+    use_rollup = granularity != "hour" and tz in (None, business_timezone)
+    timezone_name = tz or business_timezone
+
+    today = datetime.now(pytz.timezone(timezone_name)).date()
+    start, end = day_window(start, end, today)
+    labels = bucket_labels(start, end, granularity)
+    if len(labels) > MAX_TIMESERIES_POINTS:
+        raise HTTPException(status_code=400, detail=f"Series exceeds {MAX_TIMESERIES_POINTS} points; use a coarser granularity or a shorter range")
+
+    etag = make_etag(
+        "bottle-timeseries", granularity, scope, scope_id, timezone_name, use_rollup, start, end,
+        version_stamp(db, "bottles", "machines", "businesses"),
+    )
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
+    def aggregate(session: Session):
+        dialect = session.get_bind().dialect.name
+        if use_rollup:
+            bucket = bucket_day(BottleDailyRollup.day, granularity, dialect).label("bucket")
+            query = (
+                session.query(bucket, func.sum(BottleDailyRollup.bottle_count), func.sum(BottleDailyRollup.bottle_weight))
+                .filter(BottleDailyRollup.day >= start, BottleDailyRollup.day <= end)
             )
+            if scope == "machine":
+                query = query.filter(BottleDailyRollup.machine_id == scope_id)
+            elif scope == "business":
+                query = query.join(Machine, BottleDailyRollup.machine_id == Machine.id).filter(Machine.business_id == scope_id)
         else:
-            print("Warning: Found a stat with None date:", stat)
-
-    # Now, ensure all machines are included for each business even if they don't have bottle records
-    # Get all machines for each business
-    businesses = db.query(Business).all()
-    for business in businesses:
-        machines = db.query(Machine).filter(Machine.business_id == business.id).all()
-        for date in result:
-            if business.name not in result[date]:
-                result[date][business.name] = []
-
-            # Check if the machine is missing for this date, if so, add it with zero values
-            for machine in machines:
-                if not any(m["machine_id"] == machine.id for m in result[date][business.name]):
-                    result[date][business.name].append(
-                        {
-                            "machine_id": machine.id,
-                            "machine_name": machine.name,
-                            "total_bottles": 0,
-                            "total_weight": 0.0,
-                        }
-                    )
-
-    return result
+            lower, upper = utc_bounds(start, end, timezone_name)
+            bottles_source = bottle_partitions.source(session, lower.date(), upper.date() + timedelta(days=1))
+            bucket = bucket_timestamp(
+                bottles_source.c.created_at, granularity, timezone_name, utc_offset_minutes(timezone_name, start), dialect
+            ).label("bucket")
+            query = (
+                session.query(bucket, func.sum(bottles_source.c.bottle_count), func.sum(bottles_source.c.bottle_weight))
+                .select_from(bottles_source)
+                .filter(bottles_source.c.created_at >= lower, bottles_source.c.created_at < upper)
+            )
+            if scope == "machine":
+                query = query.filter(bottles_source.c.machine_id == scope_id)
+            elif scope == "business":
+                query = query.join(Machine, bottles_source.c.machine_id == Machine.id).filter(Machine.business_id == scope_id)
+
+        # Grouped by the output label: on PostgreSQL the bound timezone and unit would make
+        # a repeated expression differ from the selected one
+        return dense_series(labels, query.group_by("bucket").all(), granularity)
+
+    db.close()  # Release this request's connection while the shared computation runs
+    counts, weights = await aggregations.run(
+        ("bottle-timeseries", granularity, scope, scope_id, timezone_name, use_rollup, start, end), aggregate
+    )
+
+    return {
+        "granularity": granularity,
+        "timezone": "business-local" if use_rollup and scope == "all" else timezone_name,
+        "scope": scope,
+        "scope_id": scope_id,
+        "buckets": labels,
+        "bottle_count": counts,
+        "bottle_weight": weights,
+    }
@@ -1,9 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, Form, File, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Form, File, UploadFile, Query, Request, Response
 from sqlalchemy.orm import Session, aliased
 from app.models import Business
 from app.schemas import  BusinessCreate, UserCreate, BusinessUpdate
 from app.database import get_db
-from app.models import User, Machine, Bottle
+from app.models import User, Machine, BottleDailyRollup
 import os
 from app.core.security import role_required, verify_token, get_current_user, pwd_context
 from uuid import uuid4 
@@ -19,6 +19,12 @@ import base64
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy import func, case
 import bcrypt
+import pytz
+from typing import List, Optional
+from app.models import DEFAULT_BUSINESS_TIMEZONE
+from app.core.ingest import business_timezones
+from app.core.response_cache import response_cache
+from app.core.etag import bump_version, version_stamp, make_etag, etag_matches, not_modified, set_etag
 
 router = APIRouter()
 
@@ -33,6 +39,14 @@ os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
 
 router = APIRouter()
 
+
+def validate_timezone(name: str) -> str:
+    """Reject anything that is not an IANA timezone name such as "Asia/Kolkata"."""
+    if name not in pytz.all_timezones_set:
+        raise HTTPException(status_code=400, detail=f"Unknown timezone: {name}")
+    return name
+
+
 @router.post("/create_business", dependencies=[Depends(verify_token)], tags=["Admin-Business"])
 async def create_business(
     business_data: str = Form(...),  # JSON string as input
@@ -49,7 +63,34 @@ async def create_business(
     except json.JSONDecodeError as e:
         raise HTTPException(status_code=400, detail=f"Invalid JSON data: {e}")
 
-    # Step 1: Validate and Create the User
+    # Step 1: Validate the payload before anything is created
+    # Bottle days of the business are counted in this timezone
+    timezone = validate_timezone(business_data.get("timezone", DEFAULT_BUSINESS_TIMEZONE))
+
+    # Validate if the Business already exists
+    try:
+        existing_business = db.query(Business).filter(Business.name == business_data["name"]).first()
+        if existing_business:
+            raise HTTPException(status_code=400, detail="Business with this name already exists")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error checking business: {str(e)}")
+
+    # Step 2: Handle the Logo File
+    try:
+        if logo_image:
+            logo_binary = await logo_image.read()
+
+            if len(logo_binary) > 5 * 1024 * 1024:  # 5MB limit
+                raise HTTPException(status_code=400, detail="File is too large")
+        else:
+            logo_binary = None  # Set to None if no file is uploaded
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Error reading file: {str(e)}")
+
+    # Step 3: Validate and Create the User
     try:
         # Check if the email is already registered
         existing_user = db.query(User).filter(User.email == user_data["email"]).first()
@@ -77,27 +118,6 @@ async def create_business(
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error creating user: {str(e)}")
 
-    # Step 2: Validate if the Business already exists
-    try:
-        existing_business = db.query(Business).filter(Business.name == business_data["name"]).first()
-        if existing_business:
-            raise HTTPException(status_code=400, detail="Business with this name already exists")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error checking business: {str(e)}")
-
-    # Step 3: Handle the Logo File
-    try:
-        if logo_image:
-            logo_binary = await logo_image.read()
-
-            if len(logo_binary) > 5 * 1024 * 1024:  # 5MB limit
-                raise HTTPException(status_code=400, detail="File is too large")
-        else:
-            logo_binary = None  # Set to None if no file is uploaded
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=f"Error reading file: {str(e)}")
-
     # Step 4: Create the Business Record
     try:
         new_business = Business(
@@ -105,15 +125,18 @@ async def create_business(
             mobile=business_data["mobile"],
             logo_image=logo_binary,  # This can now be None if no file is uploaded
             business_owner=new_user.id,
+            timezone=timezone,
             created_by=current_user["id"],  # Use current_user.id for creation
             updated_by=current_user["id"],  # Use current_user.id for updates
         )
         db.add(new_business)
+        bump_version(db, "businesses", "users")
         db.commit()
         db.refresh(new_business)
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error creating business: {str(e)}")
+    response_cache.invalidate("business")
 
     return JSONResponse(content={
         "message": "Business created successfully",
@@ -122,7 +145,12 @@ async def create_business(
     })
 
 @router.get("/business/{business_id}", response_model=None, dependencies=[Depends(verify_token)], tags=["Admin-Business"])
-async def get_business(business_id: int, db: Session = Depends(get_db)):
+async def get_business(business_id: int, request: Request, db: Session = Depends(get_db)):
+    # Unchanged businesses are answered before the logo is loaded and encoded
+    etag = make_etag("business", business_id, version_stamp(db, "businesses"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
     business = db.query(Business).filter(Business.id == business_id).first()
 
     if not business:
@@ -139,13 +167,14 @@ async def get_business(business_id: int, db: Session = Depends(get_db)):
         "name": business.name,
         "mobile": business.mobile,
         "logo_image": logo_image_base64,  # Send the Base64 string
+        "timezone": business.timezone,
         "created_by": business.created_by,
         "updated_by": business.updated_by,
         "created_at": business.created_at.isoformat(),  # Convert datetime to string
         "updated_at": business.updated_at.isoformat(),  # Convert datetime to string
     }
 
-    return JSONResponse(content=response_data)
+    return JSONResponse(content=response_data, headers={"ETag": etag})
 
 
 def serialize_business_with_owner(business, owner_email):
@@ -167,7 +196,12 @@ def serialize_business_with_owner(business, owner_email):
     return business_dict
 
 @router.get("/businesses", response_model=None, dependencies=[Depends(verify_token)], tags=["Admin-Business"])
-async def get_all_businesses(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+async def get_all_businesses(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    # The listing carries every logo, so unchanged pages are answered with a 304
+    etag = make_etag("businesses", skip, limit, version_stamp(db, "businesses", "users"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
     # Fetch businesses with owner email
     businesses = (
         db.query(Business, User.email.label("owner_email"))
@@ -185,7 +219,7 @@ async def get_all_businesses(skip: int = 0, limit: int = 100, db: Session = Depe
         serialize_business_with_owner(business, owner_email) for business, owner_email in businesses
     ]
 
-    return JSONResponse(content={"businesses": serialized_businesses})
+    return JSONResponse(content={"businesses": serialized_businesses}, headers={"ETag": etag})
 
 
 @router.delete("/business/{business_id}", dependencies=[Depends(verify_token)], tags=["Admin-Business"])
@@ -212,15 +246,21 @@ async def delete_business(
     try:
         # Delete the business
         db.delete(business)
+        bump_version(db, "businesses")
         db.commit()
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error deleting business: {str(e)}")
+    response_cache.invalidate("business")
 
     return {"message": "Business deleted successfully", "business_id": business_id}
 
 @router.get("/my-business", response_model=None, dependencies=[Depends(verify_token)], tags=["Customer-Business"])
-async def get_my_businesses(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+async def get_my_businesses(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    etag = make_etag("my-business", current_user["id"], skip, limit, version_stamp(db, "businesses", "users"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
     # Fetch businesses for the current authenticated user
     businesses = (
         db.query(Business, User.email.label("owner_email"))
@@ -239,7 +279,7 @@ async def get_my_businesses(skip: int = 0, limit: int = 100, db: Session = Depen
         serialize_business_with_owner(business, owner_email) for business, owner_email in businesses
     ]
 
-    return JSONResponse(content={"businesses": serialized_businesses})
+    return JSONResponse(content={"businesses": serialized_businesses}, headers={"ETag": etag})
 
 @router.put("/businesses/{business_id}", dependencies=[Depends(verify_token)], tags=["Admin-Business"])
 async def update_business(
@@ -258,11 +298,17 @@ async def update_business(
     # Update business details
     db_business.name = business_data.name
     db_business.mobile = business_data.mobile
+    if business_data.timezone is not None:
+        # Applies to bottles stored from now on; existing days are not recomputed
+        db_business.timezone = validate_timezone(business_data.timezone)
     db_business.updated_at = datetime.utcnow()
 
     # Commit the changes
+    bump_version(db, "businesses")
     db.commit()
     db.refresh(db_business)
+    business_timezones.invalidate(business_id)
+    response_cache.invalidate("business")  # Business names key /machines-per-business
 
     # Return the updated business
     return {
@@ -271,6 +317,7 @@ async def update_business(
             "id": db_business.id,
             "name": db_business.name,
             "mobile": db_business.mobile,
+            "timezone": db_business.timezone,
             "created_by": db_business.created_by,
             "updated_by": db_business.updated_by,
             "created_at": db_business.created_at,
@@ -280,54 +327,54 @@ async def update_business(
 
 
 @router.get("/business-count", response_model=int, dependencies=[Depends(verify_token)], tags=["Admin-Dashboard"])
-async def get_business_count(db: Session = Depends(get_db)):
+async def get_business_count(request: Request, response: Response, db: Session = Depends(get_db)):
     """
     Fetch the total count of businesses.
     """
-    # Query to count the total number of businesses
-    business_count = db.query(func.count(Business.id)).scalar()
+    # The stamp starts with count(businesses.id), so it already is the answer
+    stamp = version_stamp(db, "businesses")
+    etag = make_etag("business-count", stamp)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
 
-    return business_count
+    return stamp[0]
 
 
 @router.get("/business-stats/{business_id}", dependencies=[Depends(verify_token)], tags=["Admin-Dashboard"])
 async def get_business_stats(
     business_id: int,
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: dict = Depends(role_required("t_admin"))
 ):
     """
     Get total machine count, total bottle count, and total bottle weight for a given business ID.
     """
+    etag = make_etag("business-stats", business_id, version_stamp(db, "businesses", "machines", "bottles"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
     # Validate the business
     business = db.query(Business).filter(Business.id == business_id).first()
     if not business:
         raise HTTPException(status_code=404, detail="Business not found")
 
-    # Subquery for bottle statistics grouped by machine
-    bottle_stats_subquery = (
-        db.query(
-            Bottle.machine_id.label("machine_id"),
-            func.sum(Bottle.bottle_count).label("total_bottle_count"),
-            func.sum(Bottle.bottle_weight).label("total_bottle_weight"),
-        )
-        .group_by(Bottle.machine_id)
-        .subquery()
-    )
-
     # Main query to calculate machine count
     machine_count_query = db.query(func.count(Machine.id).label("total_machines")).filter(Machine.business_id == business_id)
 
     # Fetch machine count
     total_machines = machine_count_query.scalar()
 
-    # Fetch aggregated bottle stats directly
+    # Aggregate the daily rollup of this business's machines only
     bottle_stats_query = (
         db.query(
-            func.coalesce(func.sum(bottle_stats_subquery.c.total_bottle_count), 0).label("total_bottle_count"),
-            func.coalesce(func.sum(bottle_stats_subquery.c.total_bottle_weight), 0.0).label("total_bottle_weight"),
+            func.coalesce(func.sum(BottleDailyRollup.bottle_count), 0).label("total_bottle_count"),
+            func.coalesce(func.sum(BottleDailyRollup.bottle_weight), 0.0).label("total_bottle_weight"),
         )
-        .join(Machine, Machine.id == bottle_stats_subquery.c.machine_id)
+        .join(Machine, Machine.id == BottleDailyRollup.machine_id)
         .filter(Machine.business_id == business_id)
     )
 
@@ -344,6 +391,62 @@ async def get_business_stats(
         "total_bottle_weight": total_bottle_weight,
     }
 
+@router.get("/business-stats", dependencies=[Depends(verify_token)], tags=["Admin-Dashboard"])
+async def get_business_stats_batch(
+    request: Request,
+    response: Response,
+    business_ids: Optional[List[int]] = Query(None, description="Businesses to report on (default: all)"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(role_required("t_admin"))
+):
+    """
+    Machine count, bottle count and bottle weight of many businesses at once, ordered by
+    business id and paged with skip/limit. One grouped query over the page's businesses.
+    Unknown ids are left out.
+    """
+    etag = make_etag("business-stats", sorted(business_ids or []), skip, limit, version_stamp(db, "businesses", "machines", "bottles"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
+    page = db.query(Business.id, Business.name).order_by(Business.id)
+    if business_ids:
+        page = page.filter(Business.id.in_(business_ids))
+    page = page.offset(skip).limit(limit).subquery()
+
+    # Machines are counted distinctly since each one joins to many rollup rows
+    stats = (
+        db.query(
+            page.c.id,
+            page.c.name,
+            func.count(func.distinct(Machine.id)).label("total_machines"),
+            func.coalesce(func.sum(BottleDailyRollup.bottle_count), 0).label("total_bottle_count"),
+            func.coalesce(func.sum(BottleDailyRollup.bottle_weight), 0.0).label("total_bottle_weight"),
+        )
+        .select_from(page)
+        .outerjoin(Machine, Machine.business_id == page.c.id)
+        .outerjoin(BottleDailyRollup, BottleDailyRollup.machine_id == Machine.id)
+        .group_by(page.c.id, page.c.name)
+        .order_by(page.c.id)
+        .all()
+    )
+
+    return {
+        "businesses": [
+            {
+                "business_id": stat.id,
+                "business_name": stat.name,
+                "total_machines": stat.total_machines,
+                "total_bottle_count": stat.total_bottle_count,
+                "total_bottle_weight": stat.total_bottle_weight,
+            }
+            for stat in stats
+        ]
+    }
+
+
 @router.put("/update_business/{business_id}", dependencies=[Depends(verify_token)], tags=["Admin-Business"])
 async def update_business(
     business_id: int,
@@ -401,10 +504,16 @@ async def update_business(
         business.name = business_data["name"]
     if "mobile" in business_data:
         business.mobile = business_data["mobile"]
+    if "timezone" in business_data:
+        # Applies to bottles stored from now on; existing days are not recomputed
+        business.timezone = validate_timezone(business_data["timezone"])
 
     business.updated_by = current_user["id"]  # Update the "updated_by" field
+    bump_version(db, "businesses", "users")
     db.commit()
     db.refresh(business)
+    business_timezones.invalidate(business.id)
+    response_cache.invalidate("business")  # Business names key /machines-per-business
 
     return JSONResponse(content={
         "message": "Business updated successfully",
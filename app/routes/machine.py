@@ -1,13 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
-from app.models import Machine, Business, User, Bottle
+from app.models import Machine, Business, User, MachineEmptying
 from app.schemas import MachineCreate, MachinesPerBusiness
 from app.database import get_db
 from datetime import datetime
 from app.core.security import role_required, verify_token
+from app.core.ingest import machine_cache
+from app.core.machine_auth import machine_credentials, get_machine_credentials
+from app.core.ingest import get_machine_business_ids
+from app.core.heartbeat import heartbeats
+from app.core.totals import running_totals
+from app.core.response_cache import response_cache
+from app.core.etag import bump_version, version_stamp, make_etag, etag_matches, not_modified, set_etag
+from app.core.snapshots import snapshots, machine_bottle_totals
 from sqlalchemy.orm import aliased
-from sqlalchemy import func
-from typing import Dict, List
+from sqlalchemy import func, update
+from typing import Dict, List, Optional
 from typing import List
 
 router = APIRouter()
@@ -37,21 +45,34 @@ async def create_machine(
         state=machine.state,
         pin_code=machine.pin_code,
         business_id=machine.business_id,
+        capacity=machine.capacity,
         created_by=current_user["id"],  # Changed from current_user.id
         updated_by=current_user["id"],  # Changed from current_user.id
     )
     db.add(db_machine)
+    bump_version(db, "machines")
     db.commit()
     db.refresh(db_machine)
+    machine_cache.invalidate(db_machine.id)
+    heartbeats.register(db_machine.id, db_machine.business_id)
+    running_totals.register(db_machine.id, db_machine.business_id)
+    response_cache.invalidate("machine")
     return db_machine
 
 # Get all machines
 @router.get("/machines/", dependencies=[Depends(verify_token)], tags=["Admin-Machines"])
 async def get_all_machines(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     db: Session = Depends(get_db),
 ):
+    etag = make_etag("machines", skip, limit, version_stamp(db, "machines", "businesses", "users"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
     # Query all machines with business name and user names
     machines = (
         db.query(
@@ -99,8 +120,15 @@ async def get_all_machines(
 @router.get("/machine/{machine_id}", dependencies=[Depends(verify_token)], tags=["Admin-Machines"])
 async def get_machine(
     machine_id: int,
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
 ):
+    etag = make_etag("machine", machine_id, version_stamp(db, "machines", "businesses", "users"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
     # Create aliases for the User table to join it twice
     creator = aliased(User)
     updater = aliased(User)
@@ -164,11 +192,21 @@ async def update_machine(
     db_machine.city = machine.city
     db_machine.state = machine.state
     db_machine.pin_code = machine.pin_code
+    db_machine.capacity = machine.capacity
+    business_changed = db_machine.business_id != machine.business_id
     db_machine.business_id = machine.business_id
     db_machine.updated_at = datetime.utcnow()
 
+    bump_version(db, "machines")
     db.commit()
     db.refresh(db_machine)
+    machine_cache.invalidate(machine_id)
+    # Machine tokens embed the business, so they must be reissued when it changes
+    if business_changed:
+        machine_credentials.revoke(db, machine_id)
+        heartbeats.register(machine_id, db_machine.business_id)
+        running_totals.register(machine_id, db_machine.business_id)
+        response_cache.invalidate("machine")
     return db_machine
 
 # Delete a machine
@@ -182,49 +220,92 @@ async def delete_machine(
         raise HTTPException(status_code=404, detail="Machine not found")
 
     db.delete(db_machine)
+    bump_version(db, "machines")
     db.commit()
+    machine_cache.invalidate(machine_id)
+    machine_credentials.revoke(db, machine_id)
+    heartbeats.forget(machine_id)
+    running_totals.forget(machine_id)
+    response_cache.invalidate("machine")
     return db_machine
 
-@router.get("/machines-count", response_model=int, dependencies=[Depends(verify_token)], tags=["Admin-Dashboard"])
-async def get_total_machines_count(db: Session = Depends(get_db)):
-    # Query to get the total count of machines
-    machine_count = db.query(func.count(Machine.id)).scalar()
 
-    if machine_count is None:
-        raise HTTPException(status_code=404, detail="No machines found")
+@router.post("/machines/{machine_id}/credentials", dependencies=[Depends(verify_token)], tags=["Admin-Machines"])
+async def issue_machine_credentials(
+    machine_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(role_required("t_admin"))
+):
+    """
+    Issue a signed ingestion token for a machine, to be sent in the X-Machine-Token header.
+    Issuing a new token rotates the credential: all previous tokens of the machine are revoked.
+    """
+    db_machine = db.query(Machine).filter(Machine.id == machine_id).first()
+    if db_machine is None:
+        raise HTTPException(status_code=404, detail="Machine not found")
+
+    token = machine_credentials.issue(db, db_machine.id, db_machine.business_id)
+    return {"machine_id": db_machine.id, "business_id": db_machine.business_id, "machine_token": token}
+
+
+@router.delete("/machines/{machine_id}/credentials", dependencies=[Depends(verify_token)], tags=["Admin-Machines"])
+async def revoke_machine_credentials(
+    machine_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(role_required("t_admin"))
+):
+    """
+    Revoke every ingestion token issued for a machine.
+    Other worker processes pick up the revocation on their next refresh.
+    """
+    machine_credentials.revoke(db, machine_id)
+    return {"message": "Machine credentials revoked", "machine_id": machine_id}
 
-    return machine_count
+@router.get("/machines-count", response_model=int, dependencies=[Depends(verify_token)], tags=["Admin-Dashboard"])
+async def get_total_machines_count(request: Request, response: Response, db: Session = Depends(get_db)):
+    # The stamp starts with count(machines.id), so it already is the answer
+    stamp = version_stamp(db, "machines")
+    etag = make_etag("machines-count", stamp)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
+    return stamp[0]
 
 
 @router.get("/machines/bottle-count", response_model=List[Dict[str, int]], dependencies=[Depends(verify_token)], tags=["Admin-Dashboard"])
-async def get_bottle_count_per_machine(db: Session = Depends(get_db)):
-    # Query the total bottle count per machine
+async def get_bottle_count_per_machine(request: Request, response: Response, db: Session = Depends(get_db)):
+    # Served from the machine_bottle_totals snapshot, refreshed in the background (app/core/snapshots.py)
+    refreshed_at = snapshots.refreshed_at(db, "machine_bottle_totals")
+    etag = make_etag("machines/bottle-count", refreshed_at)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+    snapshots.set_age(response, refreshed_at)
+
     result = (
-        db.query(
-            Bottle.machine_id,
-            func.sum(Bottle.bottle_count).label("total_bottle_count")
-        )
-        .group_by(Bottle.machine_id)  # Group by machine_id to get counts for each machine
-        .join(Machine, Bottle.machine_id == Machine.id)  # Join with Machine to get machine details if needed
-        .all()  # Fetch all results
+        db.query(machine_bottle_totals.c.machine_id, machine_bottle_totals.c.total_bottle_count)
+        .order_by(machine_bottle_totals.c.machine_id)
+        .all()
     )
 
-    # If no bottles are found, return an empty list
-    if not result:
-        raise HTTPException(status_code=404, detail="No bottles found")
-
-    # Format and return the result
+    # An empty snapshot (e.g. the one built at startup before any bottles) is an empty list
     return [
         {"machine_id": machine_id, "total_bottle_count": total_bottle_count or 0}
         for machine_id, total_bottle_count in result
     ]
 @router.get("/my-machines", response_model=List[MachinesPerBusiness], dependencies=[Depends(verify_token)], tags=["Customer-Machines"])
-async def get_machines_by_business(db: Session = Depends(get_db), payload: dict = Depends(verify_token)):
+async def get_machines_by_business(request: Request, response: Response, db: Session = Depends(get_db), payload: dict = Depends(verify_token)):
     """
     Fetch all machines associated with the current user's business.
     The user's business is fetched based on the JWT token.
     """
     user_id = payload.get("id")  # Assuming you store user_id in the token payload
+    etag = make_etag("my-machines", user_id, version_stamp(db, "machines", "businesses"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
     # Fetch the business owned by the current user
     business = db.query(Business).filter(Business.business_owner == user_id).first()
     if not business:
@@ -239,10 +320,20 @@ async def get_machines_by_business(db: Session = Depends(get_db), payload: dict
     return machines
 
 @router.get("/machines-per-business", response_model=dict, dependencies=[Depends(verify_token)], tags=["Admin-Dashboard"])
-async def get_machines_per_business(db: Session = Depends(get_db)):
+async def get_machines_per_business(request: Request, response: Response, db: Session = Depends(get_db)):
     """
     Fetch the count of machines for each business.
     """
+    etag = make_etag("machines-per-business", version_stamp(db, "machines", "businesses"))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
+    # Keyed by the ETag, so a write made by any worker makes the cached response unreachable
+    cached = response_cache.get("machines-per-business", etag)
+    if cached is not None:
+        return cached
+
     # Query to group machines by business and count them
     result = (
         db.query(Business.name.label("business_name"), func.count(Machine.id).label("machine_count"))
@@ -257,4 +348,118 @@ async def get_machines_per_business(db: Session = Depends(get_db)):
     # Convert the result into a dictionary
     machines_per_business = {row.business_name: row.machine_count for row in result}
 
+    response_cache.set("machines-per-business", machines_per_business, etag)
     return machines_per_business
+
+
+@router.post("/machines/{machine_id}/heartbeat", tags=["Machine-Fleet"])
+async def machine_heartbeat(
+    machine_id: int,
+    db: Session = Depends(get_db),
+    credentials: Optional[dict] = Depends(get_machine_credentials)
+):
+    """
+    Record that a machine is online. Only the in-memory last-seen table is updated;
+    timestamps are written to the database in bulk every HEARTBEAT_FLUSH_SECONDS.
+    """
+    if credentials is not None:
+        if credentials["machine_id"] != machine_id:
+            raise HTTPException(status_code=403, detail="Machine token is not valid for this machine")
+        business_id = credentials["business_id"]
+    else:
+        business_id = get_machine_business_ids(db, [machine_id]).get(machine_id)
+        if business_id is None:
+            raise HTTPException(status_code=404, detail="Machine not found")
+
+    heartbeats.beat(machine_id, business_id)
+    return {"status": "ok", "machine_id": machine_id}
+
+
+@router.get("/fleet-status", dependencies=[Depends(verify_token)], tags=["Admin-Dashboard"])
+async def get_fleet_status(business_id: Optional[int] = None):
+    """
+    Online, stale and offline machines per business, served from memory.
+    Machines are online if seen within HEARTBEAT_ONLINE_SECONDS and stale if seen
+    within HEARTBEAT_STALE_SECONDS; everything else is offline.
+    """
+    businesses = heartbeats.fleet_status(business_id)
+    return {
+        "online_seconds": int(heartbeats.online.total_seconds()),
+        "stale_seconds": int(heartbeats.stale.total_seconds()),
+        "businesses": businesses,
+    }
+
+
+@router.post("/machines/{machine_id}/emptied", dependencies=[Depends(verify_token)], tags=["Machine-Fleet"])
+async def machine_emptied(
+    machine_id: int,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(verify_token)
+):
+    """
+    Record that a collection crew emptied the machine and reset its fill level.
+    """
+    # Lock the machine row so bottles counted concurrently are not lost by the reset
+    db_machine = db.query(Machine).filter(Machine.id == machine_id).with_for_update().first()
+    if db_machine is None:
+        raise HTTPException(status_code=404, detail="Machine not found")
+
+    emptying = MachineEmptying(
+        machine_id=machine_id,
+        bottle_count=db_machine.fill_count,
+        emptied_by=current_user["id"],
+    )
+    db.add(emptying)
+    emptied_at = datetime.utcnow()
+    machines = Machine.__table__
+    db.execute(
+        update(machines)
+        .where(machines.c.id == machine_id)
+        # Subtract what was counted rather than reset to 0: bottles counted since the read are kept
+        # (SQLite ignores FOR UPDATE). Keep updated_at, like the fill_count increment on ingestion
+        .values(fill_count=machines.c.fill_count - emptying.bottle_count, last_emptied_at=emptied_at, updated_at=machines.c.updated_at)
+    )
+    db.commit()
+
+    return {
+        "message": "Machine emptied",
+        "machine_id": machine_id,
+        "bottles_removed": emptying.bottle_count,
+        "emptied_at": emptied_at,
+    }
+
+
+@router.get("/machines/fill-levels", dependencies=[Depends(verify_token)], tags=["Machine-Fleet"])
+async def get_machine_fill_levels(
+    threshold: float = 0.8,
+    business_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Machines filled to at least `threshold` of their capacity (0.8 = 80 %), fullest first.
+    Reads the fill counters maintained on ingestion; the bottles table is not scanned.
+    Machines without a capacity are not listed.
+    """
+    if threshold < 0:
+        raise HTTPException(status_code=400, detail="threshold must not be negative")
+
+    query = (
+        db.query(Machine)
+        .filter(Machine.capacity > 0, Machine.fill_count >= Machine.capacity * threshold)
+    )
+    if business_id is not None:
+        query = query.filter(Machine.business_id == business_id)
+    machines = query.order_by((Machine.fill_count * 1.0 / Machine.capacity).desc()).all()
+
+    return [
+        {
+            "machine_id": machine.id,
+            "name": machine.name,
+            "business_id": machine.business_id,
+            "capacity": machine.capacity,
+            "fill_count": machine.fill_count,
+            "fill_level": round(machine.fill_count / machine.capacity, 4),
+            "last_emptied_at": machine.last_emptied_at,
+        }
+        for machine in machines
+    ]
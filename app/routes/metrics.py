@@ -0,0 +1,76 @@
+from fastapi import APIRouter, Depends
+from app.core.security import verify_token
+from app.core.write_behind import write_behind
+from app.core.ingest import machine_cache
+from app.core.spool import spool
+from app.core.compaction import compactor
+from app.core.totals import running_totals
+from app.core.response_cache import response_cache
+from app.core.singleflight import aggregations
+from app.core.snapshots import snapshots
+
+router = APIRouter()
+
+
+@router.get("/metrics/write-behind", dependencies=[Depends(verify_token)], tags=["Admin-Metrics"])
+async def get_write_behind_metrics():
+    """
+    Queue depth, throughput and flush latency of the bottle write-behind buffer.
+    """
+    return write_behind.metrics()
+
+
+@router.get("/metrics/machine-cache", dependencies=[Depends(verify_token)], tags=["Admin-Metrics"])
+async def get_machine_cache_metrics():
+    """
+    Hit/miss counters of the machine_id -> business_id cache used by bottle ingestion.
+    """
+    return machine_cache.stats()
+
+
+@router.get("/metrics/spool", dependencies=[Depends(verify_token)], tags=["Admin-Metrics"])
+async def get_spool_metrics():
+    """
+    Backlog size, fsync count and replay progress of the durable bottle spool.
+    """
+    return spool.metrics()
+
+
+@router.get("/metrics/compaction", dependencies=[Depends(verify_token)], tags=["Admin-Metrics"])
+async def get_compaction_metrics():
+    """
+    Days and raw bottle rows archived by the compaction job.
+    """
+    return compactor.metrics()
+
+
+@router.get("/metrics/running-totals", dependencies=[Depends(verify_token)], tags=["Admin-Metrics"])
+async def get_running_totals_metrics():
+    """
+    Current running bottle totals and the drift found by the last reconciles.
+    """
+    return running_totals.metrics()
+
+
+@router.get("/metrics/response-cache", dependencies=[Depends(verify_token)], tags=["Admin-Metrics"])
+async def get_response_cache_metrics():
+    """
+    Hit ratio, size and evictions of the dashboard response cache, per endpoint.
+    """
+    return response_cache.stats()
+
+
+@router.get("/metrics/single-flight", dependencies=[Depends(verify_token)], tags=["Admin-Metrics"])
+async def get_single_flight_metrics():
+    """
+    Aggregation requests received, computations actually run and requests coalesced onto one in flight.
+    """
+    return aggregations.metrics()
+
+
+@router.get("/metrics/snapshots", dependencies=[Depends(verify_token)], tags=["Admin-Metrics"])
+async def get_snapshot_metrics():
+    """
+    Refresh counts and durations of the dashboard snapshots, and refreshes triggered by stale reads.
+    """
+    return snapshots.metrics()
@@ -51,6 +51,7 @@ class MachineCreate(BaseModel):
     state: str
     pin_code: str
     business_id: int
+    capacity: Optional[int] = None  # Bottles the machine holds before it must be emptied
 
     class Config:
         orm_mode = True
@@ -60,6 +61,7 @@ class BottleCreate(BaseModel):
     machine_id: int
     bottle_count: int
     bottle_weight: float
+    event_seq: Optional[int] = None  # Per-machine sequence number; retries with the same value are ignored
     is_deleted: bool = False
 
     class Config:
@@ -80,6 +82,7 @@ class ResetPasswordRequest(BaseModel):
 class BusinessUpdate(BaseModel):
     name: str = Field(..., max_length=100, example="Updated Business Name")
     mobile: str = Field(..., pattern="^[0-9]{10}$", example="9876543210")
+    timezone: Optional[str] = Field(None, example="Asia/Kolkata")  # Timezone bottle days are counted in
       
 class MachinesPerBusiness(BaseModel):
     id: int
@@ -0,0 +1,78 @@
+"""
+Throughput of single-row bottle ingestion (POST /create_bottle/) against the
+batch endpoint (POST /create_bottles/batch).
+
+Usage:
+    python -m benchmarks.bench_bottle_ingest --events 5000 --batch-size 500
+"""
+import argparse
+import asyncio
+import random
+
+from benchmarks.common import Timer, reset_schema, seed_fleet
+from app.database import SessionLocal
+from app.routes.bottles import create_bottle, create_bottles_batch
+from app.schemas import BottleCreate
+
+
+def make_readings(machine_ids, count):
+    return [
+        BottleCreate(
+            machine_id=random.choice(machine_ids),
+            bottle_count=random.randint(1, 20),
+            bottle_weight=round(random.uniform(0.1, 5.0), 3),
+        )
+        for _ in range(count)
+    ]
+
+
+async def run_single(readings):
+    db = SessionLocal()
+    try:
+        with Timer() as timer:
+            for reading in readings:
+                await create_bottle(reading, db, credentials=None)
+    finally:
+        db.close()
+    return timer.elapsed
+
+
+async def run_batch(readings, batch_size):
+    db = SessionLocal()
+    try:
+        with Timer() as timer:
+            for start in range(0, len(readings), batch_size):
+                await create_bottles_batch(readings[start:start + batch_size], db, credentials=None)
+    finally:
+        db.close()
+    return timer.elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--businesses", type=int, default=10)
+    parser.add_argument("--machines", type=int, default=10, help="Machines per business")
+    args = parser.parse_args()
+
+    reset_schema()
+    db = SessionLocal()
+    try:
+        machine_ids = seed_fleet(db, args.businesses, args.machines)
+    finally:
+        db.close()
+
+    readings = make_readings(machine_ids, args.events)
+
+    single = asyncio.run(run_single(readings))
+    batch = asyncio.run(run_batch(readings, args.batch_size))
+
+    print(f"{'path':<12}{'events':>10}{'seconds':>12}{'events/s':>14}")
+    print(f"{'single':<12}{args.events:>10}{single:>12.3f}{args.events / single:>14.0f}")
+    print(f"{'batch':<12}{args.events:>10}{batch:>12.3f}{args.events / batch:>14.0f}")
+    print(f"speed-up: {single / batch:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Scaling of /daywise-bottle-stats with businesses x days x machines.
+
+For every combination of the given sizes the script seeds a fleet and a daily
+rollup in which a share of the machines had bottles on each day, then times the
+endpoint against the per-business loop it replaced (one machine query per business
+plus linear any() scans to zero-fill). It prints the median latency and the number
+of SQL statements each version issued.
+
+Usage:
+    python -m benchmarks.bench_daywise_scaling --businesses 10,100,300 --days 30,365 --machines 5,20
+"""
+import argparse
+import asyncio
+import random
+import statistics
+from datetime import date, timedelta
+
+from sqlalchemy import event, insert
+
+from benchmarks.common import Timer, engine, reset_schema, seed_fleet
+from app.database import SessionLocal
+from app.core.snapshots import snapshots
+from app.models import Business, BottleDailyRollup, Machine
+from app.routes.bottles import get_daywise_bottle_stats_all_businesses
+
+
+def seed_rollup(machine_ids, days, density, today):
+    """Rollup rows for `density` of the machines on each of the last `days` days."""
+    rows = []
+    with engine.begin() as conn:
+        for offset in range(days):
+            day = today - timedelta(days=offset)
+            for machine_id in machine_ids:
+                if random.random() < density:
+                    rows.append({
+                        "day": day,
+                        "machine_id": machine_id,
+                        "bottle_count": random.randint(1, 500),
+                        "bottle_weight": round(random.uniform(1, 500), 3),
+                    })
+            if len(rows) >= 10000:
+                conn.execute(insert(BottleDailyRollup.__table__), rows)
+                rows = []
+        if rows:
+            conn.execute(insert(BottleDailyRollup.__table__), rows)
+
+
+def legacy_daywise(db, start, end):
+    """The pre-rewrite algorithm, restricted to the same window for a fair comparison."""
+    stats = (
+        db.query(
+            BottleDailyRollup.day.label("date"),
+            Machine.id.label("machine_id"),
+            Machine.name.label("machine_name"),
+            BottleDailyRollup.bottle_count.label("total_bottles"),
+            BottleDailyRollup.bottle_weight.label("total_weight"),
+            Business.name.label("business_name"),
+        )
+        .join(Machine, BottleDailyRollup.machine_id == Machine.id)
+        .join(Business, Machine.business_id == Business.id)
+        .filter(BottleDailyRollup.day >= start, BottleDailyRollup.day <= end)
+        .order_by(BottleDailyRollup.day.desc(), Machine.id)
+        .all()
+    )
+    result = {}
+    for stat in stats:
+        result.setdefault(stat.date.isoformat(), {}).setdefault(stat.business_name, []).append({
+            "machine_id": stat.machine_id,
+            "machine_name": stat.machine_name,
+            "total_bottles": stat.total_bottles,
+            "total_weight": stat.total_weight,
+        })
+    for business in db.query(Business).all():
+        machines = db.query(Machine).filter(Machine.business_id == business.id).all()
+        for day in result:
+            entries = result[day].setdefault(business.name, [])
+            for machine in machines:
+                if not any(m["machine_id"] == machine.id for m in entries):
+                    entries.append({"machine_id": machine.id, "machine_name": machine.name, "total_bottles": 0, "total_weight": 0.0})
+    return result
+
+
+def measure(call, repeat):
+    """(median seconds, statements per call) of a function taking a session."""
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    timings = []
+    for attempt in range(repeat):
+        db = SessionLocal()
+        try:
+            if attempt == 0:
+                event.listen(engine, "before_cursor_execute", count)
+            with Timer() as timer:
+                call(db)
+        finally:
+            if attempt == 0:
+                event.remove(engine, "before_cursor_execute", count)
+            db.close()
+        timings.append(timer.elapsed)
+    return statistics.median(timings), len(statements)
+
+
+def sizes(value):
+    return [int(size) for size in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--businesses", type=sizes, default=[10, 100, 300])
+    parser.add_argument("--days", type=sizes, default=[30, 365])
+    parser.add_argument("--machines", type=sizes, default=[5, 20], help="Machines per business")
+    parser.add_argument("--density", type=float, default=0.7, help="Share of machines with bottles on a day")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    today = date.today()
+    print(f"{'businesses':>10}{'days':>6}{'machines':>10}{'grid cells':>12}"
+          f"{'new ms':>10}{'new SQL':>9}{'legacy ms':>11}{'legacy SQL':>12}{'speed-up':>10}")
+
+    for businesses in args.businesses:
+        for machines in args.machines:
+            reset_schema()
+            db = SessionLocal()
+            try:
+                machine_ids = seed_fleet(db, businesses, machines)
+            finally:
+                db.close()
+            seed_rollup(machine_ids, max(args.days), args.density, today)
+            snapshots.refresh_due(engine, force=True)
+            snapshots.max_age_seconds = float("inf")  # Serve the snapshot built after seeding for the whole run
+
+            for days in args.days:
+                start = today - timedelta(days=days - 1)
+                new_seconds, new_statements = measure(
+                    lambda db: asyncio.run(get_daywise_bottle_stats_all_businesses(
+                        request=None, response=None, skip=0, limit=businesses, start=start, end=today, db=db
+                    )),
+                    args.repeat,
+                )
+                legacy_seconds, legacy_statements = measure(lambda db: legacy_daywise(db, start, today), args.repeat)
+                print(f"{businesses:>10}{days:>6}{machines:>10}{businesses * machines * days:>12}"
+                      f"{new_seconds * 1000:>10.1f}{new_statements:>9}{legacy_seconds * 1000:>11.1f}{legacy_statements:>12}"
+                      f"{legacy_seconds / new_seconds if new_seconds else float('inf'):>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
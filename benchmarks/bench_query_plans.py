@@ -0,0 +1,196 @@
+"""
+Query plans and latencies of the dashboard endpoints before and after the
+bottle/machine/business indexes are created.
+
+The script seeds a synthetic fleet, drops the indexes under test, runs every
+endpoint, then creates the indexes the same way the startup migration does and
+runs them again. For each endpoint it prints the median latency and the plan of
+every SQL statement the endpoint issued.
+
+Usage:
+    python -m benchmarks.bench_query_plans --rows 2000000 --businesses 200 --machines 10
+"""
+import argparse
+import asyncio
+import random
+import statistics
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, insert, text
+
+from benchmarks.common import Timer, engine, reset_schema, seed_fleet
+from app.database import SessionLocal
+from app.core.snapshots import snapshots
+from app.migrations import create_missing_indexes
+from app.models import Bottle, Business, DEFAULT_BUSINESS_TIMEZONE
+from app.core.ingest import local_date
+from app.core.rollup import rebuild_daily_rollup
+from app.core.response_cache import response_cache
+from app.routes.admin import router as admin_router
+from app.routes.bottles import router as bottle_router
+from app.routes.business import router as business_router
+from app.routes.machine import router as machine_router
+
+INDEXES_UNDER_TEST = [
+    ("bottles", "ix_bottles_machine_created_at"),
+    ("bottles", "ix_bottles_created_at"),
+    ("bottles", "ix_bottles_machine_local_date"),
+    ("bottles", "ix_bottles_local_date"),
+    ("machines", "ix_machines_business_id"),
+    ("machines", "ix_machines_number"),
+    ("businesses", "ix_businesses_business_owner"),
+    ("businesses", "ix_businesses_name"),
+]
+
+EXPLAIN_PREFIX = {
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "postgresql": "EXPLAIN ",
+    "mysql": "EXPLAIN ",
+}
+
+
+def endpoint(router, path):
+    return next(route.endpoint for route in router.routes if route.path == path)
+
+
+def dashboard_calls(owner_id, business_id):
+    """(name, coroutine factory taking a session) for every dashboard read endpoint."""
+    owner = {"id": owner_id, "role": "t_customer"}
+    admin = {"id": 1, "role": "t_admin"}
+    return [
+        ("/bottle-stats", lambda db: endpoint(bottle_router, "/bottle-stats")(request=None, response=None, db=db)),
+        ("/my-bottle-stats", lambda db: endpoint(bottle_router, "/my-bottle-stats")(request=None, response=None, db=db, current_user=owner)),
+        ("/my-daywise-bottle-stats", lambda db: endpoint(bottle_router, "/my-daywise-bottle-stats")(request=None, response=None, start=None, end=None, db=db, current_user=owner)),
+        ("/daywise-bottle-stats", lambda db: endpoint(bottle_router, "/daywise-bottle-stats")(request=None, response=None, skip=0, limit=100, start=None, end=None, db=db)),
+        ("/bottles/", lambda db: endpoint(bottle_router, "/bottles/")(request=None, response=None, skip=0, limit=100, start=None, end=None, db=db)),
+        ("/machines/bottle-count", lambda db: endpoint(machine_router, "/machines/bottle-count")(request=None, response=None, db=db)),
+        ("/machines-per-business", lambda db: endpoint(machine_router, "/machines-per-business")(request=None, response=None, db=db)),
+        ("/my-machines", lambda db: endpoint(machine_router, "/my-machines")(request=None, response=None, db=db, payload=owner)),
+        ("/business-stats/{business_id}", lambda db: endpoint(business_router, "/business-stats/{business_id}")(business_id=business_id, request=None, response=None, db=db, current_user=admin)),
+        ("/admin/dashboard", lambda db: endpoint(admin_router, "/admin/dashboard")(start=None, end=None, current_user=admin)),
+    ]
+
+
+def seed_bottles(machine_ids, rows, days):
+    """Insert `rows` raw readings spread over the last `days` days, then build the rollup."""
+    now = datetime.utcnow()
+    chunk = []
+    with engine.begin() as conn:
+        for _ in range(rows):
+            created_at = now - timedelta(seconds=random.randint(0, days * 86400))
+            chunk.append({
+                "machine_id": random.choice(machine_ids),
+                "bottle_count": random.randint(1, 20),
+                "bottle_weight": round(random.uniform(0.1, 5.0), 3),
+                "created_by": 1,
+                "updated_by": 1,
+                "created_at": created_at,
+                "local_date": local_date(created_at, DEFAULT_BUSINESS_TIMEZONE),
+                "updated_at": created_at,
+            })
+            if len(chunk) == 10000:
+                conn.execute(insert(Bottle.__table__), chunk)
+                chunk = []
+        if chunk:
+            conn.execute(insert(Bottle.__table__), chunk)
+
+    db = SessionLocal()
+    try:
+        rebuild_daily_rollup(db)
+    finally:
+        db.close()
+
+
+def drop_indexes():
+    with engine.begin() as conn:
+        for table, name in INDEXES_UNDER_TEST:
+            if engine.dialect.name == "mysql":
+                conn.execute(text(f"DROP INDEX {name} ON {table}"))
+            else:
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def measure(calls, repeat):
+    """Median latency per endpoint plus the plans of the statements it ran."""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    results = {}
+    for name, call in calls:
+        timings = []
+        for attempt in range(repeat):
+            db = SessionLocal()
+            # Time the queries, not the dashboard response cache
+            response_cache.clear()
+            try:
+                if attempt == 0:
+                    event.listen(engine, "before_cursor_execute", capture)
+                with Timer() as timer:
+                    try:
+                        asyncio.run(call(db))
+                    except Exception as e:  # e.g. 404 for an empty result
+                        print(f"  {name}: {e!r}")
+            finally:
+                if attempt == 0:
+                    event.remove(engine, "before_cursor_execute", capture)
+                db.close()
+            timings.append(timer.elapsed)
+
+        plans = []
+        with engine.connect() as conn:
+            for statement, parameters in statements:
+                prefix = EXPLAIN_PREFIX.get(engine.dialect.name)
+                if prefix and statement.lstrip().upper().startswith("SELECT"):
+                    plan = conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+                    plans.append("\n".join("    " + " | ".join(str(col) for col in row) for row in plan))
+        statements.clear()
+        results[name] = (statistics.median(timings), plans)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2_000_000, help="Raw bottle readings to seed")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--businesses", type=int, default=200)
+    parser.add_argument("--machines", type=int, default=10, help="Machines per business")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    reset_schema()
+    db = SessionLocal()
+    try:
+        machine_ids = seed_fleet(db, args.businesses, args.machines)
+        business = db.query(Business).first()
+        owner_id, business_id = business.business_owner, business.id
+    finally:
+        db.close()
+    seed_bottles(machine_ids, args.rows, args.days)
+    snapshots.refresh_due(engine, force=True)
+    snapshots.max_age_seconds = float("inf")  # Serve the snapshot built after seeding for the whole run
+
+    calls = dashboard_calls(owner_id, business_id)
+
+    drop_indexes()
+    before = measure(calls, args.repeat)
+    create_missing_indexes(engine)
+    after = measure(calls, args.repeat)
+
+    print(f"\n{args.rows} bottles, {len(machine_ids)} machines, {args.businesses} businesses on {engine.dialect.name}\n")
+    print(f"{'endpoint':<34}{'before ms':>12}{'after ms':>12}{'speed-up':>10}")
+    for name, _ in calls:
+        b, a = before[name][0] * 1000, after[name][0] * 1000
+        print(f"{name:<34}{b:>12.2f}{a:>12.2f}{b / a if a else float('inf'):>9.1f}x")
+
+    for name, _ in calls:
+        print(f"\n== {name}")
+        for label, plans in (("before", before[name][1]), ("after", after[name][1])):
+            print(f"  -- {label}")
+            for plan in plans:
+                print(plan)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Shared helpers for the benchmark scripts.
+
+The benchmarks talk to whatever database the DATABASE environment variable points at,
+so never run them against production. When DATABASE is not set a local SQLite file is
+used (this needs the `aiosqlite` driver for the `databases` package to import).
+"""
+import os
+import time
+
+os.environ.setdefault("DATABASE", "sqlite:///./bench.db")
+
+from app.database import Base, engine  # noqa: E402
+from app.models import User, Business, Machine  # noqa: E402
+from app.core.snapshots import snapshots  # noqa: E402
+
+
+def reset_schema():
+    """Drop and recreate every table so each run starts from an empty database."""
+    # The dashboard snapshots depend on the rollup (materialized views on PostgreSQL)
+    snapshots.drop(engine)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+
+def seed_fleet(db, businesses: int, machines_per_business: int):
+    """
+    Create one admin user and the requested number of businesses and machines.
+    Returns the list of created machine ids.
+    """
+    admin = User(id=1, email="bench-admin", password="x", role="t_admin", created_by=1, updated_by=1)
+    db.add(admin)
+    db.flush()
+
+    machine_ids = []
+    for b in range(businesses):
+        business = Business(name=f"Business {b}", mobile=f"9{b:09d}", business_owner=1, created_by=1, updated_by=1)
+        db.add(business)
+        db.flush()
+        for m in range(machines_per_business):
+            machine = Machine(
+                name=f"Machine {b}-{m}",
+                number=f"M-{b}-{m}",
+                street="Street",
+                city="City",
+                state="State",
+                pin_code="000000",
+                business_id=business.id,
+                created_by=1,
+                updated_by=1,
+            )
+            db.add(machine)
+            db.flush()
+            machine_ids.append(machine.id)
+
+    db.commit()
+    return machine_ids
+
+
+class Timer:
+    """Context manager measuring wall-clock time in seconds."""
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
@@ -0,0 +1,92 @@
+"""
+Shared fixtures. The tests run against a throwaway SQLite file: DATABASE is set before
+the app is imported, and load_dotenv never overrides variables that are already set.
+"""
+import os
+import tempfile
+
+os.environ["DATABASE"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="bottle-tests-"), "test.db")
+os.environ["MACHINE_TOKEN_SECRET"] = "test-machine-token-secret"
+
+import pytest  # noqa: E402
+from sqlalchemy import event, inspect, text  # noqa: E402
+from app.database import Base, engine, SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import User, Business, Machine  # noqa: E402
+from app.core.ingest import machine_cache, recent_events, business_timezones  # noqa: E402
+from app.core.response_cache import response_cache  # noqa: E402
+from app.core.security import create_access_token  # noqa: E402
+from app.core.partitions import MONTH_TABLE, bottle_partitions  # noqa: E402
+from app.core.snapshots import snapshots  # noqa: E402
+from app.core.totals import running_totals  # noqa: E402
+
+
+# MySQL enforces foreign keys; make SQLite do the same so refused rows can be tested
+@event.listens_for(engine, "connect")
+def _enable_foreign_keys(dbapi_connection, connection_record):
+    dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+
+engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def clean_database():
+    """Start every test from empty tables and empty in-process caches."""
+    snapshots.drop(engine)
+    Base.metadata.drop_all(bind=engine)
+    with engine.begin() as conn:
+        for name in inspect(conn).get_table_names():
+            if MONTH_TABLE.match(name):
+                conn.execute(text(f"DROP TABLE {name}"))
+    Base.metadata.create_all(bind=engine)
+    bottle_partitions.refresh(engine)
+    for cache in (machine_cache, recent_events, business_timezones):
+        cache.clear()
+    response_cache.clear()
+    running_totals.loaded = False
+    yield
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def fleet(db):
+    """One admin, one business and two machines. Returns (business_id, [machine_id, ...])."""
+    db.add(User(id=1, email="admin@example.com", password="x", role="t_admin", created_by=1, updated_by=1))
+    db.flush()
+    business = Business(name="Business", mobile="9000000000", business_owner=1, created_by=1, updated_by=1)
+    db.add(business)
+    db.flush()
+    machine_ids = []
+    for number in range(2):
+        machine = Machine(
+            name=f"Machine {number}", number=f"M-{number}", street="Street", city="City",
+            state="State", pin_code="000000", business_id=business.id, created_by=1, updated_by=1,
+        )
+        db.add(machine)
+        db.flush()
+        machine_ids.append(machine.id)
+    db.commit()
+    return business.id, machine_ids
+
+
+@pytest.fixture
+def admin_headers():
+    token = create_access_token({"sub": "admin@example.com", "role": "t_admin", "id": 1})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+
+    # Not used as a context manager: the background services are not started
+    return TestClient(app)
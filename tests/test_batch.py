@@ -0,0 +1,34 @@
+from app.models import Bottle
+from app.routes.bottles import MAX_BATCH_SIZE
+
+
+def reading(machine_id, bottle_count=1, event_seq=None):
+    return {"machine_id": machine_id, "bottle_count": bottle_count, "bottle_weight": 0.5, "event_seq": event_seq}
+
+
+def test_batch_stores_readings_of_many_machines(client, db, fleet):
+    _, (first, second) = fleet
+
+    response = client.post("/create_bottles/batch", json=[reading(first, 2), reading(second, 3), reading(first, 4)])
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["created"], body["failed"]) == (3, 0)
+    assert sorted((row.machine_id, row.bottle_count) for row in db.query(Bottle)) == [(first, 2), (first, 4), (second, 3)]
+
+
+def test_unknown_machines_are_reported_per_reading(client, db, fleet):
+    _, (machine_id, _) = fleet
+
+    body = client.post("/create_bottles/batch", json=[reading(machine_id), reading(999)]).json()
+
+    assert (body["created"], body["failed"]) == (1, 1)
+    assert body["results"][1] == {"index": 1, "machine_id": 999, "event_seq": None, "status": "error", "detail": "Machine not found"}
+    assert db.query(Bottle).count() == 1
+
+
+def test_empty_and_oversized_batches_are_refused(client, fleet):
+    _, (machine_id, _) = fleet
+
+    assert client.post("/create_bottles/batch", json=[]).status_code == 400
+    assert client.post("/create_bottles/batch", json=[reading(machine_id)] * (MAX_BATCH_SIZE + 1)).status_code == 400
@@ -0,0 +1,45 @@
+from datetime import datetime
+from app.core.ingest import build_bottle_row, store_bottle_rows
+from app.models import Business
+
+
+def test_batch_stats_match_the_single_business_stats(client, admin_headers, db, fleet):
+    business_id, (first, second) = fleet
+    db.add(Business(name="Empty business", mobile="9000000003", business_owner=1, created_by=1, updated_by=1))
+    db.commit()
+    store_bottle_rows(db, [
+        build_bottle_row(first, 2, 1.0, business_id, datetime(2024, 3, 1, 6, 0)),
+        build_bottle_row(first, 3, 1.5, business_id, datetime(2024, 3, 2, 6, 0)),
+        build_bottle_row(second, 4, 2.0, business_id, datetime(2024, 3, 2, 6, 0)),
+    ])
+
+    batch = client.get("/business-stats", headers=admin_headers)
+    single = client.get(f"/business-stats/{business_id}", headers=admin_headers)
+
+    assert batch.status_code == 200
+    businesses = batch.json()["businesses"]
+    assert businesses[0] == single.json()
+    # Machines are counted once, not once per rollup row
+    assert businesses[0]["total_machines"] == 2
+    assert businesses[0]["total_bottle_count"] == 9
+    assert businesses[0]["total_bottle_weight"] == 4.5
+    assert businesses[1]["business_name"] == "Empty business"
+    assert (businesses[1]["total_machines"], businesses[1]["total_bottle_count"]) == (0, 0)
+
+
+def test_batch_stats_filter_and_page_by_id(client, admin_headers, db, fleet):
+    business_id, _ = fleet
+    for number in range(2):
+        db.add(Business(name=f"Business {number}", mobile=f"900000001{number}", business_owner=1, created_by=1, updated_by=1))
+    db.commit()
+
+    def ids(**params):
+        response = client.get("/business-stats", params=params, headers=admin_headers)
+        return [entry["business_id"] for entry in response.json()["businesses"]]
+
+    assert ids(business_ids=[business_id + 2, business_id, 999]) == [business_id, business_id + 2]
+    assert ids(skip=1, limit=1) == [business_id + 1]
+
+
+def test_unknown_single_business_is_not_found(client, admin_headers, fleet):
+    assert client.get("/business-stats/999", headers=admin_headers).status_code == 404
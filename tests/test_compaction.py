@@ -0,0 +1,54 @@
+import csv
+import gzip
+from datetime import date, datetime
+from app.core.compaction import BottleCompactor
+from app.core.ingest import build_bottle_row, store_bottle_rows
+from app.core.rollup import rebuild_daily_rollup
+from app.models import Bottle, BottleCompaction, BottleDailyRollup
+
+
+def make_compactor(tmp_path) -> BottleCompactor:
+    return BottleCompactor(enabled=True, after_days=90, directory=str(tmp_path), delete_batch=2, interval_seconds=3600)
+
+
+def store(db, fleet, created_at, bottle_count):
+    business_id, (machine_id, _) = fleet
+    store_bottle_rows(db, [build_bottle_row(machine_id, bottle_count, 0.5, business_id, created_at)])
+
+
+def day_total(db, day):
+    return db.query(BottleDailyRollup.bottle_count).filter(BottleDailyRollup.day == day).scalar()
+
+
+def test_old_days_are_archived_and_keep_their_totals(tmp_path, db, fleet):
+    for count in (1, 2, 3):
+        store(db, fleet, datetime(2024, 1, 10, 8, 0), count)
+    store(db, fleet, datetime(2024, 5, 1, 8, 0), 4)
+
+    assert make_compactor(tmp_path).run_once(today=date(2024, 5, 2)) == 3
+
+    assert [count for (count,) in db.query(Bottle.bottle_count)] == [4]
+    assert day_total(db, date(2024, 1, 10)) == 6
+    record = db.get(BottleCompaction, date(2024, 1, 10))
+    assert record.rows_archived == 3
+    with gzip.open(record.archive_path, "rt", newline="") as archive:
+        rows = list(csv.DictReader(archive))
+    assert sorted(int(row["bottle_count"]) for row in rows) == [1, 2, 3]
+
+    # A full rebuild leaves the compacted day alone
+    rebuild_daily_rollup(db)
+    assert day_total(db, date(2024, 1, 10)) == 6
+
+
+def test_late_readings_of_compacted_days_are_added_and_archived(tmp_path, db, fleet):
+    compactor = make_compactor(tmp_path)
+    store(db, fleet, datetime(2024, 1, 10, 8, 0), 1)
+    compactor.run_once(today=date(2024, 5, 2))
+
+    store(db, fleet, datetime(2024, 1, 10, 9, 0), 5)
+    assert day_total(db, date(2024, 1, 10)) == 6
+
+    assert compactor.run_once(today=date(2024, 5, 3)) == 1
+    assert db.query(Bottle).count() == 0
+    assert day_total(db, date(2024, 1, 10)) == 6
+    assert db.get(BottleCompaction, date(2024, 1, 10)).rows_archived == 2
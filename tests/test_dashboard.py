@@ -0,0 +1,42 @@
+from datetime import datetime
+from app.core.ingest import build_bottle_row, store_bottle_rows
+from app.models import Business
+
+
+def test_dashboard_reports_every_kpi_in_one_response(client, admin_headers, db, fleet):
+    business_id, (first, second) = fleet
+    db.add(Business(name="Empty business", mobile="9000000003", business_owner=1, created_by=1, updated_by=1))
+    db.commit()
+    store_bottle_rows(db, [
+        build_bottle_row(first, 2, 1.0, business_id, datetime(2024, 3, 1, 6, 0)),
+        build_bottle_row(first, 3, 1.5, business_id, datetime(2024, 3, 2, 6, 0)),
+    ])
+
+    dashboard = client.get("/admin/dashboard", headers=admin_headers)
+
+    assert dashboard.status_code == 200
+    body = dashboard.json()
+    assert (body["machine_count"], body["business_count"]) == (2, 2)
+    assert (body["total_count"], body["total_weight"]) == (5, 2.5)
+    assert body["machines_per_business"] == {"Business": 2}
+    assert [(entry["machine_id"], entry["total_bottle_count"]) for entry in body["machine_bottle_counts"]] == [(first, 5), (second, 0)]
+
+
+def test_dashboard_bottle_figures_follow_the_window(client, admin_headers, db, fleet):
+    business_id, (first, _) = fleet
+    store_bottle_rows(db, [
+        build_bottle_row(first, 2, 1.0, business_id, datetime(2024, 3, 1, 6, 0)),
+        build_bottle_row(first, 3, 1.5, business_id, datetime(2024, 3, 2, 6, 0)),
+    ])
+
+    body = client.get("/admin/dashboard", params={"from": "2024-03-02", "to": "2024-03-02"}, headers=admin_headers).json()
+
+    assert (body["from"], body["to"]) == ("2024-03-02", "2024-03-02")
+    assert body["total_count"] == 3
+    # Machines without bottles in the window are still counted
+    assert body["machine_count"] == 2
+
+
+def test_dashboard_rejects_an_inverted_window(client, admin_headers, fleet):
+    response = client.get("/admin/dashboard", params={"from": "2024-03-02", "to": "2024-03-01"}, headers=admin_headers)
+    assert response.status_code == 400
@@ -0,0 +1,68 @@
+from datetime import datetime
+from app.core.ingest import build_bottle_row, store_bottle_rows
+from app.models import Business
+
+
+def store(db, fleet, machine_index, created_at, bottle_count):
+    business_id, machine_ids = fleet
+    store_bottle_rows(db, [build_bottle_row(machine_ids[machine_index], bottle_count, 0.5 * bottle_count, business_id, created_at)])
+
+
+def test_my_daywise_stats_fill_every_day_and_machine(client, admin_headers, db, fleet):
+    _, (first, second) = fleet
+    store(db, fleet, 0, datetime(2024, 3, 1, 6, 0), 2)
+    store(db, fleet, 0, datetime(2024, 3, 1, 7, 0), 3)
+    store(db, fleet, 1, datetime(2024, 3, 3, 6, 0), 1)
+    store(db, fleet, 1, datetime(2024, 3, 9, 6, 0), 9)  # Outside the window
+
+    response = client.get("/my-daywise-bottle-stats", params={"from": "2024-03-01", "to": "2024-03-03"}, headers=admin_headers)
+
+    assert response.status_code == 200
+    stats = {
+        day: [(entry["machine_id"], entry["total_bottles"], entry["total_weight"]) for entry in entries]
+        for day, entries in response.json().items()
+    }
+    assert list(stats) == ["2024-03-03", "2024-03-02", "2024-03-01"]
+    assert stats == {
+        "2024-03-03": [(first, 0, 0.0), (second, 1, 0.5)],
+        "2024-03-02": [(first, 0, 0.0), (second, 0, 0.0)],
+        "2024-03-01": [(first, 5, 2.5), (second, 0, 0.0)],
+    }
+
+
+def test_my_daywise_stats_windows_are_validated(client, admin_headers, fleet):
+    def get(**params):
+        return client.get("/my-daywise-bottle-stats", params=params, headers=admin_headers)
+
+    assert get(**{"from": "2024-03-02", "to": "2024-03-01"}).status_code == 400
+    assert get(**{"from": "2023-01-01", "to": "2024-03-01"}).status_code == 400
+    # Without a range the last 30 days are listed
+    assert len(get().json()) == 30
+
+
+def test_all_business_daywise_stats_list_every_business_and_machine(client, admin_headers, db, fleet):
+    _, (first, second) = fleet
+    db.add(Business(name="Empty business", mobile="9000000003", business_owner=1, created_by=1, updated_by=1))
+    db.commit()
+    store(db, fleet, 0, datetime(2024, 3, 1, 6, 0), 2)
+    store(db, fleet, 1, datetime(2024, 3, 2, 6, 0), 4)
+
+    response = client.get("/daywise-bottle-stats", params={"from": "2024-03-01", "to": "2024-03-02"}, headers=admin_headers)
+
+    assert response.status_code == 200
+    assert "X-Snapshot-Age" in response.headers
+    stats = response.json()
+    assert list(stats) == ["2024-03-02", "2024-03-01"]
+    assert stats["2024-03-01"]["Empty business"] == []
+    assert [(entry["machine_id"], entry["total_bottles"]) for entry in stats["2024-03-01"]["Business"]] == [(first, 2), (second, 0)]
+    assert [(entry["machine_id"], entry["total_bottles"]) for entry in stats["2024-03-02"]["Business"]] == [(first, 0), (second, 4)]
+
+
+def test_all_business_daywise_stats_are_paginated(client, admin_headers, db, fleet):
+    db.add(Business(name="Second business", mobile="9000000003", business_owner=1, created_by=1, updated_by=1))
+    db.commit()
+
+    params = {"from": "2024-03-01", "to": "2024-03-01", "skip": 1, "limit": 1}
+    stats = client.get("/daywise-bottle-stats", params=params, headers=admin_headers).json()
+
+    assert list(stats["2024-03-01"]) == ["Second business"]
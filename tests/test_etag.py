@@ -0,0 +1,73 @@
+from app.core.etag import bump_version, version_stamp
+from app.core.ingest import build_bottle_row, store_bottle_rows
+from app.models import Machine
+
+
+def machine_payload(business_id, number, name="Machine"):
+    return {
+        "name": name, "number": number, "street": "Street", "city": "City",
+        "state": "State", "pin_code": "000000", "business_id": business_id,
+    }
+
+
+def test_unchanged_read_answers_304(client, admin_headers, fleet):
+    first = client.get("/machines-count", headers=admin_headers)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+
+    again = client.get("/machines-count", headers={**admin_headers, "If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+
+
+def test_api_write_changes_the_etag(client, admin_headers, fleet):
+    business_id, (machine_id, _) = fleet
+    etag = client.get(f"/machine/{machine_id}", headers=admin_headers).headers["ETag"]
+
+    updated = client.put(f"/machines/{machine_id}", json=machine_payload(business_id, "M-0", "Renamed"), headers=admin_headers)
+    assert updated.status_code == 200
+
+    after = client.get(f"/machine/{machine_id}", headers={**admin_headers, "If-None-Match": etag})
+    assert after.status_code == 200
+    assert after.headers["ETag"] != etag
+    assert after.json()["name"] == "Renamed"
+
+
+def test_bottle_ingest_keeps_machine_etags(client, admin_headers, db, fleet):
+    business_id, (machine_id, _) = fleet
+    etag = client.get(f"/machine/{machine_id}", headers=admin_headers).headers["ETag"]
+
+    store_bottle_rows(db, [build_bottle_row(machine_id, 3, 1.5, business_id, event_seq=1)])
+
+    after = client.get(f"/machine/{machine_id}", headers={**admin_headers, "If-None-Match": etag})
+    assert after.status_code == 304
+
+
+def test_version_stamp_is_shared_state_only(db, fleet):
+    # No per-process component: any worker computes the same stamp for the same contents
+    before = version_stamp(db, "machines")
+    assert version_stamp(db, "machines") == before
+
+    bump_version(db, "machines")
+    db.commit()
+    assert version_stamp(db, "machines") != before
+
+
+
+def test_cached_dashboard_follows_writes_of_other_workers(client, admin_headers, db, fleet):
+    business_id, _ = fleet
+    first = client.get("/machines-per-business", headers=admin_headers)
+    assert first.json() == {"Business": 2}
+
+    # Another worker adds a machine: this process's response cache is not invalidated
+    db.add(Machine(
+        name="Machine 2", number="M-2", street="Street", city="City", state="State",
+        pin_code="000000", business_id=business_id, created_by=1, updated_by=1,
+    ))
+    bump_version(db, "machines")
+    db.commit()
+
+    after = client.get("/machines-per-business", headers={**admin_headers, "If-None-Match": first.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.json() == {"Business": 3}
+    assert client.get("/machines-count", headers=admin_headers).json() == 3
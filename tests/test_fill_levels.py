@@ -0,0 +1,52 @@
+from datetime import datetime
+from app.core.ingest import build_bottle_row, store_bottle_rows
+from app.models import Machine, MachineEmptying
+
+
+def fill(db, fleet, *counts):
+    business_id, (machine_id, _) = fleet
+    store_bottle_rows(db, [build_bottle_row(machine_id, count, 0.1 * count, business_id) for count in counts])
+
+
+def machine(db, machine_id):
+    db.expire_all()
+    return db.get(Machine, machine_id)
+
+
+def test_ingestion_grows_the_fill_count_without_touching_updated_at(db, fleet):
+    _, (machine_id, _) = fleet
+    edited = machine(db, machine_id).updated_at
+
+    fill(db, fleet, 3, 4)
+
+    assert machine(db, machine_id).fill_count == 7
+    assert machine(db, machine_id).updated_at == edited
+
+
+def test_fill_levels_lists_machines_over_the_threshold(client, admin_headers, db, fleet):
+    _, (machine_id, other_id) = fleet
+    db.query(Machine).update({"capacity": 10})
+    db.commit()
+    fill(db, fleet, 9)
+
+    levels = client.get("/machines/fill-levels", params={"threshold": 0.8}, headers=admin_headers).json()
+
+    assert [(level["machine_id"], level["fill_level"]) for level in levels] == [(machine_id, 0.9)]
+
+
+def test_emptying_resets_the_fill_count_and_keeps_the_etag(client, admin_headers, db, fleet):
+    _, (machine_id, _) = fleet
+    fill(db, fleet, 5)
+    edited = machine(db, machine_id).updated_at
+    etag = client.get(f"/machine/{machine_id}", headers=admin_headers).headers["ETag"]
+
+    emptied = client.post(f"/machines/{machine_id}/emptied", headers=admin_headers)
+
+    assert emptied.status_code == 200
+    assert emptied.json()["bottles_removed"] == 5
+    emptied_machine = machine(db, machine_id)
+    assert emptied_machine.fill_count == 0
+    assert emptied_machine.last_emptied_at is not None
+    assert emptied_machine.updated_at == edited
+    assert [row.bottle_count for row in db.query(MachineEmptying)] == [5]
+    assert client.get(f"/machine/{machine_id}", headers={**admin_headers, "If-None-Match": etag}).status_code == 304
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+import pytest
+from app.core.heartbeat import FleetHeartbeats
+from app.models import Machine
+from app.routes import machine as machine_routes
+
+
+@pytest.fixture
+def heartbeats(fleet, monkeypatch):
+    fresh = FleetHeartbeats(online_seconds=120, stale_seconds=900, flush_seconds=30)
+    fresh.load()
+    monkeypatch.setattr(machine_routes, "heartbeats", fresh)
+    return fresh
+
+
+def statuses(heartbeats, business_id):
+    fleet_status = heartbeats.fleet_status(business_id)[business_id]
+    return {status: [entry["machine_id"] for entry in entries] for status, entries in fleet_status.items()}
+
+
+def test_machines_are_classified_by_last_seen(heartbeats, fleet):
+    business_id, (first, second) = fleet
+    heartbeats.beat(first, business_id)
+    heartbeats.beat(second, business_id, datetime.utcnow() - timedelta(minutes=5))
+
+    assert statuses(heartbeats, business_id) == {"online": [first], "stale": [second], "offline": []}
+
+
+def test_heartbeats_are_written_in_bulk_without_editing_the_machine(client, db, heartbeats, fleet):
+    _, (machine_id, _) = fleet
+    edited = db.get(Machine, machine_id).updated_at
+
+    assert client.post(f"/machines/{machine_id}/heartbeat").status_code == 200
+    assert client.post(f"/machines/{machine_id}/heartbeat").status_code == 200
+    db.expire_all()
+    assert db.get(Machine, machine_id).last_seen_at is None  # Only in memory so far
+
+    assert heartbeats.flush() == 1
+    db.expire_all()
+    machine = db.get(Machine, machine_id)
+    assert machine.last_seen_at is not None
+    assert machine.updated_at == edited
+
+
+def test_flush_never_moves_last_seen_backwards(db, heartbeats, fleet):
+    business_id, (machine_id, _) = fleet
+    newer = datetime(2024, 3, 1, 12, 0)
+    db.query(Machine).filter(Machine.id == machine_id).update({"last_seen_at": newer})
+    db.commit()
+
+    heartbeats.beat(machine_id, business_id, datetime(2024, 3, 1, 11, 0))  # Older than another worker's write
+    heartbeats.flush()
+
+    db.expire_all()
+    assert db.get(Machine, machine_id).last_seen_at == newer
+
+
+def test_unknown_machines_cannot_beat(client, heartbeats):
+    assert client.post("/machines/999/heartbeat").status_code == 404
@@ -0,0 +1,43 @@
+from app.core.ingest import build_bottle_row, recent_events, store_bottle_rows
+from app.models import Bottle, BottleDailyRollup
+
+
+def reading(machine_id, event_seq, bottle_count=1):
+    return {"machine_id": machine_id, "bottle_count": bottle_count, "bottle_weight": 0.5, "event_seq": event_seq}
+
+
+def test_retried_events_are_stored_once(client, db, fleet):
+    _, (machine_id, _) = fleet
+
+    first = client.post("/create_bottle/", json=reading(machine_id, 1))
+    retry = client.post("/create_bottle/", json=reading(machine_id, 1))
+
+    assert first.json()["status"] == "created"
+    assert retry.json()["status"] == "duplicate"
+    assert db.query(Bottle).count() == 1
+
+
+def test_duplicates_are_detected_by_the_database_too(client, db, fleet):
+    _, (machine_id, _) = fleet
+    client.post("/create_bottle/", json=reading(machine_id, 1, bottle_count=2))
+    recent_events.clear()  # E.g. another worker, or a restart
+
+    body = client.post("/create_bottles/batch", json=[reading(machine_id, 1, 2), reading(machine_id, 2, 3), reading(machine_id, 2, 3)]).json()
+
+    assert [result["status"] for result in body["results"]] == ["duplicate", "created", "duplicate"]
+    assert sorted(seq for (seq,) in db.query(Bottle.event_seq)) == [1, 2]
+    # Derived data counts every stored reading once
+    assert db.query(BottleDailyRollup.bottle_count).scalar() == 5
+
+
+def test_event_seqs_are_per_machine(db, fleet):
+    business_id, (first, second) = fleet
+
+    inserted = store_bottle_rows(db, [
+        build_bottle_row(first, 1, 0.5, business_id, event_seq=1),
+        build_bottle_row(second, 1, 0.5, business_id, event_seq=1),
+        build_bottle_row(first, 1, 0.5, business_id),
+        build_bottle_row(first, 1, 0.5, business_id),  # Without an event_seq, never a duplicate
+    ])
+
+    assert len(inserted) == 4
@@ -0,0 +1,67 @@
+import json
+from datetime import date, datetime
+import pytz
+from sqlalchemy import insert
+from app.core.ingest import build_bottle_row, local_date, store_bottle_rows
+from app.core.spool import decode_record, encode_record
+from app.database import engine
+from app.migrations import backfill_bottle_local_dates
+from app.models import Bottle, Business, User
+
+
+def test_local_date_is_the_day_in_the_business_timezone():
+    created_at = datetime(2024, 1, 1, 20, 0)  # UTC
+
+    assert local_date(created_at, "UTC") == date(2024, 1, 1)
+    assert local_date(created_at, "Asia/Kolkata") == date(2024, 1, 2)
+    assert local_date(created_at, "America/New_York") == date(2024, 1, 1)
+
+
+def test_stored_rows_get_the_local_date_of_their_business(db, fleet):
+    business_id, (machine_id, _) = fleet
+    db.query(Business).filter(Business.id == business_id).update({"timezone": "America/New_York"})
+    db.commit()
+
+    store_bottle_rows(db, [build_bottle_row(machine_id, 1, 0.5, business_id, pytz.utc.localize(datetime(2024, 1, 2, 3, 0)))])
+
+    stored = db.query(Bottle).one()
+    assert stored.created_at == datetime(2024, 1, 2, 3, 0)
+    assert stored.local_date == date(2024, 1, 1)
+
+
+def test_backfill_moves_legacy_ist_times_to_utc(db, fleet):
+    business_id, (machine_id, _) = fleet
+    legacy = build_bottle_row(machine_id, 1, 0.5, business_id, datetime(2024, 1, 2, 3, 0))  # IST wall clock
+    with engine.begin() as conn:
+        conn.execute(insert(Bottle.__table__).values(**legacy))
+
+    backfill_bottle_local_dates(engine)
+    backfill_bottle_local_dates(engine)  # Rows with a local_date are not shifted again
+
+    stored = db.query(Bottle).one()
+    assert stored.created_at == datetime(2024, 1, 1, 21, 30)
+    assert stored.local_date == date(2024, 1, 2)
+
+
+def test_decode_record_converts_legacy_aware_timestamps_to_utc():
+    ist = pytz.timezone("Asia/Kolkata")
+    row = build_bottle_row(1, 1, 0.5, 1, event_seq=1)
+    row["created_at"] = row["updated_at"] = ist.localize(datetime(2024, 1, 2, 3, 0))
+
+    decoded = decode_record(encode_record(row))
+
+    assert decoded["created_at"] == datetime(2024, 1, 1, 21, 30)
+    assert decoded["created_at"].tzinfo is None
+
+
+def test_unknown_timezone_creates_nothing(client, admin_headers, db, fleet):
+    form = {
+        "business_data": json.dumps({"name": "New business", "mobile": "9000000001", "timezone": "Mars/Olympus"}),
+        "user_data": json.dumps({"email": "owner@example.com", "password": "secret"}),
+    }
+
+    response = client.post("/create_business", data=form, headers=admin_headers)
+
+    assert response.status_code == 400
+    assert db.query(User).filter(User.email == "owner@example.com").first() is None
+    assert db.query(Business).count() == 1
@@ -0,0 +1,61 @@
+import pytest
+from app.core.machine_auth import MachineCredentials, machine_credentials
+from app.core.security import SECRET_KEY
+
+
+def reading(machine_id, event_seq=None):
+    return {"machine_id": machine_id, "bottle_count": 1, "bottle_weight": 0.5, "event_seq": event_seq}
+
+
+def issue(client, admin_headers, machine_id):
+    response = client.post(f"/machines/{machine_id}/credentials", headers=admin_headers)
+    assert response.status_code == 200
+    return response.json()["machine_token"]
+
+
+def test_machine_token_reports_only_for_its_machine(client, admin_headers, fleet):
+    _, (machine_id, other_id) = fleet
+    token = issue(client, admin_headers, machine_id)
+    headers = {"X-Machine-Token": token}
+
+    assert client.post("/create_bottle/", json=reading(machine_id), headers=headers).status_code == 200
+    assert client.post("/create_bottle/", json=reading(other_id), headers=headers).status_code == 403
+
+
+def test_issuing_a_new_token_revokes_the_old_one(client, admin_headers, fleet):
+    _, (machine_id, _) = fleet
+    old = issue(client, admin_headers, machine_id)
+    new = issue(client, admin_headers, machine_id)
+
+    assert client.post("/create_bottle/", json=reading(machine_id), headers={"X-Machine-Token": old}).status_code == 403
+    assert client.post("/create_bottle/", json=reading(machine_id), headers={"X-Machine-Token": new}).status_code == 200
+
+
+def test_machine_tokens_are_not_user_tokens(client, admin_headers, fleet):
+    _, (machine_id, _) = fleet
+    token = issue(client, admin_headers, machine_id)
+
+    response = client.get("/machines-count", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 403
+
+
+def test_without_a_secret_machine_tokens_are_disabled(client, admin_headers, fleet, monkeypatch):
+    _, (machine_id, _) = fleet
+    token = issue(client, admin_headers, machine_id)
+    monkeypatch.setattr(machine_credentials, "secret", None)
+
+    assert client.post(f"/machines/{machine_id}/credentials", headers=admin_headers).status_code == 503
+    assert client.post("/create_bottle/", json=reading(machine_id), headers={"X-Machine-Token": token}).status_code == 403
+    # Uploads without a token keep working while MACHINE_AUTH_REQUIRED is off
+    assert client.post("/create_bottle/", json=reading(machine_id)).status_code == 200
+
+
+@pytest.mark.parametrize("secret", [None, "", SECRET_KEY])
+def test_startup_requires_a_distinct_secret_only_when_tokens_are_required(secret):
+    credentials = MachineCredentials(secret, refresh_seconds=60)
+
+    credentials.start(required=False)
+    assert not credentials.enabled
+
+    with pytest.raises(RuntimeError):
+        credentials.start(required=True)
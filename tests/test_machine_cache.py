@@ -0,0 +1,58 @@
+from app.core import cache as cache_module
+from app.core.cache import TTLCache
+from app.core.ingest import get_machine_business_ids, machine_cache
+from app.models import Business, Machine
+
+
+def test_lru_entries_expire_and_are_evicted(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache = TTLCache(max_size=2, ttl_seconds=10)
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)  # Evicts b, the least recently used
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+    now[0] += 10
+    assert cache.get("a") is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_bound_keeps_oversized_values_out():
+    cache = TTLCache(max_size=10, ttl_seconds=10, max_bytes=5, sizeof=len)
+
+    cache.set("big", "123456")
+    cache.set("a", "123")
+    cache.set("b", "123")  # Over 5 bytes together: evicts a
+
+    assert (cache.get("big"), cache.get("a"), cache.get("b")) == (None, None, "123")
+
+
+def test_lookups_are_answered_from_the_cache(db, fleet):
+    business_id, (machine_id, _) = fleet
+    assert get_machine_business_ids(db, [machine_id, 999]) == {machine_id: business_id}
+
+    # Changed behind the cache's back: the cached business is still served
+    other = Business(name="Other", mobile="9000000002", business_owner=1, created_by=1, updated_by=1)
+    db.add(other)
+    db.flush()
+    db.query(Machine).filter(Machine.id == machine_id).update({"business_id": other.id})
+    db.commit()
+    assert get_machine_business_ids(db, [machine_id]) == {machine_id: business_id}
+
+    machine_cache.invalidate(machine_id)
+    assert get_machine_business_ids(db, [machine_id]) == {machine_id: other.id}
+
+
+def test_deleting_a_machine_invalidates_its_entry(client, admin_headers, db, fleet):
+    _, (_, machine_id) = fleet
+    assert get_machine_business_ids(db, [machine_id])
+    assert machine_cache.get(machine_id) is not None
+
+    assert client.delete(f"/machines/{machine_id}", headers=admin_headers).status_code == 200
+
+    assert machine_cache.get(machine_id) is None
+    reading = {"machine_id": machine_id, "bottle_count": 1, "bottle_weight": 0.5}
+    assert client.post("/create_bottle/", json=reading).status_code == 404
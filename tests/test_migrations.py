@@ -0,0 +1,31 @@
+from sqlalchemy import inspect, text
+from app.database import engine
+from app.migrations import create_missing_indexes, run_migrations
+
+
+def index_names(table):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+
+def test_missing_indexes_are_created(fleet):
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_bottles_machine_created_at"))
+        conn.execute(text("DROP INDEX ix_machines_business_id"))
+
+    create_missing_indexes(engine)
+
+    assert "ix_bottles_machine_created_at" in index_names("bottles")
+    assert "ix_machines_business_id" in index_names("machines")
+
+
+def test_migrations_are_idempotent(fleet):
+    run_migrations(engine)
+    run_migrations(engine)
+
+
+def test_per_machine_date_ranges_use_an_index(db):
+    plan = " ".join(str(row[-1]) for row in db.execute(text(
+        "EXPLAIN QUERY PLAN SELECT sum(bottle_count) FROM bottles "
+        "WHERE machine_id = 1 AND created_at >= '2024-01-01' AND created_at < '2024-02-01'"
+    )))
+    assert "USING INDEX ix_bottles_machine_created_at" in plan
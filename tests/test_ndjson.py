@@ -0,0 +1,65 @@
+import asyncio
+import gzip
+import json
+import pytest
+from app.core.ingest import MAX_NDJSON_LINE_BYTES, iter_ndjson_lines
+from app.models import Bottle
+
+
+def ndjson(*readings) -> bytes:
+    return b"".join(json.dumps(reading).encode() + b"\n" for reading in readings)
+
+
+def reading(machine_id, event_seq):
+    return {"machine_id": machine_id, "bottle_count": 1, "bottle_weight": 0.5, "event_seq": event_seq}
+
+
+def lines(chunks, gzipped=False):
+    async def source():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [line async for line in iter_ndjson_lines(source(), gzipped)]
+
+    return asyncio.run(collect())
+
+
+def test_lines_are_split_across_chunks():
+    assert lines([b'{"a"', b': 1}\n{"b": 2}\n{"c"', b": 3}"]) == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+
+def test_gzip_bomb_is_refused_before_it_is_inflated():
+    bomb = gzip.compress(b"x" * (64 * MAX_NDJSON_LINE_BYTES))
+    with pytest.raises(ValueError, match="Line longer"):
+        lines([bomb], gzipped=True)
+
+
+def test_stream_upload_stores_readings_and_itemises_bad_lines(client, db, fleet):
+    _, (machine_id, _) = fleet
+    body = ndjson(reading(machine_id, 1), reading(999, 2)) + b"not json\n" + ndjson(reading(machine_id, 3))
+
+    response = client.post("/create_bottles/stream", content=gzip.compress(body), headers={"Content-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["created"], result["failed"], result["resume_offset"]) == (2, 2, 4)
+    assert sorted(error["line"] for error in result["errors"]) == [1, 2]
+    assert sorted(seq for (seq,) in db.query(Bottle.event_seq)) == [1, 3]
+
+
+def test_resumed_upload_skips_processed_lines(client, db, fleet):
+    _, (machine_id, _) = fleet
+    body = ndjson(*(reading(machine_id, seq) for seq in range(1, 6)))
+
+    result = client.post("/create_bottles/stream", params={"offset": 3}, content=body).json()
+
+    assert (result["lines_read"], result["created"], result["resume_offset"]) == (5, 2, 5)
+    assert sorted(seq for (seq,) in db.query(Bottle.event_seq)) == [4, 5]
+
+
+def test_malformed_gzip_reports_progress(client, fleet):
+    response = client.post("/create_bottles/stream", content=b"not gzip", headers={"Content-Encoding": "gzip"})
+
+    assert response.status_code == 400
+    assert response.json()["resume_offset"] == 0
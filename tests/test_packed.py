@@ -0,0 +1,49 @@
+import struct
+import time
+from app.core.ingest import decode_packed_readings, encode_packed_readings
+from app.models import Bottle
+
+
+def post(client, payload):
+    return client.post("/create_bottles/packed", content=payload, headers={"Content-Type": "application/octet-stream"})
+
+
+def test_packed_readings_round_trip():
+    readings = [(1, 3, 0.5, 1700000000, 7), (2, 1, 0.25, 0, 8)]
+    assert decode_packed_readings(encode_packed_readings(readings)) == readings
+
+
+def test_version_1_uploads_have_no_event_seq():
+    payload = bytes([1]) + struct.pack("<IHfI", 1, 3, 0.5, 0)
+    assert decode_packed_readings(payload) == [(1, 3, 0.5, 0, None)]
+
+
+def test_packed_upload_is_stored(client, db, fleet):
+    _, (machine_id, other_id) = fleet
+    now = int(time.time())
+
+    response = post(client, encode_packed_readings([(machine_id, 3, 0.1, now, 1), (other_id, 2, 0.2, 0, 1)]))
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "created", "created": 2, "duplicates": 0, "failed": 0, "errors": []}
+    # float32 noise is rounded away
+    assert sorted(row.bottle_weight for row in db.query(Bottle)) == [0.1, 0.2]
+
+
+def test_invalid_readings_are_itemised(client, db, fleet):
+    _, (machine_id, _) = fleet
+    future = int(time.time()) + 3600
+
+    body = post(client, encode_packed_readings([(machine_id, 0, 0.1, 0, 1), (machine_id, 1, 0.1, future, 2), (999, 1, 0.1, 0, 3)])).json()
+
+    assert body["failed"] == 3
+    assert [error["detail"] for error in body["errors"]] == [
+        "bottle_count must be positive", "timestamp is in the future", "Machine not found",
+    ]
+    assert db.query(Bottle).count() == 0
+
+
+def test_malformed_payloads_are_refused(client, fleet):
+    assert post(client, b"").status_code == 400
+    assert post(client, bytes([9]) + b"\x00" * 18).status_code == 400
+    assert post(client, encode_packed_readings([(1, 1, 0.1, 0, 1)])[:-1]).status_code == 400
@@ -0,0 +1,76 @@
+from datetime import date, datetime
+from sqlalchemy import func, insert, inspect, select, text
+from app.core.ingest import build_bottle_row, store_bottle_rows
+from app.core.partitions import bottle_partitions, month_table
+from app.database import engine
+from app.models import Bottle, BottleEventKey
+
+
+def store(db, machine_id, business_id, created_at, event_seq=None):
+    return store_bottle_rows(db, [build_bottle_row(machine_id, 1, 0.5, business_id, created_at, event_seq)])
+
+
+def test_rolled_months_keep_the_bottles_indexes(db, fleet):
+    business_id, (machine_id, _) = fleet
+    store(db, machine_id, business_id, datetime(2024, 1, 15), event_seq=1)
+    store(db, machine_id, business_id, datetime(2024, 4, 2), event_seq=2)
+
+    bottle_partitions.maintain(engine, today=date(2024, 4, 10))
+
+    assert bottle_partitions.month_tables == {date(2024, 1, 1): "bottles_2024_01"}
+    inspector = inspect(engine)
+    assert inspector.get_pk_constraint("bottles_2024_01")["constrained_columns"] == ["id"]
+    assert {index["name"] for index in inspector.get_indexes("bottles_2024_01")} == {
+        index.name.replace("bottles", "bottles_2024_01", 1) for index in Bottle.__table__.indexes
+    }
+    assert [seq for (seq,) in db.execute(text("SELECT event_seq FROM bottles_2024_01"))] == [1]
+    assert [seq for (seq,) in db.query(Bottle.event_seq)] == [2]
+
+
+def test_retried_events_of_rolled_months_stay_duplicates(db, fleet):
+    business_id, (machine_id, _) = fleet
+    store(db, machine_id, business_id, datetime(2024, 1, 15), event_seq=1)
+    bottle_partitions.maintain(engine, today=date(2024, 4, 10))
+
+    assert store(db, machine_id, business_id, datetime(2024, 1, 15), event_seq=1) == []
+    assert db.query(Bottle).count() == 0
+    assert len(store(db, machine_id, business_id, datetime(2024, 4, 2), event_seq=2)) == 1
+
+
+def test_ids_are_not_reused_once_the_hot_table_is_empty(db, fleet):
+    business_id, (machine_id, _) = fleet
+    for day in (10, 11, 12):
+        store(db, machine_id, business_id, datetime(2024, 1, day))
+    bottle_partitions.maintain(engine, today=date(2024, 4, 10))
+    assert db.query(Bottle).count() == 0
+
+    store(db, machine_id, business_id, datetime(2024, 4, 2))
+
+    assert db.query(Bottle.id).scalar() == 4
+
+
+def test_legacy_tables_are_rebuilt_with_keys_and_monotonic_ids(db, fleet):
+    business_id, (machine_id, _) = fleet
+    # The layout before the fix: bottles without AUTOINCREMENT and a month table without
+    # a primary key or indexes, holding higher ids than bottles
+    Bottle.__table__.drop(engine)
+    month_table("bottles").create(engine)
+    rows = [
+        dict(build_bottle_row(machine_id, 1, 0.5, business_id, datetime(2024, 1, 15), event_seq), id=bottle_id)
+        for bottle_id, event_seq in ((10, 1), (11, 2))
+    ]
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE bottles_2024_01 AS SELECT * FROM bottles WHERE 0"))
+        conn.execute(insert(month_table("bottles_2024_01")), rows)
+        conn.execute(insert(Bottle.__table__), [dict(rows[0], id=1, event_seq=3, created_at=datetime(2024, 4, 1))])
+
+    bottle_partitions.sync_month_tables(engine)
+    bottle_partitions.refresh(engine)
+
+    assert "AUTOINCREMENT" in db.execute(text("SELECT sql FROM sqlite_master WHERE name = 'bottles'")).scalar()
+    assert inspect(engine).get_pk_constraint("bottles_2024_01")["constrained_columns"] == ["id"]
+    assert sorted(db.execute(select(BottleEventKey.machine_id, BottleEventKey.event_seq))) == [(machine_id, 1), (machine_id, 2)]
+
+    assert store(db, machine_id, business_id, datetime(2024, 1, 15), event_seq=2) == []
+    store(db, machine_id, business_id, datetime(2024, 4, 2))
+    assert db.query(func.max(Bottle.id)).scalar() > 11
@@ -0,0 +1,40 @@
+from app.core.cache import TTLCache
+
+
+def cache_stats(client, headers):
+    return client.get("/metrics/response-cache", headers=headers).json()["machines-per-business"]
+
+
+def test_repeated_dashboard_reads_are_served_from_the_cache(client, admin_headers, fleet):
+    before = cache_stats(client, admin_headers)
+    first = client.get("/machines-per-business", headers=admin_headers).json()
+    second = client.get("/machines-per-business", headers=admin_headers).json()
+
+    assert first == second == {"Business": 2}
+    after = cache_stats(client, admin_headers)
+    assert after["size"] == 1
+    assert (after["hits"] - before["hits"], after["misses"] - before["misses"]) == (1, 1)
+
+
+def test_api_writes_drop_the_cached_responses(client, admin_headers, fleet):
+    _, (machine_id, _) = fleet
+    client.get("/machines-per-business", headers=admin_headers)
+    assert cache_stats(client, admin_headers)["size"] == 1
+
+    assert client.delete(f"/machines/{machine_id}", headers=admin_headers).status_code == 200
+
+    assert cache_stats(client, admin_headers)["size"] == 0
+    assert client.get("/machines-per-business", headers=admin_headers).json() == {"Business": 1}
+
+
+def test_cache_is_capped_by_encoded_size():
+    cache = TTLCache(max_size=10, ttl_seconds=60, max_bytes=20, sizeof=len)
+    cache.set("a", "x" * 8)
+    cache.set("b", "y" * 8)
+    cache.set("c", "z" * 8)  # Over 20 bytes in total: "a" is evicted
+    cache.set("d", "w" * 30)  # Larger than the whole cache: not cached
+
+    assert cache.get("a") is None
+    assert (cache.get("b"), cache.get("c"), cache.get("d")) == ("y" * 8, "z" * 8, None)
+    assert cache.stats()["bytes"] == 16
+    assert cache.stats()["evictions"] == 1
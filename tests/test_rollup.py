@@ -0,0 +1,63 @@
+from datetime import date, datetime
+from sqlalchemy import insert
+from app.core.ingest import build_bottle_row, store_bottle_rows
+from app.core.rollup import rebuild_daily_rollup
+from app.database import engine
+from app.migrations import backfill_daily_rollup
+from app.models import Bottle, BottleDailyRollup
+
+
+def rollup(db):
+    return {
+        (row.day, row.machine_id): (row.bottle_count, row.bottle_weight)
+        for row in db.query(BottleDailyRollup)
+    }
+
+
+def readings(fleet):
+    business_id, (first, second) = fleet
+    return [
+        build_bottle_row(first, 2, 1.0, business_id, datetime(2024, 3, 1, 10, 0)),
+        build_bottle_row(first, 3, 1.5, business_id, datetime(2024, 3, 1, 11, 0)),
+        build_bottle_row(first, 1, 0.5, business_id, datetime(2024, 3, 1, 20, 0)),  # March 2nd in IST
+        build_bottle_row(second, 4, 2.0, business_id, datetime(2024, 3, 1, 10, 0)),
+    ]
+
+
+def test_ingestion_keeps_the_rollup_in_step(db, fleet):
+    _, (first, second) = fleet
+    store_bottle_rows(db, readings(fleet)[:2])
+    store_bottle_rows(db, readings(fleet)[2:])
+
+    assert rollup(db) == {
+        (date(2024, 3, 1), first): (5, 2.5),
+        (date(2024, 3, 2), first): (1, 0.5),
+        (date(2024, 3, 1), second): (4, 2.0),
+    }
+
+    incremental = rollup(db)
+    rebuild_daily_rollup(db)
+    assert rollup(db) == incremental
+
+
+def test_first_start_backfills_an_empty_rollup_once(db, fleet):
+    _, (first, second) = fleet
+    # Rows stored before the rollup existed
+    store_bottle_rows(db, readings(fleet))
+    db.query(BottleDailyRollup).delete()
+    db.commit()
+
+    backfill_daily_rollup(engine)
+    backfilled = rollup(db)
+    assert backfilled[(date(2024, 3, 1), first)] == (5, 2.5)
+
+    # A populated rollup is left alone on later starts
+    with engine.begin() as conn:
+        conn.execute(insert(Bottle.__table__).values(dict(readings(fleet)[0], local_date=date(2024, 3, 1))))
+    backfill_daily_rollup(engine)
+    assert rollup(db) == backfilled
+
+
+def test_backfill_skips_an_empty_database(db):
+    backfill_daily_rollup(engine)
+    assert rollup(db) == {}
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+from app.routes import admin
+from app.core.singleflight import SingleFlight
+from app.database import SessionLocal
+
+
+def blocked(release: threading.Event, calls: list, result):
+    def compute(session):
+        calls.append(session)
+        release.wait(3)
+        return result
+    return compute
+
+
+def test_concurrent_identical_requests_share_one_computation():
+    flights = SingleFlight(SessionLocal)
+    release, calls = threading.Event(), []
+
+    async def main():
+        first = asyncio.ensure_future(flights.run("key", blocked(release, calls, 1)))
+        second = asyncio.ensure_future(flights.run("key", blocked(release, calls, 2)))
+        other = asyncio.ensure_future(flights.run("other", blocked(release, calls, 3)))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(first, second, other)
+
+    assert asyncio.run(main()) == [1, 1, 3]
+    assert len(calls) == 2
+    metrics = flights.metrics()
+    assert (metrics["executions"], metrics["coalesced"], metrics["in_flight"]) == (2, 1, 0)
+
+
+def test_a_cancelled_caller_leaves_the_computation_to_the_others():
+    flights = SingleFlight(SessionLocal)
+    release, calls = threading.Event(), []
+
+    async def main():
+        leaving = asyncio.ensure_future(flights.run("key", blocked(release, calls, 1)))
+        staying = asyncio.ensure_future(flights.run("key", blocked(release, calls, 2)))
+        await asyncio.sleep(0.05)
+        leaving.cancel()
+        release.set()
+        return await staying
+
+    assert asyncio.run(main()) == 1
+    assert len(calls) == 1
+
+
+def test_failures_reach_every_caller_and_are_not_remembered():
+    flights = SingleFlight(SessionLocal)
+
+    def fail(session):
+        raise ValueError("boom")
+
+    async def main():
+        results = await asyncio.gather(flights.run("key", fail), flights.run("key", fail), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        return await flights.run("key", lambda session: "recovered")
+
+    assert asyncio.run(main()) == "recovered"
+    assert flights.metrics()["failures"] == 1
+
+
+def test_the_dashboard_is_computed_through_the_shared_flights(client, admin_headers, fleet, monkeypatch):
+    flights = SingleFlight(SessionLocal)
+    monkeypatch.setattr(admin, "aggregations", flights)
+
+    assert client.get("/admin/dashboard", headers=admin_headers).status_code == 200
+    assert flights.metrics()["executions"] == 1
@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime, timedelta
+from app.core.ingest import build_bottle_row, store_bottle_rows
+from app.core.snapshots import DashboardSnapshots, snapshots
+from app.database import engine
+from app.models import SnapshotRefresh
+
+
+def store(db, fleet, bottle_count):
+    business_id, (first, _) = fleet
+    store_bottle_rows(db, [build_bottle_row(first, bottle_count, 0.5 * bottle_count, business_id, datetime(2024, 3, 1, 6, 0))])
+
+
+def test_bottle_counts_come_from_the_last_snapshot(client, admin_headers, db, fleet):
+    _, (first, _) = fleet
+    # Built on the first read, before any bottles: an empty list
+    empty = client.get("/machines/bottle-count", headers=admin_headers)
+    assert empty.status_code == 200
+    assert empty.json() == []
+    assert empty.headers["X-Snapshot-Age"] == "0"
+
+    store(db, fleet, 4)
+    assert client.get("/machines/bottle-count", headers=admin_headers).json() == []
+
+    assert snapshots.refresh_due(engine, force=True) == 2
+    refreshed = client.get("/machines/bottle-count", headers={**admin_headers, "If-None-Match": empty.headers["ETag"]})
+    assert refreshed.status_code == 200
+    assert refreshed.json() == [{"machine_id": first, "total_bottle_count": 4}]
+
+
+def test_recently_refreshed_snapshots_are_skipped(db, fleet):
+    assert snapshots.refresh_due(engine) == 2
+    assert snapshots.refresh_due(engine) == 0
+    assert snapshots.refresh_due(engine, force=True) == 2
+
+
+def test_stale_snapshots_are_served_and_refreshed_in_the_background(db, fleet):
+    fresh = DashboardSnapshots(refresh_seconds=60, max_age_seconds=120)
+    fresh.refresh(engine, "machine_bottle_totals")
+    stale = datetime.utcnow() - timedelta(minutes=10)
+    db.query(SnapshotRefresh).filter(SnapshotRefresh.name == "machine_bottle_totals").update({"refreshed_at": stale})
+    db.commit()
+
+    async def read():
+        served = fresh.refreshed_at(db, "machine_bottle_totals")
+        for _ in range(100):
+            if not fresh.metrics()["refreshing"]:
+                break
+            await asyncio.sleep(0.01)
+        return served
+
+    assert asyncio.run(read()) == stale
+    assert fresh.metrics()["revalidations"] == 1
+    assert fresh.refreshes["machine_bottle_totals"] == 2
+    db.expire_all()
+    assert db.query(SnapshotRefresh.refreshed_at).filter(SnapshotRefresh.name == "machine_bottle_totals").scalar() > stale
@@ -0,0 +1,93 @@
+import os
+from app.core.ingest import build_bottle_row
+from app.core.spool import BottleSpool, decode_record, encode_record
+from app.models import Bottle, Machine, SpoolCheckpoint
+
+
+def make_spool(directory) -> BottleSpool:
+    return BottleSpool(
+        enabled=True, directory=str(directory), fsync_policy="never", fsync_interval_ms=0,
+        segment_bytes=1024 * 1024, replay_rows=100, replay_interval_ms=1000,
+    )
+
+
+def rows_for(machine_id, business_id, first_seq, count):
+    return [build_bottle_row(machine_id, 1, 0.5, business_id, event_seq=seq) for seq in range(first_seq, first_seq + count)]
+
+
+def test_replay_inserts_spooled_rows_and_removes_sealed_segment(tmp_path, db, fleet):
+    business_id, (machine_id, _) = fleet
+    writer = make_spool(tmp_path)
+    writer._open_segment()
+    writer.append(rows_for(machine_id, business_id, 1, 5))
+    writer._close_segment()
+
+    replayer = make_spool(tmp_path)
+    assert replayer.replay_once() == 5
+    assert db.query(Bottle).count() == 5
+    assert os.listdir(tmp_path) == []
+    assert db.query(SpoolCheckpoint).count() == 0
+
+
+def test_records_appended_before_the_seal_are_replayed_not_deleted(tmp_path, db, fleet):
+    business_id, (machine_id, _) = fleet
+    writer = make_spool(tmp_path)
+    writer._open_segment()
+    writer.append(rows_for(machine_id, business_id, 1, 3))
+
+    replayer = make_spool(tmp_path)
+    is_sealed = replayer._is_sealed
+
+    def append_then_seal(path):
+        # The writer appends more records and closes the segment after the replayer
+        # read up to EOF but before it checks whether the segment is sealed
+        if writer._segment is not None:
+            writer.append(rows_for(machine_id, business_id, 4, 2))
+            writer._close_segment()
+        return is_sealed(path)
+
+    replayer._is_sealed = append_then_seal
+    replayer.replay_once()  # Replays the first three records, then hits the race
+    replayer.replay_once()
+
+    assert sorted(seq for (seq,) in db.query(Bottle.event_seq)) == [1, 2, 3, 4, 5]
+    assert os.listdir(tmp_path) == []
+
+
+def test_torn_tail_of_sealed_segment_is_discarded(tmp_path, db, fleet):
+    business_id, (machine_id, _) = fleet
+    writer = make_spool(tmp_path)
+    writer._open_segment()
+    writer.append(rows_for(machine_id, business_id, 1, 2))
+    writer._segment.write(encode_record(rows_for(machine_id, business_id, 3, 1)[0])[:20])
+    writer._close_segment()
+
+    make_spool(tmp_path).replay_once()
+
+    assert db.query(Bottle).count() == 2
+    assert os.listdir(tmp_path) == []
+
+
+def test_refused_rows_are_dead_lettered_and_do_not_block_replay(tmp_path, db, fleet):
+    business_id, (machine_id, deleted_id) = fleet
+    writer = make_spool(tmp_path)
+    writer._open_segment()
+    segment = writer._segment_name
+    rows = rows_for(machine_id, business_id, 1, 3) + rows_for(deleted_id, business_id, 1, 1) + rows_for(machine_id, business_id, 4, 3)
+    writer.append(rows)
+    writer._close_segment()
+
+    # The machine is deleted after its readings were spooled
+    db.query(Machine).filter(Machine.id == deleted_id).delete()
+    db.commit()
+
+    replayer = make_spool(tmp_path)
+    assert replayer.replay_once() == 6
+    assert replayer.rejected_rows == 1
+    assert db.query(Bottle).filter(Bottle.machine_id == machine_id).count() == 6
+
+    rejected = tmp_path / (segment[:-len(".log")] + ".rejected")
+    lines = rejected.read_bytes().splitlines(keepends=True)
+    assert [decode_record(line)["machine_id"] for line in lines] == [deleted_id]
+    assert os.listdir(tmp_path) == [rejected.name]
+
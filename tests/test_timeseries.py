@@ -0,0 +1,75 @@
+from datetime import datetime
+from app.core.ingest import build_bottle_row, store_bottle_rows
+
+
+def store(db, fleet, machine_index, created_at, bottle_count):
+    business_id, machine_ids = fleet
+    store_bottle_rows(db, [build_bottle_row(machine_ids[machine_index], bottle_count, 0.5 * bottle_count, business_id, created_at)])
+
+
+def series(client, headers, **params):
+    response = client.get("/bottle-timeseries", params=params, headers=headers)
+    assert response.status_code == 200
+    body = response.json()
+    return dict(zip(body["buckets"], body["bottle_count"])), body
+
+
+def test_daily_series_are_zero_filled(client, admin_headers, db, fleet):
+    business_id, _ = fleet
+    store(db, fleet, 0, datetime(2024, 3, 1, 6, 0), 2)
+    store(db, fleet, 1, datetime(2024, 3, 1, 7, 0), 3)
+    store(db, fleet, 0, datetime(2024, 3, 3, 6, 0), 1)
+
+    counts, body = series(client, admin_headers, scope="business", scope_id=business_id, **{"from": "2024-03-01", "to": "2024-03-04"})
+
+    assert counts == {"2024-03-01": 5, "2024-03-02": 0, "2024-03-03": 1, "2024-03-04": 0}
+    assert body["bottle_weight"] == [2.5, 0.0, 0.5, 0.0]
+    assert body["timezone"] == "Asia/Kolkata"
+
+
+def test_hourly_series_use_the_business_timezone(client, admin_headers, db, fleet):
+    # 20:10 UTC is 01:40 on the next day in Asia/Kolkata
+    store(db, fleet, 0, datetime(2024, 3, 1, 20, 10), 4)
+
+    counts, _ = series(client, admin_headers, granularity="hour", **{"from": "2024-03-02", "to": "2024-03-02"})
+
+    assert len(counts) == 24
+    assert counts["2024-03-02T01:00"] == 4
+    assert sum(counts.values()) == 4
+
+
+def test_weekly_and_monthly_buckets_start_on_monday_and_the_first(client, admin_headers, db, fleet):
+    store(db, fleet, 0, datetime(2024, 2, 20, 6, 0), 1)
+    store(db, fleet, 0, datetime(2024, 3, 1, 6, 0), 2)  # A Friday
+    store(db, fleet, 0, datetime(2024, 3, 4, 6, 0), 3)  # The next Monday
+    window = {"from": "2024-02-15", "to": "2024-03-10"}
+
+    weeks, _ = series(client, admin_headers, granularity="week", **window)
+    months, _ = series(client, admin_headers, granularity="month", **window)
+
+    assert weeks == {"2024-02-12": 0, "2024-02-19": 1, "2024-02-26": 2, "2024-03-04": 3}
+    assert months == {"2024-02-01": 1, "2024-03-01": 5}
+
+
+def test_explicit_timezone_buckets_the_raw_rows(client, admin_headers, db, fleet):
+    _, (first, _) = fleet
+    store(db, fleet, 0, datetime(2024, 3, 1, 20, 10), 4)
+    store(db, fleet, 1, datetime(2024, 3, 1, 20, 10), 9)  # Another machine
+
+    in_utc, _ = series(client, admin_headers, scope="machine", scope_id=first, tz="UTC", **{"from": "2024-03-01", "to": "2024-03-02"})
+    local, _ = series(client, admin_headers, scope="machine", scope_id=first, **{"from": "2024-03-01", "to": "2024-03-02"})
+
+    assert in_utc == {"2024-03-01": 4, "2024-03-02": 0}
+    assert local == {"2024-03-01": 0, "2024-03-02": 4}
+
+
+def test_series_requests_are_validated(client, admin_headers, fleet):
+    def get(**params):
+        return client.get("/bottle-timeseries", params=params, headers=admin_headers).status_code
+
+    assert get(granularity="minute") == 400
+    assert get(scope="region") == 400
+    assert get(scope="machine") == 400
+    assert get(tz="Mars/Olympus") == 400
+    assert get(scope="machine", scope_id=999) == 404
+    assert get(granularity="hour", **{"from": "2023-01-01", "to": "2024-03-01"}) == 400
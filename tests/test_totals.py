@@ -0,0 +1,76 @@
+import asyncio
+import threading
+from datetime import datetime
+import httpx
+from app.core.ingest import build_bottle_row, store_bottle_rows
+from app.core.totals import running_totals
+from app.main import app
+
+
+def reading(machine_id, bottle_count):
+    return {"machine_id": machine_id, "bottle_count": bottle_count, "bottle_weight": 0.5}
+
+
+def test_committed_rows_are_counted_once(db, fleet):
+    business_id, (machine_id, _) = fleet
+    store_bottle_rows(db, [build_bottle_row(machine_id, 2, 1.0, business_id, datetime(2024, 3, 1))])
+    running_totals.load()
+
+    store_bottle_rows(db, [build_bottle_row(machine_id, 3, 1.5, business_id, datetime(2024, 3, 1))])
+    assert running_totals.totals() == (5, 2.5)
+    assert running_totals.totals(business_id) == (5, 2.5)
+
+    assert running_totals.reconcile() is False
+    assert running_totals.totals() == (5, 2.5)
+
+
+def test_reconcile_adopts_rows_other_workers_stored(db, fleet):
+    business_id, (machine_id, _) = fleet
+    running_totals.load()
+    # Another worker's row: in the database, never added in this process
+    store_bottle_rows(db, [build_bottle_row(machine_id, 4, 2.0, business_id, datetime(2024, 3, 1))])
+    running_totals.load()  # Drop the local add, as if the row came from elsewhere
+    running_totals.add([{"machine_id": machine_id, "bottle_count": -4, "bottle_weight": -2.0}])
+
+    assert running_totals.reconcile() is True
+    assert running_totals.totals() == (4, 2.0)
+
+
+def test_commits_waiting_for_a_reconcile_do_not_block_the_event_loop(admin_headers, fleet, monkeypatch):
+    _, (machine_id, _) = fleet
+    running_totals.load()
+
+    read = running_totals._read
+    reading_started, release = threading.Event(), threading.Event()
+
+    def slow_read():
+        reading_started.set()
+        release.wait(3)
+        return read()
+
+    monkeypatch.setattr(running_totals, "_read", slow_read)
+    reconcile = threading.Thread(target=running_totals.reconcile)
+    reconcile.start()
+    assert reading_started.wait(5)
+
+    async def requests():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            upload = asyncio.ensure_future(client.post("/create_bottle/", json=reading(machine_id, 3)))
+            await asyncio.sleep(0.2)
+            assert not upload.done()  # Its commit waits for the reconcile...
+            # ...while the event loop keeps serving other requests
+            stats = await asyncio.wait_for(client.get("/bottle-stats", headers=admin_headers), 2)
+            assert reconcile.is_alive()
+            release.set()
+            return stats, await asyncio.wait_for(upload, 5)
+
+    try:
+        stats, upload = asyncio.run(requests())
+    finally:
+        release.set()
+        reconcile.join(5)
+
+    assert stats.status_code == 200
+    assert upload.status_code == 200
+    assert running_totals.totals() == (3, 0.5)
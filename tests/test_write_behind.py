@@ -0,0 +1,84 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+from app.core import write_behind as write_behind_module
+from app.core.ingest import build_bottle_row
+from app.core.spool import decode_record
+from app.core.write_behind import QueueFullError, WriteBehindBuffer
+from app.models import Bottle, Machine
+
+
+def make_buffer(tmp_path, max_size=100, flush_rows=10) -> WriteBehindBuffer:
+    return WriteBehindBuffer(
+        enabled=True, max_size=max_size, flush_rows=flush_rows, flush_interval_ms=1000,
+        dead_letters=str(tmp_path / "write_behind.rejected"),
+    )
+
+
+def rows_for(machine_id, business_id, first_seq, count):
+    return [build_bottle_row(machine_id, 1, 0.5, business_id, event_seq=seq) for seq in range(first_seq, first_seq + count)]
+
+
+def test_flush_writes_queued_rows(tmp_path, db, fleet):
+    business_id, (machine_id, _) = fleet
+    buffer = make_buffer(tmp_path)
+    buffer.enqueue(rows_for(machine_id, business_id, 1, 25))
+
+    assert buffer.flush() == 25
+    assert db.query(Bottle).count() == 25
+    assert buffer.metrics()["queue_depth"] == 0
+
+
+def test_failed_group_is_requeued_in_order_and_retried(tmp_path, db, fleet, monkeypatch):
+    business_id, (machine_id, _) = fleet
+    buffer = make_buffer(tmp_path)
+    buffer.enqueue(rows_for(machine_id, business_id, 1, 15))
+
+    insert = write_behind_module.insert_bottle_rows_or_reject
+
+    def database_down(db, rows):
+        raise OperationalError("INSERT", {}, Exception("database is down"))
+
+    monkeypatch.setattr(write_behind_module, "insert_bottle_rows_or_reject", database_down)
+    assert buffer.flush() == 0
+    assert buffer.failed_flushes == 1
+    assert [row["event_seq"] for row in buffer._rows] == list(range(1, 16))
+
+    monkeypatch.setattr(write_behind_module, "insert_bottle_rows_or_reject", insert)
+    assert buffer.flush() == 15
+    assert sorted(seq for (seq,) in db.query(Bottle.event_seq)) == list(range(1, 16))
+
+
+def test_rows_being_flushed_count_towards_the_cap(tmp_path, fleet, monkeypatch):
+    business_id, (machine_id, _) = fleet
+    buffer = make_buffer(tmp_path, max_size=10, flush_rows=10)
+    buffer.enqueue(rows_for(machine_id, business_id, 1, 10))
+
+    def enqueue_during_failing_flush(db, rows):
+        # The group is out of the queue now, but it is put back when this fails
+        with pytest.raises(QueueFullError):
+            buffer.enqueue(rows_for(machine_id, business_id, 100, 1))
+        raise OperationalError("INSERT", {}, Exception("database is down"))
+
+    monkeypatch.setattr(write_behind_module, "insert_bottle_rows_or_reject", enqueue_during_failing_flush)
+    buffer.flush()
+
+    assert len(buffer._rows) == 10
+    assert buffer.metrics()["in_flight"] == 0
+
+
+def test_refused_rows_are_dead_lettered_and_later_rows_flushed(tmp_path, db, fleet):
+    business_id, (machine_id, deleted_id) = fleet
+    buffer = make_buffer(tmp_path)
+    buffer.enqueue(rows_for(deleted_id, business_id, 1, 1) + rows_for(machine_id, business_id, 1, 12))
+
+    # The machine is deleted while its reading waits in the queue
+    db.query(Machine).filter(Machine.id == deleted_id).delete()
+    db.commit()
+
+    assert buffer.flush() == 13
+    assert buffer.dead_lettered == 1
+    assert db.query(Bottle).filter(Bottle.machine_id == machine_id).count() == 12
+    assert buffer.metrics()["queue_depth"] == 0
+
+    lines = (tmp_path / "write_behind.rejected").read_bytes().splitlines(keepends=True)
+    assert [decode_record(line)["machine_id"] for line in lines] == [deleted_id]